@@ -4,14 +4,23 @@
 """
 
 import os
+import re
 import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import List, Dict, Optional
 
+import numpy as np
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables import RunnablePassthrough
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_community.vectorstores import FAISS
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 try:
@@ -29,17 +38,155 @@ except ImportError:
     # Fallback if config not available
     Config = None
 
+from index_store import VersionedIndexStore, BuildLease
+from tracing import QueryTrace
+
+# 数据目录（默认项目根目录下的data，可通过DATA_DIR环境变量指定）
+DATA_DIR = Path(Config.DATA_DIR) if Config else Path(os.environ.get('DATA_DIR') or Path(__file__).parent.parent / "data")
+
+
+def update_knn_graph(
+    file_ids: List[str],
+    vectors: np.ndarray,
+    top_n: int,
+    old_file_ids: Optional[List[str]] = None,
+    old_vectors: Optional[np.ndarray] = None,
+    old_neighbors: Optional[Dict[str, List]] = None
+) -> Dict[str, List]:
+    """
+    计算（或增量更新）论文相似度kNN图
+    
+    只对新增/向量变化的论文以及邻居被删除导致列表不完整的论文重新计算整行相似度，
+    其余论文在原邻居列表基础上合并新论文的相似度，全部相似度计算都是向量化的矩阵乘法。
+    
+    Args:
+        file_ids: 当前论文file_id列表
+        vectors: 对应的归一化论文向量矩阵
+        top_n: 每篇论文保留的相似论文数
+        old_file_ids: 上次构建时的file_id列表
+        old_vectors: 上次构建时的论文向量矩阵
+        old_neighbors: 上次构建的kNN图（file_id -> [[相似论文file_id, 相似度], ...]）
+        
+    Returns:
+        file_id -> [[相似论文file_id, 相似度], ...]，按相似度降序
+    """
+    n = len(file_ids)
+    if n == 0:
+        return {}
+    top_n = min(top_n, n - 1)
+    
+    def top_neighbors(rows: List[int]) -> Dict[str, List]:
+        if not rows or top_n <= 0:
+            return {file_ids[i]: [] for i in rows}
+        scores = vectors[rows] @ vectors.T
+        scores[np.arange(len(rows)), rows] = -np.inf
+        top = np.argpartition(-scores, top_n - 1, axis=1)[:, :top_n]
+        result = {}
+        for row, i in enumerate(rows):
+            order = top[row][np.argsort(-scores[row, top[row]])]
+            result[file_ids[i]] = [[file_ids[j], float(scores[row, j])] for j in order]
+        return result
+    
+    old_pos = {file_id: i for i, file_id in enumerate(old_file_ids or [])}
+    changed = [
+        i for i, file_id in enumerate(file_ids)
+        if file_id not in old_pos
+        or not np.allclose(vectors[i], old_vectors[old_pos[file_id]], atol=1e-6)
+    ] if old_vectors is not None else list(range(n))
+    
+    # 没有旧图或变化过多时全量计算
+    if old_neighbors is None or len(changed) * 2 > n:
+        return top_neighbors(list(range(n)))
+    
+    changed_ids = {file_ids[i] for i in changed}
+    removed_ids = set(old_pos) - set(file_ids)
+    stale_ids = changed_ids | removed_ids
+    
+    recompute = set(changed)
+    merged = {}
+    changed_scores = vectors[changed] @ vectors.T if changed else None
+    
+    for i, file_id in enumerate(file_ids):
+        if i in recompute:
+            continue
+        previous = old_neighbors.get(file_id)
+        if previous is None:
+            recompute.add(i)
+            continue
+        kept = [entry for entry in previous if entry[0] not in stale_ids]
+        # 原列表已满且有邻居失效时，列表外的论文可能补位，需要整行重算
+        if len(kept) < len(previous) and len(previous) >= top_n:
+            recompute.add(i)
+            continue
+        candidates = kept + [
+            [file_ids[j], float(changed_scores[row, i])]
+            for row, j in enumerate(changed) if j != i
+        ]
+        candidates.sort(key=lambda entry: entry[1], reverse=True)
+        merged[file_id] = candidates[:top_n]
+    
+    merged.update(top_neighbors(sorted(recompute)))
+    return merged
+
+
+class LoadedIndex:
+    """一个已加载的向量数据库版本，加载完成后只读，可被多个请求线程共享"""
+    
+    def __init__(self, library_id: Optional[str] = None, version: Optional[str] = None):
+        self.library_id = library_id
+        self.version = version
+        # 向量数据库
+        self.vector_store: Optional[FAISS] = None
+        # 文档元数据
+        self.doc_metadata: Dict[str, Dict] = {}
+        # 预生成的论文摘要（file_id -> 摘要信息）
+        self.paper_summaries: Dict[str, Dict] = {}
+        # 论文级向量索引（file_id列表 + 对应的归一化向量矩阵）
+        self.paper_file_ids: List[str] = []
+        self.paper_vectors: Optional[np.ndarray] = None
+    
+    @property
+    def memory_bytes(self) -> int:
+        """内存占用估算：FAISS向量编码 + 论文级向量"""
+        total = 0
+        if self.vector_store is not None:
+            index = self.vector_store.index
+            total += index.ntotal * getattr(index, 'code_size', index.d * 4)
+        if self.paper_vectors is not None:
+            total += self.paper_vectors.nbytes
+        return total
+
+
+def _current_index_property(name: str) -> property:
+    """代理到当前线程所选向量数据库版本的属性"""
+    def getter(self):
+        return getattr(self.current_index, name)
+    
+    def setter(self, value):
+        setattr(self.current_index, name, value)
+    
+    return property(getter, setter)
+
 
 class PaperRAGSystem:
     """论文RAG检索系统"""
     
+    # 当前线程通过load_vector_store选中的向量数据库版本，不同请求线程互不干扰
+    vector_store = _current_index_property('vector_store')
+    doc_metadata = _current_index_property('doc_metadata')
+    paper_summaries = _current_index_property('paper_summaries')
+    paper_file_ids = _current_index_property('paper_file_ids')
+    paper_vectors = _current_index_property('paper_vectors')
+    
     def __init__(
         self,
         base_url: Optional[str] = None,
         api_key: Optional[str] = None,
         model: Optional[str] = None,
         temperature: Optional[float] = None,
-        vector_store_path: Optional[str] = None
+        vector_store_path: Optional[str] = None,
+        llm_required: bool = True,
+        embeddings: Optional[Embeddings] = None
     ):
         """
         初始化RAG系统
@@ -50,8 +197,13 @@ class PaperRAGSystem:
             model: 模型名称（如果为None，从环境变量或配置读取）
             temperature: 温度参数（如果为None，从环境变量或配置读取）
             vector_store_path: 向量数据库存储路径（None则使用默认路径）
+            llm_required: 是否必须配置全局LLM；为False时缺少配置不报错，查询时需传入llm
+            embeddings: 使用指定的Embeddings（None则加载本地HuggingFace模型）
         """
-        # 从配置或环境变量读取参数
+        # 从配置或环境变量读取参数（API Key与Base URL作为一组，只传入其中一项时使用全局配置的一组，
+        # 不会把全局Key发送到传入的地址）
+        if not (api_key and base_url):
+            api_key = base_url = None
         if Config:
             self.base_url = base_url or Config.OPENAI_BASE_URL or None
             self.api_key = api_key or Config.OPENAI_API_KEY
@@ -65,36 +217,93 @@ class PaperRAGSystem:
             self.temperature = temperature if temperature is not None else float(os.environ.get('OPENAI_TEMPERATURE', '0.7'))
         
         # 验证必需参数
-        if not self.api_key:
+        if llm_required and not self.api_key:
             raise ValueError(
                 "OPENAI_API_KEY 未设置。请设置环境变量 OPENAI_API_KEY 或在配置文件中配置。"
             )
         
         # 验证 base_url（如果未设置，抛出错误而不是使用硬编码值）
-        if not self.base_url:
+        if llm_required and not self.base_url:
             raise ValueError(
                 "OPENAI_BASE_URL 未设置。请设置环境变量 OPENAI_BASE_URL 或在配置文件中配置。"
             )
         
         # 设置向量数据库存储路径
         if vector_store_path is None:
-            # 使用默认路径：项目根目录下的 data/vectorDatabase
-            base_dir = Path(__file__).parent.parent
-            vector_store_path = str(base_dir / "data" / "vectorDatabase")
+            # 使用默认路径：数据目录下的 vectorDatabase
+            vector_store_path = str(DATA_DIR / "vectorDatabase")
         
         self.vector_store_path = Path(vector_store_path)
         self.vector_store_path.mkdir(parents=True, exist_ok=True)
         
-        # 初始化LLM（使用已经处理好的 self 属性）
-        self.llm = ChatOpenAI(
-            model=self.model,
-            base_url=self.base_url,
-            api_key=self.api_key,
-            temperature=self.temperature
+        # 版本化存储：构建写入新版本目录，完成后原子切换，读取方不会看到半写入的索引
+        self.index_store = VersionedIndexStore(
+            self.vector_store_path,
+            keep_versions=getattr(Config, 'RAG_INDEX_KEEP_VERSIONS', 2) if Config else 2
         )
         
+        # 已加载版本的LRU缓存（library_id -> LoadedIndex），版本未变化时无需重新加载
+        self.index_cache_size = getattr(Config, 'RAG_INDEX_CACHE_SIZE', 4) if Config else 4
+        self._index_cache: "OrderedDict[str, LoadedIndex]" = OrderedDict()
+        self._index_cache_lock = threading.Lock()
+        self._local = threading.local()
+        
+        # 运行统计（索引缓存命中/未命中/淘汰、向量化文本数与耗时），供监控指标读取
+        self._stats = {
+            'index_cache_hits': 0,
+            'index_cache_misses': 0,
+            'index_cache_evictions': 0,
+            'embedded_texts': 0,
+            'embedding_seconds': 0.0
+        }
+        self._stats_lock = threading.Lock()
+        
+        # 构建租约：持有者超过租约时长未刷新视为已崩溃；等待其他构建完成的最长时间
+        self.build_lease_seconds = getattr(Config, 'RAG_BUILD_LEASE_SECONDS', 60) if Config else 60
+        self.build_wait_timeout = getattr(Config, 'RAG_BUILD_WAIT_TIMEOUT', 1800) if Config else 1800
+        
+        # 初始化默认LLM（使用已经处理好的 self 属性）
+        # 未配置全局LLM时为None，由调用方按用户传入LLM客户端
+        self.llm: Optional[ChatOpenAI] = None
+        if self.api_key and self.base_url:
+            self.llm = ChatOpenAI(
+                model=self.model,
+                base_url=self.base_url,
+                api_key=self.api_key,
+                temperature=self.temperature
+            )
+        
         # Initialize Embeddings
         # Use local HuggingFace model, supports Chinese and English
+        self.embedding_model_name = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+        if embeddings is not None:
+            # 外部传入的Embeddings（如基准测试使用的哈希向量），跳过本地模型加载
+            self.embeddings = embeddings
+            self.embedding_model_name = getattr(embeddings, 'model_name', type(embeddings).__name__)
+        else:
+            self._init_embeddings()
+        
+        # 初始化文本分割器
+        self.text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=1000,  # 每个chunk的大小
+            chunk_overlap=200,  # chunk之间的重叠
+            length_function=len,
+            separators=["\n\n", "\n", "。", ".", " ", ""]
+        )
+        
+        # 两级检索参数：论文数超过阈值时先选出最相关的论文，再在其中检索文本块
+        self.paper_top_n = getattr(Config, 'RAG_PAPER_TOP_N', 5) if Config else 5
+        self.hierarchical_min_papers = getattr(Config, 'RAG_HIERARCHICAL_MIN_PAPERS', 10) if Config else 10
+        
+        # 相关论文kNN图中每篇论文保留的相似论文数
+        self.related_top_n = getattr(Config, 'RAG_RELATED_TOP_N', 10) if Config else 10
+        
+        # 邻接文本块扩展：命中的文本块向前后各扩展n个相邻块，context_chars为上下文字符预算
+        self.neighbor_window = getattr(Config, 'RAG_NEIGHBOR_CHUNKS', 1) if Config else 1
+        self.context_chars = getattr(Config, 'RAG_CONTEXT_CHARS', 4000) if Config else 4000
+        
+    def _init_embeddings(self):
+        """加载本地HuggingFace Embedding模型，失败时self.embeddings为None"""
         # Model will be saved to vectorDatabase/models directory
         try:
             # Create model cache directory
@@ -105,7 +314,7 @@ class PaperRAGSystem:
             os.environ['SENTENCE_TRANSFORMERS_HOME'] = str(model_cache_dir)
             os.environ['HF_HOME'] = str(model_cache_dir)
             
-            model_name = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+            model_name = self.embedding_model_name
             
             from sentence_transformers import SentenceTransformer
             
@@ -163,20 +372,55 @@ class PaperRAGSystem:
             import traceback
             traceback.print_exc()
             self.embeddings = None
-        
-        # 初始化文本分割器
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,  # 每个chunk的大小
-            chunk_overlap=200,  # chunk之间的重叠
-            length_function=len,
-            separators=["\n\n", "\n", "。", ".", " ", ""]
-        )
-        
-        # 向量数据库
-        self.vector_store: Optional[FAISS] = None
-        
-        # 文档元数据
-        self.doc_metadata: Dict[str, Dict] = {}
+    
+    @property
+    def current_index(self) -> LoadedIndex:
+        """当前线程选中的向量数据库版本"""
+        index = getattr(self._local, 'index', None)
+        if index is None:
+            index = LoadedIndex()
+            self._local.index = index
+        return index
+    
+    def _get_cached_index(self, library_id: str, version: str) -> Optional[LoadedIndex]:
+        """获取已加载且版本一致的向量数据库"""
+        with self._index_cache_lock:
+            index = self._index_cache.get(library_id)
+            if index is None or index.version != version:
+                return None
+            self._index_cache.move_to_end(library_id)
+            return index
+    
+    def _cache_index(self, index: LoadedIndex):
+        """缓存已加载的向量数据库，超出容量时淘汰最久未使用的文库"""
+        with self._index_cache_lock:
+            self._index_cache[index.library_id] = index
+            self._index_cache.move_to_end(index.library_id)
+            while len(self._index_cache) > max(1, self.index_cache_size):
+                self._index_cache.popitem(last=False)
+                self._count('index_cache_evictions')
+    
+    def _count(self, name: str, value=1):
+        with self._stats_lock:
+            self._stats[name] += value
+    
+    def runtime_stats(self) -> Dict:
+        """运行统计：索引缓存命中/未命中/淘汰次数、已缓存文库数与内存占用、向量化文本数与耗时"""
+        with self._index_cache_lock:
+            cached = list(self._index_cache.values())
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['index_cache_entries'] = len(cached)
+        stats['index_memory_bytes'] = {index.library_id: index.memory_bytes for index in cached}
+        return stats
+    
+    @staticmethod
+    def _write_json(path: Path, data, indent: Optional[int] = 2):
+        """写入JSON文件（先写临时文件再替换）"""
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=indent)
+        os.replace(tmp_path, path)
     
     def _extract_filename(self, file_dir: Path) -> str:
         """Extract filename from file directory"""
@@ -226,8 +470,7 @@ class PaperRAGSystem:
         Returns:
             文库列表，每个文库包含id、name、display_name等信息
         """
-        base_dir = Path(__file__).parent.parent
-        libraries_dir = base_dir / "data" / "output" / "libraries"
+        libraries_dir = DATA_DIR / "output" / "libraries"
         
         libraries = []
         
@@ -272,8 +515,7 @@ class PaperRAGSystem:
         Returns:
             论文文档列表
         """
-        base_dir = Path(__file__).parent.parent
-        library_dir = base_dir / "data" / "output" / "libraries" / library_id
+        library_dir = DATA_DIR / "output" / "libraries" / library_id
         
         if not library_dir.exists():
             print(f"⚠️ 文库目录不存在: {library_dir}")
@@ -374,13 +616,25 @@ class PaperRAGSystem:
         print(f"📚 共加载 {len(papers)} 篇论文")
         return papers
     
-    def build_vector_store(self, papers: List[Dict], library_id: str = "default") -> bool:
+    def build_vector_store(
+        self,
+        papers: List[Dict],
+        library_id: str = "default",
+        build_summaries: bool = False,
+        llm: Optional[ChatOpenAI] = None,
+        summary_workers: int = 4,
+        build_lease: Optional[BuildLease] = None
+    ) -> bool:
         """
         构建向量数据库
         
         Args:
             papers: 论文列表
             library_id: 文库ID
+            build_summaries: 是否同时预生成论文摘要（仅内容变化的论文会重新生成）
+            llm: 生成摘要使用的LLM客户端（None则使用默认LLM）
+            summary_workers: 生成摘要时的最大并发LLM调用数
+            build_lease: 构建租约，发布前确认仍持有（见build_library）
             
         Returns:
             是否成功
@@ -393,28 +647,27 @@ class PaperRAGSystem:
             print("⚠️ 没有论文可处理")
             return False
         
-        # Clear existing vector store and metadata before building new one
-        # This ensures we don't mix data from different libraries
-        self.vector_store = None
-        
         # Use local metadata dictionary to avoid being overwritten by concurrent requests
-        # Only update self.doc_metadata after successful save
         local_metadata = {}
         all_documents = []
         
-        # 处理每篇论文
+        # 处理每篇论文（同一论文的文本块在索引中连续存放，chunk_offset记录起始位置）
         for paper in papers:
             content = paper['content']
             file_id = paper['file_id']
             filename = paper['filename']
             library_name = paper.get('library_name', library_id)
             
+            if file_id in local_metadata:
+                print(f"⚠️ 重复的file_id，跳过: {filename} (file_id: {file_id})")
+                continue
+            
             # 分割文本
             chunks = self.text_splitter.split_text(content)
+            chunk_offset = len(all_documents)
             
             # 创建文档对象
             for i, chunk in enumerate(chunks):
-                from langchain_core.documents import Document
                 doc = Document(
                     page_content=chunk,
                     metadata={
@@ -433,31 +686,79 @@ class PaperRAGSystem:
                 'filename': filename,
                 'library_id': library_id,
                 'library_name': library_name,
-                'chunk_count': len(chunks)
+                'chunk_count': len(chunks),
+                'chunk_offset': chunk_offset,
+                'content_hash': self._content_hash(content)
             }
         
         print(f"📝 共生成 {len(all_documents)} 个文本块")
         
+        # 增量数据（摘要、论文向量、相关论文图）都以构建开始时已发布的版本为基准
+        previous_version = self.index_store.current_version(library_id)
+        
+        # 写入新的版本目录，全部完成后再发布；失败时旧版本不受影响
+        version, staging_dir = self.index_store.create_staging(library_id)
+        index = LoadedIndex(library_id=library_id, version=version)
+        
         # 构建向量数据库
         try:
             print("🔄 正在构建向量数据库...")
             # Create vector store in local variable first
+            embed_start = time.perf_counter()
             vector_store = FAISS.from_documents(all_documents, self.embeddings)
+            self._count('embedding_seconds', time.perf_counter() - embed_start)
+            self._count('embedded_texts', len(all_documents))
+            vector_store.save_local(str(staging_dir / "faiss"))
+            self._write_json(staging_dir / "metadata.json", local_metadata)
+            
+            index.vector_store = vector_store
+            index.doc_metadata = local_metadata
+            # 后续步骤在当前线程中使用正在构建的版本，其他线程仍使用旧版本
+            self._local.index = index
+            
+            # 可选：预生成论文摘要，失败不影响向量数据库
+            self.paper_summaries = self._load_summaries(library_id, previous_version)
+            if build_summaries:
+                try:
+                    self.paper_summaries = self.build_paper_summaries(
+                        papers, library_id=library_id, llm=llm, max_workers=summary_workers
+                    )
+                except Exception as e:
+                    print(f"⚠️ 生成论文摘要失败: {str(e)}")
+            self._write_json(staging_dir / "summaries.json", self.paper_summaries)
             
-            # 保存向量数据库
-            store_path = self.vector_store_path / f"{library_id}_faiss"
-            vector_store.save_local(str(store_path))
-            print(f"✅ 向量数据库已保存到: {store_path}")
+            # 论文级向量索引与相关论文kNN图，失败时查询回退到单级检索
+            try:
+                old_file_ids, old_vectors = self._read_paper_vectors(library_id, previous_version)
+                self.paper_file_ids, self.paper_vectors = self._build_paper_vectors(vector_store, local_metadata)
+                np.savez(
+                    staging_dir / "papers.npz",
+                    file_ids=np.array(self.paper_file_ids),
+                    vectors=self.paper_vectors
+                )
+                graph = self.build_related_graph(library_id, old_file_ids, old_vectors, previous_version)
+                self._write_json(
+                    staging_dir / "related.json",
+                    {'top_n': self.related_top_n, 'neighbors': graph},
+                    indent=None
+                )
+            except Exception as e:
+                print(f"⚠️ 构建论文级向量失败: {str(e)}")
+                self.paper_file_ids, self.paper_vectors = [], None
             
-            # 保存元数据（使用局部变量，避免被并发请求覆盖）
-            metadata_path = self.vector_store_path / f"{library_id}_metadata.json"
-            with open(metadata_path, 'w', encoding='utf-8') as f:
-                json.dump(local_metadata, f, ensure_ascii=False, indent=2)
+            if build_lease is not None and not build_lease.renew():
+                raise RuntimeError("构建租约已丢失，放弃发布")
             
-            # Only update instance variables after successful save
-            # This ensures data consistency
-            self.vector_store = vector_store
-            self.doc_metadata = local_metadata
+            # 原子发布新版本
+            version_dir = self.index_store.publish(library_id, version, staging_dir, manifest={
+                'paper_count': len(local_metadata),
+                'chunk_count': len(all_documents),
+                'embedding_model': self.embedding_model_name,
+                'embedding_dim': int(vector_store.index.d),
+                'created_at': time.time()
+            })
+            self._cache_index(index)
+            print(f"✅ 向量数据库已发布: {version_dir}")
             
             return True
             
@@ -465,7 +766,584 @@ class PaperRAGSystem:
             print(f"❌ 构建向量数据库失败: {str(e)}")
             import traceback
             traceback.print_exc()
+            self.index_store.discard(staging_dir)
+            self._local.index = None
+            return False
+    
+    def build_library(
+        self,
+        library_id: str,
+        build_summaries: bool = False,
+        llm: Optional[ChatOpenAI] = None,
+        summary_workers: int = 4
+    ) -> Dict:
+        """
+        在构建租约保护下构建文库的向量数据库
+        
+        同一文库已有构建在进行时（本进程或共享存储上的其他副本），不重复构建，
+        而是等待其完成并使用其发布的版本；持有者崩溃导致租约过期时由当前请求接管构建
+        
+        Args:
+            library_id: 文库ID
+            build_summaries: 是否同时预生成论文摘要
+            llm: 生成摘要使用的LLM客户端
+            summary_workers: 生成摘要时的最大并发LLM调用数
+            
+        Returns:
+            {'success', 'attached', 'paper_count', 'version', 'error'}
+        """
+        start_version = self.index_store.current_version(library_id)
+        
+        for _ in range(2):
+            lease = self.index_store.try_acquire_build(library_id, lease_seconds=self.build_lease_seconds)
+            if lease is not None:
+                break
+            
+            owner = (self.index_store.build_status(library_id, self.build_lease_seconds) or {}).get('owner') or '未知进程'
+            print(f"⏳ 文库 {library_id} 正在构建中（{owner}），等待其完成")
+            if not self.index_store.wait_for_build(library_id, timeout=self.build_wait_timeout,
+                                                   lease_seconds=self.build_lease_seconds):
+                return {'success': False, 'attached': True, 'error': 'wait_timeout'}
+            
+            version = self.index_store.current_version(library_id)
+            if version != start_version:
+                exists, paper_count = self.check_vector_store_exists(library_id)
+                return {'success': exists, 'attached': True, 'paper_count': paper_count, 'version': version}
+            # 对方构建失败或中断，由当前请求重新尝试
+        else:
+            return {'success': False, 'attached': True, 'error': 'build_failed'}
+        
+        with lease:
+            papers = self.load_papers_from_library(library_id=library_id)
+            if not papers:
+                return {'success': False, 'attached': False, 'error': 'no_papers'}
+            
+            success = self.build_vector_store(
+                papers,
+                library_id=library_id,
+                build_summaries=build_summaries,
+                llm=llm,
+                summary_workers=summary_workers,
+                build_lease=lease
+            )
+            return {
+                'success': success,
+                'attached': False,
+                'paper_count': len(papers),
+                'version': self.index_store.current_version(library_id),
+                'error': None if success else 'build_failed'
+            }
+    
+    @staticmethod
+    def _content_hash(content: str) -> str:
+        """计算论文内容哈希，用于判断摘要是否需要重新生成"""
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+    
+    def _load_summaries(self, library_id: str, version: Optional[str] = None) -> Dict[str, Dict]:
+        """加载已生成的论文摘要（与 metadata.json 位于同一版本目录）"""
+        if not version:
+            return {}
+        summaries_path = self.index_store.artifact_path(library_id, 'summaries.json', version)
+        if not summaries_path.exists():
+            return {}
+        try:
+            with open(summaries_path, 'r', encoding='utf-8') as f:
+                summaries = json.load(f)
+            return summaries if isinstance(summaries, dict) else {}
+        except Exception as e:
+            print(f"⚠️ 读取论文摘要失败: {str(e)}")
+            return {}
+    
+    def _split_for_summary(self, content: str, max_parts: int = 12) -> List[str]:
+        """将论文切分为用于map阶段的大段落，段落数不超过max_parts"""
+        part_size = max(6000, -(-len(content) // max_parts))
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=part_size,
+            chunk_overlap=0,
+            length_function=len,
+            separators=["\n\n", "\n", "。", ".", " ", ""]
+        )
+        return splitter.split_text(content)[:max_parts]
+    
+    def build_paper_summaries(
+        self,
+        papers: List[Dict],
+        library_id: str = "default",
+        llm: Optional[ChatOpenAI] = None,
+        max_workers: int = 4
+    ) -> Dict[str, Dict]:
+        """
+        以map-reduce方式为每篇论文生成摘要，内容哈希未变化的论文直接复用已有摘要
+        （结果由调用方写入版本目录）
+        
+        Args:
+            papers: 论文列表
+            library_id: 文库ID
+            llm: 使用的LLM客户端（None则使用默认LLM）
+            max_workers: 最大并发LLM调用数
+            
+        Returns:
+            file_id -> 摘要信息
+        """
+        llm = llm or self.llm
+        if llm is None:
+            raise ValueError("LLM未配置，无法生成论文摘要")
+        
+        # 以当前线程已加载的摘要为基准（构建时为上一版本的摘要）
+        existing = self.paper_summaries
+        summaries: Dict[str, Dict] = {}
+        pending = []
+        
+        for paper in papers:
+            file_id = paper['file_id']
+            content_hash = self._content_hash(paper['content'])
+            cached = existing.get(file_id)
+            if cached and cached.get('content_hash') == content_hash and cached.get('summary'):
+                summaries[file_id] = cached
+            else:
+                pending.append((paper, content_hash))
+        
+        print(f"📝 论文摘要: 复用 {len(summaries)} 篇，需生成 {len(pending)} 篇")
+        
+        if pending:
+            map_prompt = ChatPromptTemplate.from_messages([
+                ("system", "你是一个世界级论文专家。"),
+                ("user", "以下是论文《{filename}》的一部分内容，请用中文简要概括其要点（研究问题、方法、实验、结论中出现的部分）：\n\n{text}")
+            ])
+            reduce_prompt = ChatPromptTemplate.from_messages([
+                ("system", "你是一个世界级论文专家。"),
+                ("user", "以下是论文《{filename}》各部分的要点，请整合为一份完整的中文总结，包括研究问题、核心方法、主要贡献和结论：\n\n{text}")
+            ])
+            map_chain = map_prompt | llm | StrOutputParser()
+            reduce_chain = reduce_prompt | llm | StrOutputParser()
+            
+            with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+                # map阶段：所有论文的分段摘要共享同一个有界线程池
+                map_futures = []
+                for paper, _ in pending:
+                    parts = self._split_for_summary(paper['content'])
+                    if len(parts) == 1:
+                        # 短论文直接生成最终摘要
+                        map_futures.append([executor.submit(
+                            reduce_chain.invoke, {'filename': paper['filename'], 'text': parts[0]}
+                        )])
+                    else:
+                        map_futures.append([
+                            executor.submit(map_chain.invoke, {'filename': paper['filename'], 'text': part})
+                            for part in parts
+                        ])
+                
+                # reduce阶段：合并分段要点
+                reduce_futures = []
+                for (paper, _), futures in zip(pending, map_futures):
+                    try:
+                        partials = [future.result() for future in futures]
+                    except Exception as e:
+                        print(f"⚠️ 生成摘要失败: {paper['filename']}, 错误: {str(e)}")
+                        reduce_futures.append(None)
+                        continue
+                    if len(partials) == 1:
+                        reduce_futures.append(partials[0])
+                    else:
+                        reduce_futures.append(executor.submit(
+                            reduce_chain.invoke,
+                            {'filename': paper['filename'], 'text': "\n\n---\n\n".join(partials)}
+                        ))
+                
+                for (paper, content_hash), future in zip(pending, reduce_futures):
+                    if future is None:
+                        continue
+                    try:
+                        summary = future if isinstance(future, str) else future.result()
+                    except Exception as e:
+                        print(f"⚠️ 生成摘要失败: {paper['filename']}, 错误: {str(e)}")
+                        continue
+                    summaries[paper['file_id']] = {
+                        'filename': paper['filename'],
+                        'content_hash': content_hash,
+                        'summary': summary,
+                        'model': getattr(llm, 'model_name', None),
+                        'generated_at': time.time()
+                    }
+                    print(f"✅ 生成摘要: {paper['filename']}")
+        
+        return summaries
+    
+    def get_paper_summary(self, file_id: str) -> Optional[Dict]:
+        """获取与当前向量数据库内容一致的论文摘要（内容已变化的摘要视为过期）"""
+        summary = self.paper_summaries.get(file_id)
+        metadata = self.doc_metadata.get(file_id)
+        if not summary or not metadata:
+            return None
+        if metadata.get('content_hash') and summary.get('content_hash') != metadata['content_hash']:
+            return None
+        return summary
+    
+    # 整库总结时摘要上下文的最大字符数
+    SUMMARY_CONTEXT_MAX_CHARS = 24000
+    
+    # 总结整篇论文（或整个文库）的问法，需整句匹配：只包含“摘要”“contribution”等词的具体问题
+    # （如“摘要部分提到的数据集是什么”）仍走常规检索
+    SUMMARY_INTENT_PATTERN = re.compile(
+        r'(?:请|请你|帮我|麻烦)?(?:简要|简单)?(?:总结|概括|概述)(?:一下)?'
+        r'(?:这篇|本篇|该|这些|所有|全部|各篇)?(?:论文|文章|文献|文档)?(?:的)?(?:主要内容|内容|核心贡献|主要贡献)?'
+        r'|(?:这篇|本篇|该|这些|各篇)?(?:论文|文章|文献)(?:的)?(?:主要内容|主要贡献|核心贡献|摘要)(?:是什么|有哪些|有什么)?'
+        r'|(?:这篇|本篇|该|这些)?(?:论文|文章|文献)(?:主要)?(?:讲了|讲的是|说了)(?:什么|些什么|哪些)'
+        r'|(?:please )?(?:summari[sz]e|give (?:me )?an? (?:summary|overview) of|tl;?dr(?: of)?)'
+        r'(?: (?:this|the|these|all|all the|each))?(?: (?:paper|papers|article|articles|document|documents|library))?'
+        r'|what (?:is|are) (?:this|the|these) (?:paper|papers)(?:\'s)? (?:main |key )?(?:contributions?|about)'
+        r'|tl;?dr',
+        re.IGNORECASE
+    )
+    _SUMMARY_QUESTION_STRIP = re.compile(r'[\s，,。.？?！!：:]+')
+    
+    @classmethod
+    def is_summary_question(cls, question: str) -> bool:
+        """判断问题是否为总结整篇论文/整个文库的问题（去掉空白和标点后整句匹配）"""
+        normalized = cls._SUMMARY_QUESTION_STRIP.sub(' ', (question or '').lower()).strip()
+        # 中文问法不含空格，英文问法保留单词间的单个空格
+        return bool(cls.SUMMARY_INTENT_PATTERN.fullmatch(normalized)
+                    or cls.SUMMARY_INTENT_PATTERN.fullmatch(normalized.replace(' ', '')))
+    
+    def _summary_source(self, file_id: str, summary: Dict) -> Dict:
+        """将摘要转换为来源信息"""
+        metadata = self.doc_metadata.get(file_id, {})
+        return {
+            'filename': summary.get('filename') or metadata.get('filename', '未知文档'),
+            'library_name': metadata.get('library_name', ''),
+            'file_id': file_id,
+            'chunk_index': 0,
+            'source_type': 'summary',
+            'content_preview': summary['summary'][:200] + "..."
+        }
+    
+    def _answer_from_summaries(self, question: str, file_id: Optional[str], llm: Optional[ChatOpenAI], trace: QueryTrace) -> Optional[Dict]:
+        """
+        使用预生成摘要回答总结类问题
+        
+        以论文摘要（单篇）或各论文摘要（整个文档库）作为精简上下文，连同原问题调用LLM。
+        没有可用摘要时返回None，由调用方回退到常规检索。
+        """
+        llm = llm or self.llm
+        if file_id:
+            summary = self.get_paper_summary(file_id)
+            if llm is None or not summary:
+                return None
+            context = f"[来源论文: {summary['filename']}, 论文摘要]\n{summary['summary']}"
+            prompt = ChatPromptTemplate.from_messages([
+                ("system", "你是一个世界级论文专家。"),
+                ("user", "请基于以下论文摘要回答用户的问题。\n\n论文摘要：\n{context}\n\n问题：{question}\n\n请提供详细、准确的回答：")
+            ])
+            trace.set('chunks', 0)
+            answer = self._generate(prompt, llm, {'context': context, 'question': question}, trace)
+            return {
+                'answer': answer,
+                'sources': [self._summary_source(file_id, summary)],
+                'paper_count': 1,
+                'query_scope': 'single_paper',
+                'answer_type': 'summary'
+            }
+        
+        available = {
+            fid: summary for fid in self.doc_metadata
+            if (summary := self.get_paper_summary(fid))
+        }
+        # 只有全部论文都有摘要时才使用摘要上下文，避免遗漏论文
+        if llm is None or not available or len(available) < len(self.doc_metadata):
+            return None
+        
+        context = "\n\n---\n\n".join(
+            f"[来源论文: {summary['filename']}, 论文摘要]\n{summary['summary']}"
+            for summary in available.values()
+        )
+        # 摘要总量超出上下文预算时回退到常规检索
+        if len(context) > self.SUMMARY_CONTEXT_MAX_CHARS:
+            return None
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", "你是一个世界级论文专家。"),
+            ("user", "请基于以下各论文的摘要回答用户的问题。\n\n论文摘要：\n{context}\n\n问题：{question}\n\n请提供详细、准确的回答：")
+        ])
+        trace.set('chunks', 0)
+        answer = self._generate(prompt, llm, {'context': context, 'question': question}, trace)
+        return {
+            'answer': answer,
+            'sources': [self._summary_source(fid, summary) for fid, summary in available.items()],
+            'paper_count': len(available),
+            'query_scope': 'all_papers',
+            'answer_type': 'summary'
+        }
+    
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        """按行L2归一化"""
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+    
+    def _build_paper_vectors(self, vector_store: FAISS, metadata: Dict[str, Dict]):
+        """
+        计算论文级向量：有预生成摘要的论文使用摘要向量，否则使用文本块向量的质心
+        
+        Returns:
+            (file_id列表, 归一化向量矩阵)
+        """
+        chunk_vectors = vector_store.index.reconstruct_n(0, vector_store.index.ntotal)
+        
+        file_ids = []
+        rows = []
+        for file_id, info in metadata.items():
+            offset, count = info.get('chunk_offset'), info.get('chunk_count', 0)
+            if offset is None or count == 0:
+                continue
+            file_ids.append(file_id)
+            rows.append(chunk_vectors[offset:offset + count].mean(axis=0))
+        
+        if not rows:
+            return [], None
+        vectors = np.vstack(rows).astype(np.float32)
+        
+        # 摘要向量更能代表整篇论文
+        summary_ids = [
+            (row, file_id) for row, file_id in enumerate(file_ids)
+            if self.paper_summaries.get(file_id, {}).get('content_hash') == metadata[file_id].get('content_hash')
+            and self.paper_summaries[file_id].get('summary')
+        ]
+        if summary_ids:
+            summary_vectors = self.embeddings.embed_documents(
+                [self.paper_summaries[file_id]['summary'] for _, file_id in summary_ids]
+            )
+            for (row, _), vector in zip(summary_ids, summary_vectors):
+                vectors[row] = vector
+        
+        return file_ids, self._normalize(vectors)
+    
+    def _read_paper_vectors(self, library_id: str, version: Optional[str] = None):
+        """读取指定版本的论文级向量，不存在时返回 ([], None)"""
+        if not version:
+            return [], None
+        paper_vectors_path = self.index_store.artifact_path(library_id, 'papers.npz', version)
+        if not paper_vectors_path.exists():
+            return [], None
+        try:
+            with np.load(paper_vectors_path) as data:
+                return [str(file_id) for file_id in data['file_ids']], data['vectors']
+        except Exception as e:
+            print(f"⚠️ 读取论文级向量失败: {str(e)}")
+            return [], None
+    
+    def _load_paper_vectors(self, library_id: str, version: str):
+        """加载论文级向量，与当前元数据不一致时视为不可用"""
+        self.paper_file_ids, self.paper_vectors = [], None
+        file_ids, vectors = self._read_paper_vectors(library_id, version)
+        if vectors is not None and all(file_id in self.doc_metadata for file_id in file_ids):
+            self.paper_file_ids, self.paper_vectors = file_ids, vectors
+    
+    def build_related_graph(
+        self,
+        library_id: str,
+        old_file_ids: Optional[List[str]] = None,
+        old_vectors: Optional[np.ndarray] = None,
+        old_version: Optional[str] = None
+    ) -> Dict[str, List[Dict]]:
+        """
+        基于当前论文级向量构建相关论文kNN图，已有图时增量更新（结果由调用方写入版本目录）
+        
+        Args:
+            library_id: 文库ID
+            old_file_ids: 上次构建时的file_id列表
+            old_vectors: 上次构建时的论文向量矩阵
+            old_version: 上次构建的版本号
+            
+        Returns:
+            file_id -> 相关论文列表
+        """
+        old_neighbors = None
+        graph_path = self.index_store.artifact_path(library_id, 'related.json', old_version) if old_version else None
+        if graph_path and graph_path.exists() and old_vectors is not None:
+            try:
+                with open(graph_path, 'r', encoding='utf-8') as f:
+                    old_graph = json.load(f)
+                if old_graph.get('top_n') == self.related_top_n:
+                    old_neighbors = {
+                        file_id: [[item['file_id'], item['score']] for item in items]
+                        for file_id, items in old_graph.get('neighbors', {}).items()
+                    }
+            except Exception as e:
+                print(f"⚠️ 读取相关论文图失败，将全量重建: {str(e)}")
+        
+        neighbors = update_knn_graph(
+            self.paper_file_ids,
+            self.paper_vectors,
+            self.related_top_n,
+            old_file_ids=old_file_ids,
+            old_vectors=old_vectors,
+            old_neighbors=old_neighbors
+        )
+        
+        graph = {
+            file_id: [
+                {
+                    'file_id': neighbor_id,
+                    'filename': self.doc_metadata.get(neighbor_id, {}).get('filename', '未知文档'),
+                    'score': round(score, 4)
+                }
+                for neighbor_id, score in items
+            ]
+            for file_id, items in neighbors.items()
+        }
+        
+        print(f"✅ 相关论文图已更新: {len(graph)} 篇论文")
+        return graph
+    
+    def _has_chunk_offsets(self) -> bool:
+        """向量数据库是否按论文连续存放文本块（旧版本构建的索引没有chunk_offset）"""
+        if not self.vector_store or not self.doc_metadata:
             return False
+        total = 0
+        for info in self.doc_metadata.values():
+            if info.get('chunk_offset') is None:
+                return False
+            total += info.get('chunk_count', 0)
+        return total == self.vector_store.index.ntotal
+    
+    def _embed_query(self, question: str) -> np.ndarray:
+        """计算问题向量"""
+        start = time.perf_counter()
+        vector = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        self._count('embedding_seconds', time.perf_counter() - start)
+        self._count('embedded_texts')
+        return vector
+    
+    def _doc_at(self, position: int):
+        """根据索引位置取出文档"""
+        docstore_id = self.vector_store.index_to_docstore_id[position]
+        return self.vector_store.docstore.search(docstore_id)
+    
+    def select_papers(self, query_vector: np.ndarray, top_n: int) -> List[str]:
+        """第一级检索：按论文级向量选出最相关的top_n篇论文"""
+        scores = self.paper_vectors @ query_vector
+        top_n = min(top_n, len(scores))
+        top = np.argpartition(-scores, top_n - 1)[:top_n]
+        top = top[np.argsort(-scores[top])]
+        return [self.paper_file_ids[i] for i in top]
+    
+    def search_in_papers(self, query_vector: np.ndarray, file_ids: List[str], k: int) -> List:
+        """
+        第二级检索：只在指定论文的文本块中做精确检索
+        
+        文本块按论文连续存放，直接按偏移量取出向量，计算量只与所选论文的文本块数相关
+        """
+        index = self.vector_store.index
+        blocks = []
+        positions = []
+        for file_id in file_ids:
+            info = self.doc_metadata.get(file_id) or {}
+            offset, count = info.get('chunk_offset'), info.get('chunk_count', 0)
+            if offset is None or count == 0:
+                continue
+            blocks.append(index.reconstruct_n(offset, count))
+            positions.append(np.arange(offset, offset + count))
+        
+        if not blocks:
+            return []
+        
+        positions = np.concatenate(positions)
+        # 向量已归一化，内积排序与L2距离排序一致
+        scores = np.vstack(blocks) @ query_vector
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [self._doc_at(int(positions[i])) for i in top]
+    
+    @staticmethod
+    def _merge_chunk_texts(texts: List[str], max_overlap: int = 400) -> str:
+        """拼接相邻文本块，去掉切分时产生的重叠部分"""
+        merged = texts[0]
+        for text in texts[1:]:
+            overlap = 0
+            for size in range(min(len(merged), len(text), max_overlap), 19, -1):
+                if merged.endswith(text[:size]):
+                    overlap = size
+                    break
+            merged += text[overlap:] if overlap else "\n" + text
+        return merged
+    
+    def expand_neighbors(self, docs: List, window: int, max_chars: int) -> List:
+        """
+        将命中的文本块扩展为包含前后相邻块的连续段落
+        
+        文本块按论文连续存放，相邻块直接按偏移量取出，无需额外的向量检索。
+        先按命中排名加入所有命中块，再按距离由近及远加入各命中块的相邻块，
+        放不下的块跳过、继续尝试更短的块，直到字符预算用完（排名第一的命中块始终保留），
+        同一论文中相连的块合并为一个段落。
+        
+        Args:
+            docs: 检索到的文本块（按相关性排序）
+            window: 向前后各扩展的块数
+            max_chars: 上下文字符预算
+            
+        Returns:
+            合并后的段落列表，按最相关命中块的排名排序
+        """
+        selected = {}  # 索引位置 -> (文档, 命中排名)
+        used = 0
+        
+        def try_add(position, chunk, rank):
+            nonlocal used
+            size = len(chunk.page_content)
+            if selected and used + size > max_chars:
+                return False
+            selected[position] = (chunk, rank)
+            used += size
+            return True
+        
+        # 第一轮：命中块
+        hits = []  # (命中位置, 论文起始偏移, 论文块数, 命中排名)
+        for rank, doc in enumerate(docs):
+            info = self.doc_metadata.get(doc.metadata.get('file_id')) or {}
+            offset, count = info.get('chunk_offset'), info.get('chunk_count', 0)
+            if offset is None:
+                continue
+            center = offset + doc.metadata.get('chunk_index', 0)
+            if center in selected:
+                continue
+            if try_add(center, doc, rank):
+                hits.append((center, offset, count, rank))
+        
+        # 第二轮：按距离由近及远，依命中排名交替加入前后相邻块
+        for distance in range(1, window + 1):
+            if used >= max_chars:
+                break
+            for center, offset, count, rank in hits:
+                for position in (center - distance, center + distance):
+                    if position < offset or position >= offset + count or position in selected:
+                        continue
+                    try_add(position, self._doc_at(position), rank)
+        
+        if not selected:
+            return docs
+        
+        # 合并同一论文中位置相连的块
+        passages = []
+        run = []
+        for position in sorted(selected):
+            chunk, rank = selected[position]
+            if run and (position != run[-1][0] + 1
+                        or chunk.metadata.get('file_id') != run[-1][1].metadata.get('file_id')):
+                passages.append(run)
+                run = []
+            run.append((position, chunk, rank))
+        passages.append(run)
+        
+        merged = []
+        for run in sorted(passages, key=lambda items: min(rank for _, _, rank in items)):
+            first, last = run[0][1], run[-1][1]
+            metadata = dict(first.metadata)
+            metadata['chunk_end'] = last.metadata.get('chunk_index', 0)
+            merged.append(Document(
+                page_content=self._merge_chunk_texts([chunk.page_content for _, chunk, _ in run]),
+                metadata=metadata
+            ))
+        return merged
     
     def check_vector_store_exists(self, library_id: str = "default") -> tuple[bool, int]:
         """
@@ -477,13 +1355,17 @@ class PaperRAGSystem:
         Returns:
             (是否存在, 论文数量)
         """
-        store_path = self.vector_store_path / f"{library_id}_faiss"
-        
-        if not store_path.exists():
+        version = self.index_store.current_version(library_id)
+        if not version:
             return False, 0
         
+        # 已加载的版本直接使用内存中的元数据
+        index = self._get_cached_index(library_id, version)
+        if index is not None:
+            return True, len(index.doc_metadata)
+        
         # Check metadata file to get paper count
-        metadata_path = self.vector_store_path / f"{library_id}_metadata.json"
+        metadata_path = self.index_store.artifact_path(library_id, 'metadata.json', version)
         if metadata_path.exists():
             try:
                 with open(metadata_path, 'r', encoding='utf-8') as f:
@@ -497,7 +1379,9 @@ class PaperRAGSystem:
     
     def load_vector_store(self, library_id: str = "default") -> bool:
         """
-        加载已存在的向量数据库
+        加载已存在的向量数据库（当前发布版本），并设为当前线程使用的版本
+        
+        版本未变化时直接复用内存中的索引；构建发布新版本后，下一次加载自动切换
         
         Args:
             library_id: 文库ID
@@ -509,17 +1393,28 @@ class PaperRAGSystem:
             print("❌ Embeddings未初始化，无法加载向量数据库")
             return False
         
-        store_path = self.vector_store_path / f"{library_id}_faiss"
+        version = self.index_store.current_version(library_id)
+        if not version:
+            print(f"⚠️ 向量数据库不存在: {library_id}")
+            return False
+        
+        index = self._get_cached_index(library_id, version)
+        if index is not None:
+            self._count('index_cache_hits')
+            self._local.index = index
+            return True
+        self._count('index_cache_misses')
         
+        # 所有文件都从同一个版本目录读取，旧版本在保留期内不会被删除
+        store_path = self.index_store.artifact_path(library_id, 'faiss', version)
         if not store_path.exists():
             print(f"⚠️ 向量数据库不存在: {store_path}")
             return False
         
         try:
             print(f"🔄 正在加载向量数据库: {store_path}")
-            # Clear existing vector store and metadata before loading new one
-            self.vector_store = None
-            self.doc_metadata = {}
+            index = LoadedIndex(library_id=library_id, version=version)
+            self._local.index = index
             
             self.vector_store = FAISS.load_local(
                 str(store_path),
@@ -528,27 +1423,71 @@ class PaperRAGSystem:
             )
             
             # 加载元数据
-            metadata_path = self.vector_store_path / f"{library_id}_metadata.json"
+            metadata_path = self.index_store.artifact_path(library_id, 'metadata.json', version)
             if metadata_path.exists():
                 with open(metadata_path, 'r', encoding='utf-8') as f:
                     self.doc_metadata = json.load(f)
             
-            print(f"✅ 向量数据库加载成功，包含 {len(self.doc_metadata)} 篇论文")
+            # 加载预生成的论文摘要
+            self.paper_summaries = self._load_summaries(library_id, version)
+            
+            # 加载论文级向量
+            self._load_paper_vectors(library_id, version)
+            
+            self._cache_index(index)
+            print(f"✅ 向量数据库加载成功（版本 {version}），包含 {len(self.doc_metadata)} 篇论文")
             return True
             
         except Exception as e:
             print(f"❌ 加载向量数据库失败: {str(e)}")
             import traceback
             traceback.print_exc()
+            self._local.index = None
             return False
     
-    def create_rag_chain(self, k: int = 4, file_id: Optional[str] = None):
+    @staticmethod
+    def _rag_prompt() -> ChatPromptTemplate:
+        """RAG问答提示词模板"""
+        template = """你是一个世界级论文专家，擅长分析和回答学术论文相关的问题。
+
+请基于以下上下文信息回答用户的问题。如果上下文中没有相关信息，请说明你无法从提供的文档中找到答案。
+
+上下文信息：
+{context}
+
+问题：{question}
+
+请提供详细、准确的回答："""
+        
+        return ChatPromptTemplate.from_messages([
+            ("system", "你是一个世界级论文专家。"),
+            ("user", template)
+        ])
+    
+    @staticmethod
+    def _format_docs(docs) -> str:
+        """格式化检索到的文档"""
+        formatted = []
+        for doc in docs:
+            filename = doc.metadata.get('filename', '未知文档')
+            library_name = doc.metadata.get('library_name', '')
+            chunk_index = doc.metadata.get('chunk_index', 0)
+            chunk_end = doc.metadata.get('chunk_end', chunk_index)
+            chunk_label = f"{chunk_index+1}-{chunk_end+1}" if chunk_end > chunk_index else f"{chunk_index+1}"
+            if library_name:
+                formatted.append(f"[来源: {library_name} - {filename}, 片段: {chunk_label}]\n{doc.page_content}")
+            else:
+                formatted.append(f"[来源论文: {filename}, 片段: {chunk_label}]\n{doc.page_content}")
+        return "\n\n---\n\n".join(formatted)
+    
+    def create_rag_chain(self, k: int = 4, file_id: Optional[str] = None, llm: Optional[ChatOpenAI] = None):
         """
         创建RAG检索链
         
         Args:
             k: 检索的文档数量
             file_id: 如果指定，只检索该文件的内容（None表示检索所有论文）
+            llm: 使用的LLM客户端（None则使用默认LLM）
             
         Returns:
             RAG链
@@ -556,6 +1495,10 @@ class PaperRAGSystem:
         if not self.vector_store:
             raise ValueError("向量数据库未初始化，请先构建或加载向量数据库")
         
+        llm = llm or self.llm
+        if llm is None:
+            raise ValueError("LLM未配置，请设置 OPENAI_API_KEY 和 OPENAI_BASE_URL 或在用户配置中填写")
+        
         # 定义检索器
         # 注意：FAISS不支持metadata过滤，所以我们需要在检索后过滤
         # 如果指定了file_id，需要检索更多文档然后过滤
@@ -564,22 +1507,7 @@ class PaperRAGSystem:
             search_kwargs={"k": search_k}
         )
         
-        # 定义提示词模板
-        template = """你是一个世界级论文专家，擅长分析和回答学术论文相关的问题。
-
-请基于以下上下文信息回答用户的问题。如果上下文中没有相关信息，请说明你无法从提供的文档中找到答案。
-
-上下文信息：
-{context}
-
-问题：{question}
-
-请提供详细、准确的回答："""
-        
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", "你是一个世界级论文专家。"),
-            ("user", template)
-        ])
+        prompt = self._rag_prompt()
         
         # 构建RAG链
         def filter_docs(docs):
@@ -589,29 +1517,16 @@ class PaperRAGSystem:
                 return filtered[:k] if filtered else []
             return docs[:k]
         
-        def format_docs(docs):
-            """格式化检索到的文档"""
-            formatted = []
-            for doc in docs:
-                filename = doc.metadata.get('filename', '未知文档')
-                library_name = doc.metadata.get('library_name', '')
-                chunk_index = doc.metadata.get('chunk_index', 0)
-                if library_name:
-                    formatted.append(f"[来源: {library_name} - {filename}, 片段: {chunk_index+1}]\n{doc.page_content}")
-                else:
-                    formatted.append(f"[来源论文: {filename}, 片段: {chunk_index+1}]\n{doc.page_content}")
-            return "\n\n---\n\n".join(formatted)
-        
         rag_chain = (
-            {"context": retriever | filter_docs | format_docs, "question": RunnablePassthrough()}
+            {"context": retriever | filter_docs | self._format_docs, "question": RunnablePassthrough()}
             | prompt
-            | self.llm
+            | llm
             | StrOutputParser()
         )
         
         return rag_chain
     
-    def query(self, question: str, k: int = 4, file_id: Optional[str] = None) -> str:
+    def query(self, question: str, k: int = 4, file_id: Optional[str] = None, llm: Optional[ChatOpenAI] = None) -> str:
         """
         查询RAG系统
         
@@ -619,6 +1534,7 @@ class PaperRAGSystem:
             question: 问题
             k: 检索的文档数量
             file_id: 如果指定，只查询该文件的内容（None表示查询整个数据库）
+            llm: 使用的LLM客户端（None则使用默认LLM）
             
         Returns:
             回答
@@ -627,13 +1543,91 @@ class PaperRAGSystem:
             return "❌ 向量数据库未初始化，请先构建或加载向量数据库"
         
         try:
-            rag_chain = self.create_rag_chain(k=k, file_id=file_id)
+            rag_chain = self.create_rag_chain(k=k, file_id=file_id, llm=llm)
             response = rag_chain.invoke(question)
             return response
         except Exception as e:
             return f"❌ 查询失败: {str(e)}"
     
-    def query_with_sources(self, question: str, k: int = 4, file_id: Optional[str] = None) -> Dict:
+    def _generate(self, prompt: ChatPromptTemplate, llm: ChatOpenAI, inputs: Dict, trace: QueryTrace) -> str:
+        """渲染prompt并调用LLM，分别计时并记录token用量"""
+        with trace.stage('prompt'):
+            prompt_value = prompt.invoke(inputs)
+        trace.set('prompt_chars', sum(len(str(m.content)) for m in prompt_value.to_messages()))
+        with trace.stage('llm'):
+            message = llm.invoke(prompt_value)
+        trace.record_usage(message)
+        return StrOutputParser().invoke(message)
+    
+    def _similarity_search(self, question: str, k: int, trace: QueryTrace) -> List:
+        """全库向量检索，问题向量化与FAISS检索分别计时"""
+        with trace.stage('embed_query'):
+            query_vector = self._embed_query(question)
+        with trace.stage('search'):
+            return self.vector_store.similarity_search_by_vector(query_vector.tolist(), k=k)
+    
+    def retrieve(self, question: str, k: int = 4, file_id: Optional[str] = None, trace: Optional[QueryTrace] = None) -> List:
+        """
+        检索问题相关的文本段落（不调用LLM），供问答和查询日志回放使用
+        
+        Args:
+            question: 问题
+            k: 检索的文本块数量
+            file_id: 如果指定，只在该论文中检索
+            trace: 分阶段计时（None则不记录）
+            
+        Returns:
+            文本块（开启邻接扩展时为扩展后的段落）列表，指定论文中无匹配时为空
+        """
+        trace = trace or QueryTrace()
+        chunk_offsets = self._has_chunk_offsets()
+        
+        if file_id and chunk_offsets:
+            # 文本块按论文连续存放，直接在该论文范围内精确检索
+            with trace.stage('embed_query'):
+                query_vector = self._embed_query(question)
+            with trace.stage('search'):
+                docs = self.search_in_papers(query_vector, [file_id], k)
+        elif file_id:
+            # FAISS不支持metadata过滤，检索更多文档然后过滤
+            search_k = max(k * 20, 100)
+            all_docs = self._similarity_search(question, search_k, trace)
+            docs = [doc for doc in all_docs if doc.metadata.get('file_id') == file_id]
+            
+            if len(docs) < k:
+                search_k = max(search_k * 2, 200)
+                all_docs = self._similarity_search(question, search_k, trace)
+                docs = [doc for doc in all_docs if doc.metadata.get('file_id') == file_id]
+            
+            docs = docs[:k]
+        elif (chunk_offsets and self.paper_vectors is not None
+              and len(self.paper_file_ids) > self.hierarchical_min_papers):
+            # 两级检索：先选出最相关的论文，再只在这些论文中检索文本块
+            with trace.stage('embed_query'):
+                query_vector = self._embed_query(question)
+            with trace.stage('select_papers'):
+                selected_papers = self.select_papers(query_vector, self.paper_top_n)
+            with trace.stage('search'):
+                docs = self.search_in_papers(query_vector, selected_papers, k)
+        else:
+            docs = self._similarity_search(question, k, trace)
+        trace.set('chunks', len(docs))
+        
+        # 将命中块扩展为包含相邻块的连续段落
+        if self.neighbor_window > 0 and chunk_offsets:
+            with trace.stage('expand_neighbors'):
+                docs = self.expand_neighbors(docs, self.neighbor_window, self.context_chars)
+            trace.set('passages', len(docs))
+        return docs
+    
+    def query_with_sources(
+        self,
+        question: str,
+        k: int = 4,
+        file_id: Optional[str] = None,
+        llm: Optional[ChatOpenAI] = None,
+        trace: Optional[QueryTrace] = None
+    ) -> Dict:
         """
         查询RAG系统并返回来源信息
         
@@ -641,10 +1635,19 @@ class PaperRAGSystem:
             question: 问题
             k: 检索的文档数量
             file_id: 如果指定，只查询该文件的内容（None表示查询整个数据库）
+            llm: 使用的LLM客户端（None则使用默认LLM，用于按用户配置的LLM）
+            trace: 分阶段计时（None则新建），结果的timings字段为其导出
             
         Returns:
             包含回答和来源的字典
         """
+        trace = trace or QueryTrace()
+        result = self._query_with_sources(question, k, file_id, llm, trace)
+        result['timings'] = trace.to_dict()
+        return result
+    
+    def _query_with_sources(self, question: str, k: int, file_id: Optional[str], llm: Optional[ChatOpenAI], trace: QueryTrace) -> Dict:
+        """query_with_sources的实现，各阶段记录到trace"""
         if not self.vector_store:
             return {
                 'answer': "❌ 向量数据库未初始化，请先构建或加载向量数据库",
@@ -653,44 +1656,38 @@ class PaperRAGSystem:
         
         try:
             # 如果指定了file_id，验证是否存在
-            if file_id:
-                if file_id not in self.doc_metadata:
-                    return {
-                        'answer': f"❌ 错误: 指定的论文 (file_id: {file_id}) 不在向量数据库中",
-                        'sources': [],
-                        'paper_count': 0,
-                        'query_scope': 'single_paper',
-                        'error': 'file_not_found'
-                    }
-                
-                # FAISS不支持metadata过滤，检索更多文档然后过滤
-                search_k = max(k * 20, 100)
-                retriever = self.vector_store.as_retriever(search_kwargs={"k": search_k})
-                all_docs = retriever.invoke(question)
-                docs = [doc for doc in all_docs if doc.metadata.get('file_id') == file_id]
-                
-                if len(docs) < k:
-                    search_k = max(search_k * 2, 200)
-                    retriever = self.vector_store.as_retriever(search_kwargs={"k": search_k})
-                    all_docs = retriever.invoke(question)
-                    docs = [doc for doc in all_docs if doc.metadata.get('file_id') == file_id]
-                
-                if not docs:
-                    return {
-                        'answer': f"❌ 无法从指定论文中找到相关内容。请尝试：\n1. 检查问题是否与论文内容相关\n2. 尝试使用更具体的关键词\n3. 确保论文已正确加载到向量数据库",
-                        'sources': [],
-                        'paper_count': 0,
-                        'query_scope': 'single_paper',
-                        'error': 'no_matching_content'
-                    }
-                docs = docs[:k]
-            else:
-                retriever = self.vector_store.as_retriever(search_kwargs={"k": k})
-                docs = retriever.invoke(question)
+            if file_id and file_id not in self.doc_metadata:
+                return {
+                    'answer': f"❌ 错误: 指定的论文 (file_id: {file_id}) 不在向量数据库中",
+                    'sources': [],
+                    'paper_count': 0,
+                    'query_scope': 'single_paper',
+                    'error': 'file_not_found'
+                }
+            
+            # 总结类问题优先使用预生成的论文摘要
+            if self.is_summary_question(question):
+                summary_result = self._answer_from_summaries(question, file_id, llm, trace)
+                if summary_result:
+                    return summary_result
+            
+            docs = self.retrieve(question, k, file_id, trace)
+            if file_id and not docs:
+                return {
+                    'answer': f"❌ 无法从指定论文中找到相关内容。请尝试：\n1. 检查问题是否与论文内容相关\n2. 尝试使用更具体的关键词\n3. 确保论文已正确加载到向量数据库",
+                    'sources': [],
+                    'paper_count': 0,
+                    'query_scope': 'single_paper',
+                    'error': 'no_matching_content'
+                }
             
-            # 获取回答
-            rag_chain = self.create_rag_chain(k=k, file_id=file_id)
-            answer = rag_chain.invoke(question)
+            # 基于已检索的文档获取回答，不再重复检索
+            llm = llm or self.llm
+            if llm is None:
+                raise ValueError("LLM未配置，请设置 OPENAI_API_KEY 和 OPENAI_BASE_URL 或在用户配置中填写")
+            with trace.stage('prompt'):
+                context = self._format_docs(docs)
+            answer = self._generate(self._rag_prompt(), llm, {'context': context, 'question': question}, trace)
             
             # 整理来源信息
             sources = []
@@ -705,6 +1702,7 @@ class PaperRAGSystem:
                     'library_name': doc.metadata.get('library_name', ''),
                     'file_id': paper_file_id,
                     'chunk_index': doc.metadata.get('chunk_index', 0),
+                    'chunk_end': doc.metadata.get('chunk_end', doc.metadata.get('chunk_index', 0)),
                     'content_preview': doc.page_content[:200] + "..."
                 })
             
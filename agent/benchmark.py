@@ -0,0 +1,337 @@
+"""
+检索性能基准测试
+在合成文库或 data/output/libraries 中的真实文库上测量 PaperRAGSystem 的构建、加载与检索性能，
+并对比不同FAISS索引/压缩配置的索引大小、查询延迟和 recall@k（以精确检索为基准）
+
+用法:
+    python agent/benchmark.py --synthetic 200x20 --embeddings hash
+    python agent/benchmark.py --library library_d8fd90da --output results.jsonl
+    python agent/benchmark.py --synthetic 1000x30 --configs "Flat;HNSW32|efSearch=64;IVF256,PQ16|nprobe=16"
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import platform
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import faiss
+from langchain_core.embeddings import Embeddings
+
+sys.path.insert(0, str(Path(__file__).parent))
+from RAG import PaperRAGSystem
+
+
+DEFAULT_CONFIGS = "Flat;HNSW32|efSearch=64;IVF{nlist},Flat|nprobe=8;IVF{nlist},PQ{pq}|nprobe=8;SQ8"
+
+
+class HashEmbeddings(Embeddings):
+    """基于特征哈希的词袋向量，无需加载模型，适合快速测量索引与检索开销"""
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+        self.model_name = f"hash-{dim}"
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in text.lower().split():
+            digest = hashlib.md5(token.encode('utf-8')).digest()
+            bucket = int.from_bytes(digest[:4], 'little') % self.dim
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm > 0 else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+def generate_synthetic_papers(paper_count: int, chunks_per_paper: int, seed: int = 0) -> List[Dict]:
+    """
+    生成合成文库：每篇论文有自己的主题词，段落约900字符，切分后每段约对应一个文本块
+    """
+    rng = random.Random(seed)
+    vocabulary = [f"w{i}" for i in range(5000)]
+    papers = []
+    for p in range(paper_count):
+        topic = rng.sample(vocabulary, 40)
+        paragraphs = []
+        for _ in range(chunks_per_paper):
+            words = []
+            while sum(len(w) + 1 for w in words) < 900:
+                words.append(rng.choice(topic) if rng.random() < 0.4 else rng.choice(vocabulary))
+            paragraphs.append(" ".join(words))
+        papers.append({
+            'file_id': f"synthetic_{p:06d}",
+            'filename': f"synthetic_{p:06d}.pdf",
+            'library_name': 'synthetic',
+            'content': "\n\n".join(paragraphs)
+        })
+    return papers
+
+
+def sample_queries(rag: PaperRAGSystem, count: int, seed: int = 0) -> List[str]:
+    """从文本块中截取短句作为查询"""
+    rng = random.Random(seed)
+    docstore = rag.vector_store.docstore
+    ids = list(rag.vector_store.index_to_docstore_id.values())
+    queries = []
+    for _ in range(count):
+        words = docstore.search(rng.choice(ids)).page_content.split()
+        start = rng.randrange(max(len(words) - 12, 1))
+        queries.append(" ".join(words[start:start + 12]))
+    return queries
+
+
+def percentiles(samples_ms: List[float]) -> Dict:
+    """延迟统计（毫秒）"""
+    samples = np.asarray(samples_ms)
+    return {
+        'p50_ms': round(float(np.percentile(samples, 50)), 4),
+        'p99_ms': round(float(np.percentile(samples, 99)), 4),
+        'mean_ms': round(float(samples.mean()), 4)
+    }
+
+
+def recall_at_k(results: List[List[int]], truth: List[List[int]]) -> float:
+    """与精确检索结果的平均重合比例"""
+    hits = [len(set(r) & set(t)) / max(len(t), 1) for r, t in zip(results, truth)]
+    return round(float(np.mean(hits)), 4)
+
+
+def dir_size(path: Path) -> int:
+    return sum(p.stat().st_size for p in path.rglob('*') if p.is_file())
+
+
+def bench_pipeline(rag: PaperRAGSystem, papers: List[Dict], library_id: str, query_count: int, k: int, seed: int = 0) -> Tuple[Dict, np.ndarray, np.ndarray]:
+    """
+    测量 PaperRAGSystem 端到端的构建、加载和检索
+
+    Returns:
+        (结果, 文本块向量矩阵, 查询向量矩阵)
+    """
+    result = {}
+
+    start = time.perf_counter()
+    if not rag.build_vector_store(papers, library_id=library_id):
+        raise RuntimeError("构建向量数据库失败")
+    result['build_s'] = round(time.perf_counter() - start, 4)
+
+    version = rag.index_store.current_version(library_id)
+    result['index_bytes'] = dir_size(rag.index_store.version_dir(library_id, version))
+    result['chunk_count'] = rag.vector_store.index.ntotal
+    result['paper_count'] = len(rag.doc_metadata)
+
+    # 冷加载：清空内存缓存后从磁盘读取；热加载：命中版本缓存
+    rag._index_cache.clear()
+    start = time.perf_counter()
+    rag.load_vector_store(library_id)
+    result['load_cold_s'] = round(time.perf_counter() - start, 4)
+    start = time.perf_counter()
+    rag.load_vector_store(library_id)
+    result['load_warm_s'] = round(time.perf_counter() - start, 6)
+
+    queries = sample_queries(rag, query_count, seed=seed)
+    start = time.perf_counter()
+    query_vectors = np.vstack([rag._embed_query(q) for q in queries])
+    result['embed_query_ms'] = round((time.perf_counter() - start) * 1000 / len(queries), 4)
+
+    index = rag.vector_store.index
+    chunk_vectors = index.reconstruct_n(0, index.ntotal)
+    _, exact = index.search(query_vectors, k)
+    truth = [list(row) for row in exact]
+    # docstore返回同一对象，按对象标识反查索引位置
+    positions = {id(rag._doc_at(pos)): pos for pos in range(index.ntotal)}
+
+    # 单级检索（与 /rag 接口的默认检索路径一致）
+    latencies = []
+    for vector in query_vectors:
+        start = time.perf_counter()
+        rag.vector_store.similarity_search_by_vector(vector.tolist(), k=k)
+        latencies.append((time.perf_counter() - start) * 1000)
+    result['flat_search'] = percentiles(latencies)
+
+    # 两级检索：先选论文再在论文内精确检索，recall相对全库精确检索
+    if rag.paper_vectors is not None:
+        latencies, found = [], []
+        for vector in query_vectors:
+            start = time.perf_counter()
+            file_ids = rag.select_papers(vector, rag.paper_top_n)
+            docs = rag.search_in_papers(vector, file_ids, k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            found.append([positions[id(doc)] for doc in docs if id(doc) in positions])
+        result['hierarchical_search'] = percentiles(latencies)
+        result['hierarchical_search']['recall_at_k'] = recall_at_k(found, truth)
+
+    return result, chunk_vectors, query_vectors
+
+
+def parse_config(spec: str, ntotal: int) -> Tuple[str, Dict[str, int]]:
+    """解析 "IVF{nlist},PQ{pq}|nprobe=8" 形式的配置，占位符按数据规模填充"""
+    factory, _, params = spec.partition('|')
+    # 每个聚类中心至少39个训练点（FAISS的建议下限）
+    nlist = max(1, min(4096, int(np.sqrt(ntotal)), ntotal // 39))
+    factory = factory.strip().format(nlist=nlist, pq=16)
+    search_params = {}
+    for item in filter(None, params.split(',')):
+        name, _, value = item.partition('=')
+        search_params[name.strip()] = int(value)
+    return factory, search_params
+
+
+def bench_index_config(spec: str, chunk_vectors: np.ndarray, query_vectors: np.ndarray, k: int, truth: List[List[int]]) -> Dict:
+    """测量单个FAISS索引配置的训练/构建时间、大小、加载时间、查询延迟和recall@k"""
+    factory, search_params = parse_config(spec, len(chunk_vectors))
+    result = {'config': spec, 'factory': factory, 'search_params': search_params}
+    dim = chunk_vectors.shape[1]
+
+    index = faiss.index_factory(dim, factory, faiss.METRIC_L2)
+    start = time.perf_counter()
+    if not index.is_trained:
+        index.train(chunk_vectors)
+    result['train_s'] = round(time.perf_counter() - start, 4)
+    start = time.perf_counter()
+    index.add(chunk_vectors)
+    result['add_s'] = round(time.perf_counter() - start, 4)
+
+    parameter_space = faiss.ParameterSpace()
+    for name, value in search_params.items():
+        parameter_space.set_index_parameter(index, name, value)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        index_path = os.path.join(tmp_dir, "index.faiss")
+        faiss.write_index(index, index_path)
+        result['index_bytes'] = os.path.getsize(index_path)
+        start = time.perf_counter()
+        loaded = faiss.read_index(index_path)
+        result['load_s'] = round(time.perf_counter() - start, 4)
+    for name, value in search_params.items():
+        parameter_space.set_index_parameter(loaded, name, value)
+
+    latencies, found = [], []
+    for vector in query_vectors:
+        start = time.perf_counter()
+        _, ids = loaded.search(vector.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found.append([int(i) for i in ids[0] if i >= 0])
+    result.update(percentiles(latencies))
+    result['recall_at_k'] = recall_at_k(found, truth)
+    return result
+
+
+def print_table(report: Dict):
+    """打印可读的结果表"""
+    pipeline = report['pipeline']
+    print(f"\n📊 端到端: {pipeline['paper_count']} 篇论文 / {pipeline['chunk_count']} 个文本块")
+    print(f"   构建 {pipeline['build_s']}s，索引 {pipeline['index_bytes'] / 1024 / 1024:.2f} MB，"
+          f"冷加载 {pipeline['load_cold_s']}s，热加载 {pipeline['load_warm_s']}s，查询向量 {pipeline['embed_query_ms']}ms")
+    for name in ('flat_search', 'hierarchical_search'):
+        if name in pipeline:
+            print(f"   {name}: {pipeline[name]}")
+
+    print(f"\n{'config':<32}{'train_s':>9}{'add_s':>9}{'MB':>9}{'load_s':>9}{'p50_ms':>10}{'p99_ms':>10}{'recall':>8}")
+    for row in report['indexes']:
+        if 'error' in row:
+            print(f"{row['config']:<32}  ❌ {row['error']}")
+            continue
+        print(f"{row['config']:<32}{row['train_s']:>9}{row['add_s']:>9}{row['index_bytes'] / 1024 / 1024:>9.2f}"
+              f"{row['load_s']:>9}{row['p50_ms']:>10}{row['p99_ms']:>10}{row['recall_at_k']:>8}")
+
+
+def write_report(report: Dict, output: str):
+    """保存结果：.jsonl 追加一行便于跟踪历史，其他后缀覆盖写入JSON"""
+    path = Path(output)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.suffix == '.jsonl':
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(report, ensure_ascii=False) + "\n")
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n✅ 结果已保存到: {path}")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="PaperRAGSystem 检索性能基准测试")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--synthetic', default='100x20', help="合成文库规模，格式 论文数x每篇文本块数")
+    source.add_argument('--library', help="使用 data/output/libraries 下的真实文库ID")
+    parser.add_argument('--embeddings', choices=['hash', 'model'], default='hash',
+                        help="hash: 特征哈希向量（快速）；model: 本地HuggingFace模型（与线上一致）")
+    parser.add_argument('--configs', default=DEFAULT_CONFIGS,
+                        help="以分号分隔的FAISS index_factory配置，'|'后为查询参数，如 IVF{nlist},Flat|nprobe=8")
+    parser.add_argument('--queries', type=int, default=200, help="查询数")
+    parser.add_argument('--k', type=int, default=4, help="每次查询返回的文本块数")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="结果文件（.json 覆盖写入，.jsonl 追加）")
+    args = parser.parse_args(argv)
+
+    embeddings = HashEmbeddings() if args.embeddings == 'hash' else None
+
+    with tempfile.TemporaryDirectory() as store_dir:
+        # 使用临时目录，避免影响线上向量数据库
+        rag = PaperRAGSystem(vector_store_path=store_dir, llm_required=False, embeddings=embeddings)
+        if not rag.embeddings:
+            print("❌ Embeddings初始化失败")
+            return 1
+
+        if args.library:
+            papers = rag.load_papers_from_library(library_id=args.library)
+            dataset = {'type': 'library', 'library_id': args.library}
+        else:
+            paper_count, chunks_per_paper = (int(x) for x in args.synthetic.lower().split('x'))
+            papers = generate_synthetic_papers(paper_count, chunks_per_paper, seed=args.seed)
+            dataset = {'type': 'synthetic', 'papers': paper_count, 'chunks_per_paper': chunks_per_paper}
+        if not papers:
+            print("❌ 没有可用的论文")
+            return 1
+
+        pipeline, chunk_vectors, query_vectors = bench_pipeline(
+            rag, papers, "benchmark", args.queries, args.k, seed=args.seed
+        )
+
+    exact = faiss.IndexFlatL2(chunk_vectors.shape[1])
+    exact.add(chunk_vectors)
+    truth = [list(row) for row in exact.search(query_vectors, args.k)[1]]
+
+    indexes = []
+    for spec in filter(None, (s.strip() for s in args.configs.split(';'))):
+        try:
+            indexes.append(bench_index_config(spec, chunk_vectors, query_vectors, args.k, truth))
+        except Exception as e:
+            indexes.append({'config': spec, 'error': str(e)})
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'machine': {
+            'host': platform.node(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'faiss': getattr(faiss, '__version__', 'unknown'),
+            'cpu_count': os.cpu_count()
+        },
+        'dataset': dataset,
+        'embeddings': rag.embedding_model_name,
+        'k': args.k,
+        'query_count': len(query_vectors),
+        'pipeline': pipeline,
+        'indexes': indexes
+    }
+
+    print_table(report)
+    if args.output:
+        write_report(report, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
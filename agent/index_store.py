@@ -0,0 +1,509 @@
+"""
+版本化的向量数据库存储
+每次构建写入独立的版本目录，完成后通过原子替换CURRENT指针发布，读取方始终看到完整的版本
+
+目录结构:
+    {vector_store_path}/{library_id}_index/
+        CURRENT                 # 当前版本号
+        BUILD.lock              # 构建租约（多副本共享存储时协调构建）
+        versions/{version}/     # faiss/、metadata.json、summaries.json、papers.npz、related.json、manifest.json
+        staging/{version}/      # 构建中的版本
+
+用法:
+    python agent/index_store.py selfcheck    # 在临时目录上检查发布、旧版本清理和构建租约
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import socket
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+
+# 锁文件中没有租约时长（内容无法读取）时使用的租约时长（秒）
+DEFAULT_BUILD_LEASE_SECONDS = 60
+
+# 旧版（未版本化）布局中各文件的命名方式
+LEGACY_ARTIFACTS = {
+    'faiss': "{library_id}_faiss",
+    'metadata.json': "{library_id}_metadata.json",
+    'summaries.json': "{library_id}_summaries.json",
+    'papers.npz': "{library_id}_papers.npz",
+    'related.json': "{library_id}_related.json",
+}
+
+
+class BuildLease:
+    """
+    文库构建租约（基于共享存储上的锁文件）
+
+    持有期间后台线程定期刷新锁文件的修改时间；持有者崩溃后租约过期，其他进程可以接管
+    """
+
+    def __init__(self, lock_path: Path, token: str, lease_seconds: float):
+        self.lock_path = lock_path
+        self.token = token
+        self.lease_seconds = lease_seconds
+        self.lost = False
+        self._stop = threading.Event()
+        self._heartbeat = threading.Thread(target=self._renew_loop, daemon=True)
+        self._heartbeat.start()
+
+    def _owned(self) -> bool:
+        lock = _read_lock_file(self.lock_path)
+        return bool(lock) and lock.get('token') == self.token
+
+    def _renew_loop(self):
+        while not self._stop.wait(max(self.lease_seconds / 3, 0.1)):
+            if not self.renew():
+                print(f"⚠️ 构建租约已丢失: {self.lock_path}")
+                return
+
+    def renew(self) -> bool:
+        """刷新租约，返回是否仍持有"""
+        try:
+            if self._owned():
+                os.utime(self.lock_path)
+                return True
+        except OSError:
+            pass
+        self.lost = True
+        return False
+
+    def release(self):
+        """释放租约（仅删除自己持有的锁文件）"""
+        self._stop.set()
+        try:
+            if self._owned():
+                os.remove(self.lock_path)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+def _read_lock_file(lock_path: Path) -> Optional[Dict]:
+    """
+    读取锁文件内容，附带心跳时间（修改时间），不存在时返回None
+
+    内容为空或无法解析的锁文件（如旧版本写入途中崩溃留下的）仍视为一个锁，
+    返回 {'token': None, 'owner': '', 'unreadable': True, 'heartbeat_at': 修改时间}，按修改时间判断是否过期
+    """
+    try:
+        heartbeat_at = lock_path.stat().st_mtime
+        with open(lock_path, 'r', encoding='utf-8') as f:
+            lock = json.load(f)
+        if not isinstance(lock, dict):
+            raise ValueError('锁文件格式无效')
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        try:
+            heartbeat_at = lock_path.stat().st_mtime
+        except FileNotFoundError:
+            return None
+        lock = {'token': None, 'owner': '', 'unreadable': True}
+    lock['heartbeat_at'] = heartbeat_at
+    return lock
+
+
+def _create_lock_file(lock_path: Path, tmp_path: Path):
+    """
+    用已写好的临时文件原子地创建锁文件（硬链接，锁文件一出现就是完整内容）
+
+    Raises:
+        FileExistsError: 锁文件已存在
+    """
+    try:
+        os.link(tmp_path, lock_path)
+    except FileExistsError:
+        raise
+    except OSError:
+        # 不支持硬链接的文件系统：退回到独占创建后写入（写入期间的空锁文件按修改时间判断过期）
+        fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        with os.fdopen(fd, 'wb') as f, open(tmp_path, 'rb') as src:
+            f.write(src.read())
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class VersionedIndexStore:
+    """按版本目录存储向量数据库，通过CURRENT指针原子切换"""
+
+    def __init__(self, base_path: Path, keep_versions: int = 2, staging_ttl: float = 3600):
+        """
+        初始化存储
+
+        Args:
+            base_path: 向量数据库根目录
+            keep_versions: 保留的历史版本数（含当前版本）
+            staging_ttl: 未完成的构建目录超过该时间（秒）后视为失败并清理
+        """
+        self.base_path = Path(base_path)
+        self.keep_versions = max(1, keep_versions)
+        self.staging_ttl = staging_ttl
+
+    def library_dir(self, library_id: str) -> Path:
+        """文库的版本化存储目录"""
+        return self.base_path / f"{library_id}_index"
+
+    def _pointer_path(self, library_id: str) -> Path:
+        return self.library_dir(library_id) / "CURRENT"
+
+    def _build_lock_path(self, library_id: str) -> Path:
+        return self.library_dir(library_id) / "BUILD.lock"
+
+    def _legacy_path(self, library_id: str, name: str) -> Path:
+        return self.base_path / LEGACY_ARTIFACTS[name].format(library_id=library_id)
+
+    def current_version(self, library_id: str) -> Optional[str]:
+        """
+        当前发布的版本号
+
+        旧版布局返回基于索引文件修改时间的版本号，不存在时返回None
+        """
+        try:
+            version = self._pointer_path(library_id).read_text(encoding='utf-8').strip()
+            if version:
+                return version
+        except FileNotFoundError:
+            pass
+
+        legacy_index = self._legacy_path(library_id, 'faiss') / "index.faiss"
+        try:
+            return f"legacy-{legacy_index.stat().st_mtime_ns}"
+        except FileNotFoundError:
+            return None
+
+    def version_dir(self, library_id: str, version: str) -> Path:
+        """指定版本的目录"""
+        return self.library_dir(library_id) / "versions" / version
+
+    def artifact_path(self, library_id: str, name: str, version: Optional[str] = None) -> Path:
+        """
+        获取文件路径
+
+        Args:
+            library_id: 文库ID
+            name: 文件名（faiss、metadata.json、summaries.json、papers.npz、related.json）
+            version: 版本号，None表示当前版本
+
+        Returns:
+            文件路径（旧版布局返回旧文件名）
+        """
+        version = version or self.current_version(library_id)
+        if version and not version.startswith("legacy-"):
+            return self.version_dir(library_id, version) / name
+        return self._legacy_path(library_id, name)
+
+    def create_staging(self, library_id: str) -> Tuple[str, Path]:
+        """创建构建目录，返回 (版本号, 目录)"""
+        version = f"{int(time.time() * 1000):013d}-{uuid.uuid4().hex[:8]}"
+        staging_dir = self.library_dir(library_id) / "staging" / version
+        staging_dir.mkdir(parents=True, exist_ok=True)
+        return version, staging_dir
+
+    @staticmethod
+    def _checksum(path: Path) -> str:
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                sha256.update(block)
+        return sha256.hexdigest()
+
+    def publish(self, library_id: str, version: str, staging_dir: Path, manifest: Optional[Dict] = None) -> Path:
+        """
+        发布构建完成的版本：写入manifest，移动到versions目录，再原子替换CURRENT指针
+
+        Returns:
+            发布后的版本目录
+        """
+        manifest = dict(manifest or {})
+        manifest.update({
+            'version': version,
+            'library_id': library_id,
+            'published_at': time.time(),
+            'files': {
+                str(path.relative_to(staging_dir)).replace(os.sep, '/'): self._checksum(path)
+                for path in sorted(staging_dir.rglob('*')) if path.is_file()
+            }
+        })
+        with open(staging_dir / "manifest.json", 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+        target_dir = self.version_dir(library_id, version)
+        target_dir.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(staging_dir, target_dir)
+
+        pointer_path = self._pointer_path(library_id)
+        tmp_pointer = pointer_path.with_name(f"CURRENT.{version}.tmp")
+        with open(tmp_pointer, 'w', encoding='utf-8') as f:
+            f.write(version)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_pointer, pointer_path)
+
+        self.collect_garbage(library_id)
+        return target_dir
+
+    def discard(self, staging_dir: Path):
+        """丢弃失败的构建目录"""
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def read_manifest(self, library_id: str, version: Optional[str] = None) -> Optional[Dict]:
+        """读取版本的manifest，旧版布局返回None"""
+        version = version or self.current_version(library_id)
+        if not version or version.startswith("legacy-"):
+            return None
+        try:
+            with open(self.version_dir(library_id, version) / "manifest.json", 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def collect_garbage(self, library_id: str):
+        """删除超出保留数量的旧版本、超时的构建目录，以及已被版本化构建取代的旧版布局文件（当前版本始终保留）"""
+        library_dir = self.library_dir(library_id)
+        current = self.current_version(library_id)
+
+        # 已发布过版本化构建时，旧版布局的索引文件不会再被读取
+        if current and not current.startswith("legacy-"):
+            for name in LEGACY_ARTIFACTS:
+                legacy_path = self._legacy_path(library_id, name)
+                try:
+                    if legacy_path.is_dir():
+                        shutil.rmtree(legacy_path)
+                    elif legacy_path.exists():
+                        legacy_path.unlink()
+                    else:
+                        continue
+                    print(f"🧹 已删除旧版索引文件: {legacy_path.name}")
+                except OSError as e:
+                    print(f"⚠️ 删除旧版索引文件失败 ({legacy_path.name}): {str(e)}")
+
+        versions_dir = library_dir / "versions"
+        if versions_dir.exists():
+            versions = sorted((d.name for d in versions_dir.iterdir() if d.is_dir()), reverse=True)
+            for version in versions[self.keep_versions:]:
+                if version != current:
+                    shutil.rmtree(versions_dir / version, ignore_errors=True)
+
+        staging_root = library_dir / "staging"
+        if staging_root.exists():
+            now = time.time()
+            for staging_dir in staging_root.iterdir():
+                try:
+                    if now - staging_dir.stat().st_mtime > self.staging_ttl:
+                        shutil.rmtree(staging_dir, ignore_errors=True)
+                except FileNotFoundError:
+                    continue
+
+        # 获取租约时崩溃留下的临时锁文件
+        if library_dir.exists():
+            now = time.time()
+            for leftover in library_dir.glob("BUILD.lock.*"):
+                try:
+                    if now - leftover.stat().st_mtime > self.staging_ttl:
+                        leftover.unlink()
+                except FileNotFoundError:
+                    continue
+
+    def build_status(self, library_id: str, lease_seconds: float = DEFAULT_BUILD_LEASE_SECONDS) -> Optional[Dict]:
+        """
+        正在进行的构建信息（owner、started_at、heartbeat_at），没有或租约已过期时返回None
+
+        Args:
+            lease_seconds: 锁文件内容无法读取时使用的租约时长（此时owner为空、unreadable为True）
+        """
+        lock = _read_lock_file(self._build_lock_path(library_id))
+        if not lock:
+            return None
+        if time.time() - lock['heartbeat_at'] > (lock.get('lease_seconds') or lease_seconds):
+            return None
+        return lock
+
+    def try_acquire_build(self, library_id: str, lease_seconds: float = 60) -> Optional[BuildLease]:
+        """
+        尝试获取文库的构建租约
+
+        Args:
+            library_id: 文库ID
+            lease_seconds: 租约时长（秒），持有者超过该时间未刷新视为已崩溃
+
+        Returns:
+            获取成功返回BuildLease，已有其他构建在进行时返回None
+        """
+        lock_path = self._build_lock_path(library_id)
+        lock_path.parent.mkdir(parents=True, exist_ok=True)
+        token = uuid.uuid4().hex
+        content = json.dumps({
+            'token': token,
+            'owner': f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}",
+            'started_at': time.time(),
+            'lease_seconds': lease_seconds
+        }, ensure_ascii=False)
+
+        # 先写完整的临时文件，再以硬链接原子地创建锁文件，其他进程不会读到空锁
+        tmp_path = lock_path.with_name(f"BUILD.lock.{token}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+
+        try:
+            for _ in range(2):
+                try:
+                    _create_lock_file(lock_path, tmp_path)
+                except FileExistsError:
+                    # 已过期的租约（包括内容无法读取、按修改时间已过期的锁）：先原子改名再核对，避免误删刚被其他进程接管的新锁
+                    stale = _read_lock_file(lock_path)
+                    if stale and self.build_status(library_id, lease_seconds) is None:
+                        stale_path = lock_path.with_name(f"BUILD.lock.stale-{token}")
+                        try:
+                            os.rename(lock_path, stale_path)
+                        except FileNotFoundError:
+                            continue
+                        moved = _read_lock_file(stale_path)
+                        if moved and (moved.get('token') != stale.get('token')
+                                      or moved['heartbeat_at'] != stale['heartbeat_at']):
+                            # 改名的是其他进程刚创建的锁，尝试放回
+                            try:
+                                os.link(stale_path, lock_path)
+                            except OSError:
+                                pass
+                        try:
+                            os.remove(stale_path)
+                        except FileNotFoundError:
+                            pass
+                        continue
+                    return None
+                return BuildLease(lock_path, token, lease_seconds)
+            return None
+        finally:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+
+    def wait_for_build(self, library_id: str, timeout: Optional[float] = None, poll_interval: float = 1.0,
+                       lease_seconds: float = DEFAULT_BUILD_LEASE_SECONDS) -> bool:
+        """
+        等待正在进行的构建结束（完成、失败或租约过期）
+
+        Returns:
+            是否在超时前结束
+        """
+        deadline = time.time() + timeout if timeout else None
+        while self.build_status(library_id, lease_seconds) is not None:
+            if deadline and time.time() >= deadline:
+                return False
+            time.sleep(poll_interval)
+        return True
+
+
+def selfcheck() -> List[str]:
+    """
+    在临时目录上检查版本发布、旧版本清理和构建租约
+
+    Returns:
+        未通过的检查项（为空表示全部通过）
+    """
+    import tempfile
+
+    failures = []
+
+    def check(name: str, condition: bool):
+        print(f"   {'✅' if condition else '❌'} {name}")
+        if not condition:
+            failures.append(name)
+
+    tmp_dir = Path(tempfile.mkdtemp(prefix='index_store_check_'))
+    try:
+        store = VersionedIndexStore(tmp_dir, keep_versions=2, staging_ttl=0.5)
+        library_id = 'lib'
+        check("未构建时没有当前版本", store.current_version(library_id) is None)
+
+        # 旧版布局：发布版本化构建前读取旧文件，发布后旧文件被清理
+        legacy_faiss = store._legacy_path(library_id, 'faiss')
+        legacy_faiss.mkdir(parents=True)
+        (legacy_faiss / 'index.faiss').write_bytes(b'legacy')
+        store._legacy_path(library_id, 'metadata.json').write_text('{}', encoding='utf-8')
+        check("旧版布局的版本号", (store.current_version(library_id) or '').startswith('legacy-'))
+
+        # 发布：manifest记录文件校验和，CURRENT指向新版本，构建目录被移走
+        published = []
+        for i in range(3):
+            version, staging_dir = store.create_staging(library_id)
+            (staging_dir / 'metadata.json').write_text(json.dumps({'i': i}), encoding='utf-8')
+            store.publish(library_id, version, staging_dir, {'paper_count': i})
+            published.append(version)
+            check(f"发布第 {i + 1} 个版本后CURRENT指向它", store.current_version(library_id) == version
+                  and not staging_dir.exists())
+            time.sleep(0.002)
+        manifest = store.read_manifest(library_id)
+        check("发布后删除旧版布局的文件", not legacy_faiss.exists()
+              and not store._legacy_path(library_id, 'metadata.json').exists())
+        check("manifest记录版本与文件校验和", bool(manifest) and manifest['version'] == published[-1]
+              and manifest['paper_count'] == 2 and 'metadata.json' in manifest['files'])
+        check("读取当前版本的文件", json.loads(store.artifact_path(library_id, 'metadata.json')
+                                                 .read_text(encoding='utf-8')) == {'i': 2})
+
+        # 清理：只保留最近 keep_versions 个版本，超时的构建目录被删除，当前版本始终保留
+        remaining = sorted(d.name for d in (store.library_dir(library_id) / 'versions').iterdir())
+        check("只保留最近的版本", remaining == sorted(published[-2:]))
+        _, abandoned = store.create_staging(library_id)
+        time.sleep(0.6)
+        store.collect_garbage(library_id)
+        check("清理超时的构建目录", not abandoned.exists())
+        check("清理后当前版本仍可读取", store.version_dir(library_id, published[-1]).exists()
+              and store.current_version(library_id) == published[-1])
+
+        # 构建租约：同一时间只有一个持有者，释放或过期（包括内容为空的锁文件）后可以重新获取
+        lease = store.try_acquire_build(library_id, lease_seconds=30)
+        check("获取构建租约", lease is not None and store.build_status(library_id) is not None)
+        check("已有构建时不能重复获取", store.try_acquire_build(library_id, lease_seconds=30) is None)
+        lease.release()
+        check("释放后没有进行中的构建", store.build_status(library_id) is None)
+        lock_path = store._build_lock_path(library_id)
+        lock_path.write_text('', encoding='utf-8')
+        check("内容为空的新锁视为构建中", store.build_status(library_id, 30) is not None
+              and store.try_acquire_build(library_id, lease_seconds=30) is None)
+        expired = time.time() - 60
+        os.utime(lock_path, (expired, expired))
+        lease = store.try_acquire_build(library_id, lease_seconds=30)
+        check("过期的空锁被接管", lease is not None and lease._owned())
+        if lease is not None:
+            lease.release()
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return failures
+
+
+def main(argv: Optional[List[str]] = None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="版本化的向量数据库存储")
+    parser.add_argument('command', choices=['selfcheck'], help="selfcheck: 在临时目录上检查发布、清理和构建租约")
+    parser.parse_args(argv)
+
+    print("🔎 检查版本化索引存储")
+    failures = selfcheck()
+    if failures:
+        print(f"❌ {len(failures)} 项检查未通过")
+        return 1
+    print("✅ 全部检查通过")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""
+按用户缓存的LLM客户端池
+向量检索层（Embedding模型 + FAISS索引）全局共享，LLM客户端按用户配置独立创建
+"""
+
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import httpx
+from langchain_openai import ChatOpenAI
+
+
+class LLMClientPool:
+    """有界LRU的ChatOpenAI客户端池，每个客户端持有独立的keep-alive连接池"""
+
+    def __init__(
+        self,
+        max_size: int = 32,
+        max_keepalive_connections: int = 8,
+        keepalive_expiry: float = 60.0,
+        timeout: float = 120.0
+    ):
+        """
+        初始化客户端池
+
+        Args:
+            max_size: 最多缓存的客户端数量，超出后淘汰最久未使用的客户端
+            max_keepalive_connections: 每个客户端保持的空闲长连接数
+            keepalive_expiry: 空闲长连接的保持时间（秒）
+            timeout: 单次LLM请求超时时间（秒）
+        """
+        self.max_size = max(1, int(max_size))
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.timeout = timeout
+
+        # key -> (配置指纹, ChatOpenAI, httpx.Client)
+        self._clients: "OrderedDict[str, Tuple[Tuple, ChatOpenAI, httpx.Client]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _fingerprint(base_url: str, api_key: str, model: str, temperature: float) -> Tuple:
+        """配置指纹，用户修改配置后自动重建客户端"""
+        return (base_url, api_key, model, float(temperature))
+
+    def _create_client(self, base_url: str, api_key: str, model: str, temperature: float) -> Tuple[ChatOpenAI, httpx.Client]:
+        """
+        创建带keep-alive连接池的ChatOpenAI客户端
+
+        客户端被淘汰或替换时可能仍有请求在使用，因此不主动关闭连接池，
+        而是在ChatOpenAI对象被回收（最后一个使用者释放）时再关闭
+        """
+        http_client = httpx.Client(
+            limits=httpx.Limits(
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry
+            ),
+            timeout=self.timeout
+        )
+        llm = ChatOpenAI(
+            model=model,
+            base_url=base_url,
+            api_key=api_key,
+            temperature=temperature,
+            http_client=http_client
+        )
+        weakref.finalize(llm, self._close, http_client)
+        return llm, http_client
+
+    @staticmethod
+    def _close(http_client: httpx.Client):
+        """关闭已回收客户端的连接池"""
+        try:
+            http_client.close()
+        except Exception as e:
+            print(f"⚠️ 关闭LLM连接池失败: {str(e)}")
+
+    def get(self, key: str, base_url: str, api_key: str, model: str, temperature: float) -> ChatOpenAI:
+        """
+        获取指定key的LLM客户端，不存在或配置变化时创建
+
+        Args:
+            key: 缓存键（通常为用户ID）
+            base_url: LLM API基础URL
+            api_key: API密钥
+            model: 模型名称
+            temperature: 温度参数
+
+        Returns:
+            ChatOpenAI客户端
+        """
+        fingerprint = self._fingerprint(base_url, api_key, model, temperature)
+
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry and entry[0] == fingerprint:
+                self._clients.move_to_end(key)
+                return entry[1]
+
+            # 被替换或淘汰的客户端只从池中移除，连接池在其最后一个使用者释放后关闭
+            llm, http_client = self._create_client(base_url, api_key, model, temperature)
+            self._clients[key] = (fingerprint, llm, http_client)
+            self._clients.move_to_end(key)
+
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+
+        return llm
+
+    def invalidate(self, key: str):
+        """移除指定key的客户端（如用户更新了API配置），进行中的请求不受影响"""
+        with self._lock:
+            self._clients.pop(key, None)
+
+    def clear(self):
+        """清空客户端池，进行中的请求不受影响"""
+        with self._lock:
+            self._clients.clear()
+
+    def stats(self) -> Dict:
+        """客户端池状态"""
+        with self._lock:
+            return {
+                'size': len(self._clients),
+                'max_size': self.max_size
+            }
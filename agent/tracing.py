@@ -0,0 +1,64 @@
+"""
+RAG查询的分阶段计时
+记录每个阶段的单调时钟耗时（毫秒）和规模指标（检索的文本块数、prompt/completion token数等）
+"""
+
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+
+class QueryTrace:
+    """一次查询的分阶段耗时与规模指标"""
+
+    def __init__(self):
+        self._start = time.perf_counter()
+        # 阶段名 -> 累计耗时（毫秒），按首次出现的顺序保存
+        self.stages: Dict[str, float] = {}
+        # 规模指标，如 chunks、prompt_tokens、completion_tokens
+        self.counters: Dict[str, object] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        """计时一个阶段，同名阶段多次出现时累加"""
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+    def set(self, name: str, value):
+        """记录规模指标"""
+        self.counters[name] = value
+
+    def add(self, name: str, value: int = 1):
+        """累加规模指标"""
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def record_usage(self, message) -> None:
+        """从LLM返回的消息中提取token用量（兼容usage_metadata与OpenAI的token_usage）"""
+        usage = getattr(message, 'usage_metadata', None) or {}
+        prompt_tokens = usage.get('input_tokens')
+        completion_tokens = usage.get('output_tokens')
+        if prompt_tokens is None:
+            token_usage = (getattr(message, 'response_metadata', None) or {}).get('token_usage') or {}
+            prompt_tokens = token_usage.get('prompt_tokens')
+            completion_tokens = token_usage.get('completion_tokens')
+        if prompt_tokens is not None:
+            self.add('prompt_tokens', int(prompt_tokens))
+        if completion_tokens is not None:
+            self.add('completion_tokens', int(completion_tokens))
+
+    def to_dict(self) -> Dict:
+        """
+        导出为可JSON序列化的字典
+
+        Returns:
+            {'total_ms', 'stages': {阶段: 毫秒}, 以及各规模指标}
+        """
+        result = {
+            'total_ms': round((time.perf_counter() - self._start) * 1000, 3),
+            'stages': {name: round(ms, 3) for name, ms in self.stages.items()}
+        }
+        result.update(self.counters)
+        return result
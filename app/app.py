@@ -4,13 +4,19 @@ import json
 import shutil
 import traceback
 import time
+import threading
+import atexit
+from collections import OrderedDict
 from datetime import datetime
 from pathlib import Path
-from flask import Flask, request, jsonify, send_from_directory, make_response, session
+from flask import Flask, request, jsonify, send_file, make_response, session, g, Response
 from flask_cors import CORS
 from config import config
 from mineru_api import MinerUAPI
 from user_manager import get_user_manager
+from result_store import save_with_hash
+from catalog import FILE_SORTS, LIBRARY_SORTS
+import metrics
 import sys
 
 # 添加agent目录到路径
@@ -26,8 +32,11 @@ def allowed_file(filename, app):
     supported_extensions = {'pdf', 'png', 'jpg', 'jpeg'}
     return extension in supported_extensions
 
-def process_files_with_mineru_api(file_paths, output_dir, app, is_ocr=True, enable_formula=True, enable_table=True, language="ch", layout_model="doclayout_yolo", saved_files=None):
-    """使用MinerU API批量处理文件 - 严格按照test_input.py和test_output.py的逻辑"""
+def process_files_with_mineru_api(file_paths, output_dir, app, is_ocr=True, enable_formula=True, enable_table=True, language="ch", layout_model="doclayout_yolo", saved_files=None, cancel_event=None, progress_callback=None):
+    """使用MinerU API批量处理文件 - 严格按照test_input.py和test_output.py的逻辑
+    
+    cancel_event 置位时取消处理；progress_callback(已完成数, 总数) 在本地模式每完成一个文件时调用
+    """
     try:
         # 检查文件格式
         valid_files = []
@@ -51,6 +60,9 @@ def process_files_with_mineru_api(file_paths, output_dir, app, is_ocr=True, enab
                 'error': '没有有效的文件可处理'
             }
         
+        if cancel_event is not None and cancel_event.is_set():
+            return {'success': False, 'error': '已取消'}
+        
         # 获取配置
         use_local = app.config.get('MINERU_USE_LOCAL', False)
         local_url = app.config.get('MINERU_LOCAL_URL', 'http://127.0.0.1:30000')
@@ -58,8 +70,13 @@ def process_files_with_mineru_api(file_paths, output_dir, app, is_ocr=True, enab
         # 创建MinerU客户端（支持API和本地调用）
         try:
             if use_local:
-                api_client = MinerUAPI(use_local=True, local_url=local_url)
-                print(f"🚀 MinerU 本地模式: {local_url}")
+                api_client = MinerUAPI(
+                    use_local=True,
+                    local_url=local_url,
+                    local_concurrency=app.config.get('MINERU_LOCAL_CONCURRENCY', 2),
+                    local_timeout=app.config.get('MINERU_LOCAL_TIMEOUT', 600)
+                )
+                print(f"🚀 MinerU 本地模式: {local_url}（并发 {api_client.local_concurrency}）")
             else:
                 token = app.config.get('MINERU_API_TOKEN')
                 if not token:
@@ -67,7 +84,11 @@ def process_files_with_mineru_api(file_paths, output_dir, app, is_ocr=True, enab
                         'success': False,
                         'error': 'MinerU API Token未配置，请在环境变量中设置MINERU_API_TOKEN，或设置MINERU_USE_LOCAL=true使用本地模式'
                     }
-                api_client = MinerUAPI(token=token)
+                api_client = MinerUAPI(
+                    token=token,
+                    base_url=app.config.get('MINERU_API_BASE_URL', 'https://mineru.net/api/v4'),
+                    poll_interval=app.config.get('MINERU_POLL_INTERVAL', 10)
+                )
                 print(f"🚀 MinerU API 模式")
         except ValueError as e:
             return {
@@ -100,19 +121,34 @@ def process_files_with_mineru_api(file_paths, output_dir, app, is_ocr=True, enab
                         break
         
         # 批量处理文件
-        result = api_client.process_files_batch(
-            file_paths=valid_files,
-            output_dir=str(output_dir),
-            batch_index=0,
-            max_files_per_batch=200,
-            language=language,
-            is_ocr=is_ocr,
-            enable_formula=enable_formula,
-            enable_table=enable_table,
-            layout_model=layout_model,
-            file_id_map=file_id_map if file_id_map else None,
-            original_filename_map=original_filename_map if original_filename_map else None
-        )
+        mode = 'local' if use_local else 'api'
+        ingest_start = time.perf_counter()
+        metrics.MINERU_JOBS_IN_PROGRESS.inc(mode=mode)
+        try:
+            result = api_client.process_files_batch(
+                file_paths=valid_files,
+                output_dir=str(output_dir),
+                batch_index=0,
+                max_files_per_batch=200,
+                language=language,
+                is_ocr=is_ocr,
+                enable_formula=enable_formula,
+                enable_table=enable_table,
+                layout_model=layout_model,
+                file_id_map=file_id_map if file_id_map else None,
+                original_filename_map=original_filename_map if original_filename_map else None,
+                cancel_event=cancel_event,
+                progress_callback=progress_callback
+            )
+        finally:
+            metrics.MINERU_JOBS_IN_PROGRESS.dec(mode=mode)
+        
+        status = 'success' if result['success'] else 'failed'
+        metrics.INGEST_DURATION.observe(time.perf_counter() - ingest_start, mode=mode, status=status)
+        processed = result.get('processed_files') or []
+        succeeded = sum(1 for item in processed if item.get('success'))
+        metrics.INGEST_FILES.inc(succeeded, mode=mode, status='success')
+        metrics.INGEST_FILES.inc(len(valid_files) - succeeded, mode=mode, status='failed')
         
         if result['success']:
             print("✅ 批量处理成功")
@@ -183,11 +219,117 @@ def create_app(config_name='default'):
          allow_headers=["Content-Type", "Authorization", "X-Requested-With", "X-User-ID"],
          methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"])
     
+    # 监控指标（需在其他before_request之前注册，预检请求也计入）
+    register_metrics(app)
+    
     # 注册路由
     register_routes(app)
     
+    # 启动时加载文库目录（首次启动从磁盘重建）
+    get_catalog()
+    
+    # 解析工作线程不在这里启动，由下方的启动入口调用 start_ingest_workers()
     return app
 
+def _collect_rag_metrics():
+    """抓取时读取RAG系统与LLM客户端池的运行统计（RAG系统未初始化时不创建）"""
+    rag_system = _rag_system_cache.get("default")
+    families = []
+    if rag_system is not None:
+        stats = rag_system.runtime_stats()
+        families.extend([
+            ('arborvista_rag_index_cache_hits_total', 'counter', "索引缓存命中次数", [({}, stats['index_cache_hits'])]),
+            ('arborvista_rag_index_cache_misses_total', 'counter', "索引缓存未命中（从磁盘加载）次数", [({}, stats['index_cache_misses'])]),
+            ('arborvista_rag_index_cache_evictions_total', 'counter', "索引缓存淘汰次数", [({}, stats['index_cache_evictions'])]),
+            ('arborvista_rag_index_cache_entries', 'gauge', "已缓存的文库索引数", [({}, stats['index_cache_entries'])]),
+            ('arborvista_rag_index_memory_bytes', 'gauge', "已加载索引的内存占用估算（字节，所有文库合计）",
+             [({}, sum(stats['index_memory_bytes'].values()))]),
+            ('arborvista_embedding_texts_total', 'counter', "向量化的文本数（文本块与问题）", [({}, stats['embedded_texts'])]),
+            ('arborvista_embedding_seconds_total', 'counter', "向量化累计耗时（秒）", [({}, stats['embedding_seconds'])]),
+        ])
+    if _llm_pool is not None:
+        families.append(('arborvista_llm_pool_clients', 'gauge', "LLM客户端池中的客户端数", [({}, _llm_pool.stats()['size'])]))
+    if _query_log is not None:
+        stats = _query_log.stats()
+        families.extend([
+            ('arborvista_query_log_records_total', 'counter', "查询日志记录数",
+             [({'result': 'written'}, stats['written']), ({'result': 'dropped'}, stats['dropped']), ({'result': 'error'}, stats['errors'])]),
+            ('arborvista_query_log_queued', 'gauge', "等待写入的查询日志记录数", [({}, stats['queued'])]),
+        ])
+    return families
+
+metrics.registry.register_collector(_collect_rag_metrics)
+
+def _collect_content_cache_metrics():
+    """抓取时读取文档内容缓存的统计"""
+    if _content_cache is None:
+        return []
+    stats = _content_cache.stats()
+    return [
+        ('arborvista_content_cache_requests_total', 'counter', "文档内容缓存查询次数",
+         [({'result': 'hit'}, stats['hits']), ({'result': 'miss'}, stats['misses'])]),
+        ('arborvista_content_cache_bytes', 'gauge', "文档内容缓存占用（含压缩版本，字节）", [({}, stats['bytes'])]),
+    ]
+
+metrics.registry.register_collector(_collect_content_cache_metrics)
+
+def register_metrics(app):
+    """注册HTTP请求指标和 /metrics 接口"""
+    
+    @app.before_request
+    def _metrics_start():
+        g.metrics_start = time.perf_counter()
+        g.metrics_recorded = False
+        metrics.HTTP_IN_FLIGHT.inc()
+    
+    def _record(status):
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.HTTP_REQUESTS.inc(route=route, method=request.method, status=status)
+        metrics.HTTP_LATENCY.observe(time.perf_counter() - g.metrics_start, route=route, method=request.method)
+        g.metrics_recorded = True
+    
+    @app.after_request
+    def _metrics_finish(response):
+        if 'metrics_start' in g:
+            _record(response.status_code)
+        return response
+    
+    @app.teardown_request
+    def _metrics_teardown(exc):
+        if 'metrics_start' not in g:
+            return
+        if not g.metrics_recorded:
+            _record(500)
+        metrics.HTTP_IN_FLIGHT.dec()
+    
+    @app.route('/metrics', methods=['GET'])
+    def prometheus_metrics():
+        """Prometheus指标（需携带METRICS_TOKEN，或来自METRICS_ALLOWED_IPS中的地址）"""
+        if not _metrics_access_allowed(app):
+            return jsonify({'error': '无权访问监控指标'}), 403
+        return Response(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def _metrics_access_allowed(app):
+    """/metrics 访问控制：Bearer令牌与METRICS_TOKEN一致，或客户端地址在METRICS_ALLOWED_IPS中"""
+    import hmac
+    import ipaddress
+    token = app.config.get('METRICS_TOKEN')
+    if token:
+        auth_header = request.headers.get('Authorization', '')
+        if auth_header.startswith('Bearer ') and hmac.compare_digest(auth_header[7:].strip(), token):
+            return True
+    try:
+        remote = ipaddress.ip_address(request.remote_addr or '')
+    except ValueError:
+        return False
+    for allowed in app.config.get('METRICS_ALLOWED_IPS', []):
+        try:
+            if remote in ipaddress.ip_network(allowed, strict=False):
+                return True
+        except ValueError:
+            print(f"⚠️ 无效的METRICS_ALLOWED_IPS项: {allowed}")
+    return False
+
 def _extract_library_id_from_path(file_dir):
     """从文件目录路径中提取文库ID"""
     try:
@@ -205,7 +347,24 @@ def _extract_library_id_from_path(file_dir):
         return 'default'
 
 def _find_file_directory(library_id, file_id, output_dir, search_all_libraries=False):
-    """查找文件目录的辅助函数"""
+    """查找文件目录：先查文件位置索引，未记录时扫描磁盘并补录到索引"""
+    catalog = get_catalog()
+    location = catalog.locate(file_id, None if search_all_libraries else library_id)
+    if location:
+        return location
+    
+    file_dir, found_library_id = _scan_file_directory(library_id, file_id, output_dir, search_all_libraries)
+    if file_dir:
+        library_dir = output_dir / 'libraries' / found_library_id
+        top_dir = file_dir if file_dir.parent == library_dir else file_dir.parent
+        try:
+            catalog.sync_files(found_library_id, [top_dir])
+        except Exception as e:
+            print(f"⚠️ 更新文件位置索引失败: {str(e)}")
+    return file_dir, found_library_id
+
+def _scan_file_directory(library_id, file_id, output_dir, search_all_libraries=False):
+    """扫描磁盘查找文件目录（位置索引未命中时使用）"""
     if search_all_libraries:
         libraries_dir = output_dir / 'libraries'
         if libraries_dir.exists():
@@ -281,163 +440,706 @@ def _process_image_paths(content, library_id, file_id, user_id=None):
     
     return re.sub(image_pattern, replace_image_path, content)
 
-# 全局字典存储每个文档库的logger实例
-_rag_loggers = {}
+# 文档内容缓存（改写后的JSON响应体及压缩版本）
+_content_cache = None
+
+def get_content_cache():
+    """获取文档内容缓存"""
+    global _content_cache
+    if _content_cache is None:
+        from config import Config
+        from content_cache import ContentCache
+        _content_cache = ContentCache(Config.CONTENT_CACHE_MAX_BYTES)
+    return _content_cache
+
+def _markdown_response(md_file, rewrite_key, build_payload):
+    """
+    返回文档内容的JSON响应：按 (markdown文件, mtime, 改写方式) 缓存序列化后的响应体，
+    带强ETag，If-None-Match命中时返回304，按Accept-Encoding返回gzip/brotli压缩版本
+    
+    Args:
+        md_file: markdown文件路径
+        rewrite_key: 影响响应内容的其他参数（文库、文件ID、图片URL中的user_id等）
+        build_payload: 根据markdown原文生成响应字典的函数
+    """
+    def build_body():
+        with open(md_file, 'r', encoding='utf-8') as f:
+            content = f.read()
+        return build_payload(content)
+    
+    return _cached_json_response(md_file, rewrite_key, build_body)
+
+def _cached_json_response(md_file, rewrite_key, build_body):
+    """
+    按 (markdown文件, mtime, rewrite_key) 缓存build_body()生成的JSON响应体，
+    并处理ETag/304与压缩（整篇内容和分段内容共用）
+    """
+    stat = md_file.stat()
+    key = (str(md_file), stat.st_mtime_ns, stat.st_size) + tuple(rewrite_key)
+    cache = get_content_cache()
+    entry = cache.get(key)
+    if entry is None:
+        body = json.dumps(build_body(), ensure_ascii=False).encode('utf-8')
+        entry = cache.put(key, body)
+    
+    encoding = entry.choose_encoding(request.headers.get('Accept-Encoding'))
+    headers = {
+        'ETag': entry.etag_for(encoding),
+        # 内容因用户而异，只允许浏览器缓存，每次使用前用ETag验证
+        'Cache-Control': 'private, no-cache',
+        'Vary': 'Accept-Encoding, X-User-ID'
+    }
+    if entry.matches(request.headers.get('If-None-Match')):
+        return Response(status=304, headers=headers)
+    
+    response = Response(cache.encoded(key, entry, encoding), mimetype='application/json', headers=headers)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+# 图片的WebP与多宽度版本
+_image_variants = None
+
+def get_image_variants():
+    """获取图片版本生成器"""
+    global _image_variants
+    if _image_variants is None:
+        from config import Config
+        from image_variants import ImageVariants, parse_widths
+        _image_variants = ImageVariants(parse_widths(Config.IMAGE_VARIANT_WIDTHS), Config.IMAGE_WEBP_QUALITY)
+    return _image_variants
+
+def _collect_image_variant_metrics():
+    """抓取时读取图片版本生成统计"""
+    if _image_variants is None:
+        return []
+    stats = _image_variants.stats()
+    return [
+        ('arborvista_image_variants_total', 'counter', "生成图片版本（WebP/缩放）的次数",
+         [({'result': 'generated'}, stats['generated']), ({'result': 'failed'}, stats['failed'])]),
+    ]
+
+metrics.registry.register_collector(_collect_image_variant_metrics)
 
-def _get_rag_logger(library_id):
-    """获取或创建指定文档库的logger实例"""
-    from loguru import logger
+# 图片响应（版本协商、条件请求与前端代理卸载）
+def _image_response(file_dir, image_path, private=False):
+    """
+    返回文件目录下 images/ 中的图片：按Accept和宽度参数w选择WebP/缩放版本，
+    带基于mtime和大小的ETag与Last-Modified，If-None-Match/If-Modified-Since 命中时返回304；
+    配置了 IMAGE_SENDFILE 时只返回 X-Accel-Redirect/X-Sendfile 头，由前端代理（nginx/Apache）发送文件内容
+    
+    Returns:
+        Response，图片不存在（或路径越界）时返回None
+    """
     from config import Config
+    from urllib.parse import quote
+    from werkzeug.security import safe_join
     
-    if library_id not in _rag_loggers:
-        logs_dir = Config.LOGS_DIR
-        logs_dir.mkdir(parents=True, exist_ok=True)
-        
-        # 日志文件名格式: {library_id}_query.log
-        log_file = logs_dir / f"{library_id}_query.log"
-        
-        # 创建独立的logger实例
-        rag_logger = logger.bind(library_id=library_id)
-        
-        # 添加文件处理器，使用美观的格式，包含时间、级别、文档库ID和消息
-        rag_logger.add(
-            str(log_file),
-            format="<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | <cyan>{extra[library_id]}</cyan> | {message}",
-            level="INFO",
-            rotation="10 MB",
-            retention="30 days",
-            compression="zip",
-            encoding="utf-8",
-            enqueue=True,
-            backtrace=True,
-            diagnose=True
-        )
-        
-        _rag_loggers[library_id] = rag_logger
+    images_dir = Path(file_dir) / "images"
+    image_file = safe_join(str(images_dir), image_path)
+    if image_file is None or not os.path.isfile(image_file):
+        return None
+    variants = get_image_variants()
+    image_file = variants.select(Path(image_file), request.headers.get('Accept'), request.args.get('w', type=int))
+    stat = image_file.stat()
     
-    return _rag_loggers[library_id]
+    mode = Config.IMAGE_SENDFILE
+    if mode == 'x-accel-redirect':
+        relative = image_file.resolve().relative_to(Config.OUTPUT_DIR.resolve())
+        response = Response(mimetype=_guess_mimetype(image_file))
+        response.headers['X-Accel-Redirect'] = Config.IMAGE_ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + quote(relative.as_posix())
+    elif mode == 'x-sendfile':
+        response = Response(mimetype=_guess_mimetype(image_file))
+        response.headers['X-Sendfile'] = str(image_file.resolve())
+    else:
+        response = send_file(str(image_file), conditional=False, etag=False, max_age=None)
+    
+    response.set_etag(f"{stat.st_mtime_ns:x}-{stat.st_size:x}")
+    response.last_modified = int(stat.st_mtime)
+    response.cache_control.no_cache = None
+    response.cache_control.max_age = Config.IMAGE_CACHE_MAX_AGE
+    if private:
+        response.cache_control.private = True
+    else:
+        response.cache_control.public = True
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Access-Control-Allow-Methods'] = 'GET'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+    if variants.enabled:
+        response.vary.add('Accept')
+    response = response.make_conditional(request)
+    if response.status_code == 304:
+        # 304不应再让代理发送文件
+        response.headers.pop('X-Accel-Redirect', None)
+        response.headers.pop('X-Sendfile', None)
+    return response
+
+def _guess_mimetype(path):
+    import mimetypes
+    return mimetypes.guess_type(str(path))[0] or 'application/octet-stream'
+
+# 查询日志（单个后台写线程，按文库写入JSONL）
+_query_log = None
+_query_log_lock = threading.Lock()
 
-def _log_rag_query(library_id, question, answer, file_id=None, query_scope=None):
-    """记录RAG查询日志到文件（使用Loguru，完整记录答案）"""
+def _get_query_log():
+    """获取查询日志写入器（首次使用时创建）"""
+    global _query_log
+    if _query_log is None:
+        with _query_log_lock:
+            if _query_log is None:
+                from config import Config
+                from query_log import QueryLogWriter
+                _query_log = QueryLogWriter(
+                    Config.LOGS_DIR,
+                    max_bytes=Config.QUERY_LOG_MAX_BYTES,
+                    retention_days=Config.QUERY_LOG_RETENTION_DAYS,
+                    queue_size=Config.QUERY_LOG_QUEUE_SIZE,
+                    flush_interval=Config.QUERY_LOG_FLUSH_INTERVAL
+                )
+                atexit.register(_query_log.flush)
+    return _query_log
+
+def _log_rag_query(library_id, question, answer, file_id=None, query_scope=None, timings=None):
+    """记录RAG查询日志（只入队，由后台线程写入，完整记录答案和分阶段耗时）"""
     try:
-        from loguru import logger
-        from config import Config
-        
-        # 获取或创建logger实例
-        rag_logger = _get_rag_logger(library_id)
-        
-        # 构建完整的日志消息，答案不截断
-        message_lines = [
-            "📝 RAG Query",
-            f"   📚 Library: {library_id}",
-            f"   📄 File ID: {file_id or 'N/A'}",
-            f"   🔍 Scope: {query_scope or 'N/A'}",
-            f"   ❓ Question: {question}",
-            "   💬 Answer:",
-            answer  # 完整答案，不截断
-        ]
-        
-        # 使用结构化格式记录，包含完整信息
-        rag_logger.bind(
-            library_id=library_id,
-            file_id=file_id,
-            query_scope=query_scope,
-            question=question,
-            answer=answer
-        ).info("\n".join(message_lines))
-            
-    except ImportError:
-        # 如果Loguru未安装，使用简单的文件写入
-        try:
-            from config import Config
-            from datetime import datetime
-            
-            logs_dir = Config.LOGS_DIR
-            logs_dir.mkdir(parents=True, exist_ok=True)
-            log_file = logs_dir / f"{library_id}_query.log"
-            
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            log_entry = {
-                'timestamp': timestamp,
-                'level': 'INFO',
-                'library_id': library_id,
-                'file_id': file_id,
-                'query_scope': query_scope,
-                'question': question,
-                'answer': answer
-            }
-            
-            # 写入JSON格式，但格式化为更易读的形式
-            log_line = f"{timestamp} | INFO     | {library_id} | "
-            log_line += f"Library: {library_id}, File ID: {file_id or 'N/A'}, "
-            log_line += f"Scope: {query_scope or 'N/A'}, Question: {question}, Answer: {answer}"
-            
-            with open(log_file, 'a', encoding='utf-8') as f:
-                f.write(log_line + '\n')
-        except Exception as e:
-            print(f"⚠️ 记录日志失败: {str(e)}")
+        _get_query_log().write(library_id, {
+            'library_id': library_id,
+            'file_id': file_id,
+            'query_scope': query_scope,
+            'question': question,
+            'answer': answer,
+            'timings': timings
+        })
     except Exception as e:
         # 日志记录失败不应该影响主流程
         print(f"⚠️ 记录日志失败: {str(e)}")
 
-def _collect_files_from_library(library_dir, library_id):
-    """从文库目录收集文件信息"""
-    files = []
-    for file_dir in library_dir.iterdir():
-        if not file_dir.is_dir() or file_dir.name == 'info.json':
+def _pagination_args(sorts, default_sort='created_at'):
+    """
+    解析列表接口的分页参数：limit（不传表示不分页）、cursor、sort、order、prefix、with_total（翻页时也返回总数）
+    
+    Args:
+        sorts: 支持的排序字段（catalog.FILE_SORTS 或 LIBRARY_SORTS）
+        default_sort: 默认排序字段
+    
+    Raises:
+        ValueError: 参数无效（消息可直接返回给客户端）
+    """
+    limit = request.args.get('limit')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValueError('limit必须是整数')
+        if limit < 1:
+            raise ValueError('limit必须大于0')
+        limit = min(limit, 200)
+    sort = request.args.get('sort') or default_sort
+    if sort not in sorts:
+        raise ValueError(f"sort必须是 {', '.join(sorts)} 之一")
+    # 按名称默认升序（A→Z），按时间和大小默认降序
+    order = (request.args.get('order') or ('asc' if sort == 'name' else 'desc')).lower()
+    if order not in ('asc', 'desc'):
+        raise ValueError('order必须是 asc 或 desc')
+    return {
+        'limit': limit,
+        'cursor': request.args.get('cursor') or None,
+        'sort': sort,
+        'order': order,
+        'name_prefix': request.args.get('prefix') or None,
+        'with_total': (request.args.get('with_total') or 'false').lower() == 'true'
+    }
+
+# 文库与文件目录（SQLite）
+_catalog = None
+_catalog_lock = threading.Lock()
+
+def get_catalog():
+    """获取文库与文件目录（首次使用时创建，目录为空时从磁盘重建）"""
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                from config import Config
+                from catalog import LibraryCatalog
+                catalog = LibraryCatalog(Config.CATALOG_DB_PATH, Config.OUTPUT_DIR / 'libraries')
+                if Config.CATALOG_REBUILD_ON_START or catalog.is_empty():
+                    counts = catalog.rebuild()
+                    print(f"📇 文库目录已从磁盘重建: {counts['libraries']} 个文库，{counts['files']} 个文件")
+                _catalog = catalog
+    return _catalog
+
+def _sync_catalog_after_processing(library_id, result):
+    """处理完成后把成功的文件目录写入文库目录"""
+    try:
+        file_dirs = [Path(item['output_dir']) for item in result.get('processed_files') or []
+                     if item.get('success') and item.get('output_dir')]
+        if file_dirs:
+            get_catalog().sync_files(library_id, file_dirs)
+    except Exception as e:
+        print(f"⚠️ 更新文库目录失败: {str(e)}")
+        file_dirs = []
+    
+    # 生成大纲索引（分段加载）和全文检索索引
+    from config import Config
+    from catalog import scan_file_dir
+    from outline import build_outlines
+    for file_dir in file_dirs:
+        try:
+            record = scan_file_dir(file_dir)
+            if record and record['has_markdown']:
+                content_dir = file_dir.parent / record['content_dir']
+                build_outlines(content_dir)
+                if Config.IMAGE_VARIANTS_AT_INGEST:
+                    get_image_variants().build_all(content_dir / "images")
+                md_files = list(content_dir.glob("*.md"))
+                if md_files:
+                    get_search_index().index_file(library_id, record['file_id'], md_files[0], record['filename'])
+        except Exception as e:
+            print(f"⚠️ 生成文档索引失败 ({file_dir.name}): {str(e)}")
+
+# 全文检索索引（SQLite FTS5）
+_search_index = None
+_search_index_lock = threading.Lock()
+_search_synced_libraries = set()
+
+def get_search_index():
+    """获取全文检索索引（首次使用时创建）"""
+    global _search_index
+    if _search_index is None:
+        with _search_index_lock:
+            if _search_index is None:
+                from config import Config
+                from search_index import SearchIndex
+                _search_index = SearchIndex(Config.SEARCH_INDEX_DB_PATH)
+    return _search_index
+
+def _ensure_library_indexed(library_id):
+    """
+    进程内首次检索某文库时补建索引：目录中有而索引中没有的文档（如启用检索前上传的文档）
+    在这里索引一次，之后由上传和删除增量维护
+    """
+    if library_id in _search_synced_libraries:
+        return
+    from search_index import catalog_files
+    index = get_search_index()
+    indexed = index.indexed_files(library_id)
+    for lib_id, file_id, md_file, filename in catalog_files(get_catalog(), library_id):
+        if (lib_id, file_id) not in indexed:
+            try:
+                index.index_file(lib_id, file_id, md_file, filename)
+            except Exception as e:
+                print(f"⚠️ 索引文档失败 ({lib_id}/{file_id}): {str(e)}")
+    _search_synced_libraries.add(library_id)
+
+# 解析结果去重存储（内容寻址）
+_result_store = None
+_result_store_lock = threading.Lock()
+
+def get_result_store():
+    """获取解析结果存储（未启用去重时返回None）"""
+    global _result_store
+    from config import Config
+    if not Config.RESULT_STORE_ENABLED:
+        return None
+    if _result_store is None:
+        with _result_store_lock:
+            if _result_store is None:
+                from result_store import ResultStore
+                _result_store = ResultStore(Config.RESULT_STORE_DIR)
+    return _result_store
+
+def _collect_result_store_metrics():
+    """抓取时读取解析结果去重统计"""
+    if _result_store is None:
+        return []
+    stats = _result_store.stats()
+    return [
+        ('arborvista_result_store_lookups_total', 'counter', "上传时查找已有解析结果的次数",
+         [({'result': 'hit'}, stats['hits']), ({'result': 'miss'}, stats['misses'])]),
+        ('arborvista_result_store_stored_total', 'counter', "存入的解析结果数", [({}, stats['stored'])]),
+    ]
+
+metrics.registry.register_collector(_collect_result_store_metrics)
+
+def _result_store_key(app, file_hash, is_ocr, enable_formula, enable_table, language, layout_model):
+    """解析结果的去重键（模型版本包含调用方式：在线API与本地vlm-http-client的结果不通用）"""
+    from result_store import result_key
+    mode = 'local' if app.config.get('MINERU_USE_LOCAL', False) else 'api'
+    model_version = f"{mode}:{app.config.get('MINERU_MODEL_VERSION', 'vlm')}"
+    return result_key(file_hash, is_ocr, enable_formula, enable_table, language, layout_model, model_version)
+
+def _reuse_stored_results(store, library_dir, saved_files):
+    """
+    为已有解析结果的上传文件直接生成文件目录（硬链接，不调用MinerU）
+
+    Returns:
+        (复用的处理结果列表, 仍需解析的saved_files)
+    """
+    reused, remaining = [], []
+    for saved_file in saved_files:
+        if not store.lookup(saved_file['result_key']):
+            remaining.append(saved_file)
             continue
-        
-        # Find actual file directory (may be in subdirectory)
-        actual_file_dir = file_dir
-        filename_info_file = file_dir / 'filename_info.json'
-        
-        if not filename_info_file.exists():
-            for sub_dir in file_dir.iterdir():
-                if sub_dir.is_dir():
-                    potential_info_file = sub_dir / 'filename_info.json'
-                    if potential_info_file.exists():
-                        actual_file_dir = sub_dir
-                        filename_info_file = potential_info_file
-                        break
-        
-        md_files = list(actual_file_dir.glob("*.md"))
-        if md_files:
-            md_file = md_files[0]
-            filename = _extract_filename_from_file_dir(actual_file_dir)
-            
-            files.append({
-                'id': file_dir.name,
-                'library_id': library_id,
-                'filename': filename,
-                'created_at': md_file.stat().st_ctime
+        file_id = saved_file['file_id']
+        file_dir = Path(library_dir) / f"{file_id}_b1"
+        filename_info = {
+            'file_id': file_id,
+            'original_filename': saved_file['original_filename'],
+            'processed_at': time.time(),
+            'file_hash': saved_file['file_hash'],
+            'reused_result': True
+        }
+        if store.materialize(saved_file['result_key'], file_dir, filename_info):
+            print(f"♻️ 复用已有解析结果: {saved_file['original_filename']} -> {file_dir.name}")
+            reused.append({
+                'original_name': saved_file['saved_filename'],
+                'data_id': file_dir.name,
+                'output_dir': str(file_dir),
+                'success': True,
+                'reused': True
             })
-    return files
+        else:
+            remaining.append(saved_file)
+    return reused, remaining
+
+def _store_processing_results(store, result, saved_files):
+    """把MinerU成功解析的结果存入去重存储"""
+    from catalog import scan_file_dir
+    for item in result.get('processed_files') or []:
+        if not item.get('success') or not item.get('output_dir'):
+            continue
+        file_dir = Path(item['output_dir'])
+        saved_file = next((s for s in saved_files if s['file_id'] in file_dir.name), None)
+        if saved_file is None:
+            continue
+        try:
+            record = scan_file_dir(file_dir)
+            if not record or not record['has_markdown']:
+                continue
+            store.put(saved_file['result_key'], file_dir.parent / record['content_dir'], {
+                'file_hash': saved_file['file_hash'],
+                'file_size': saved_file['file_size'],
+                'source_filename': saved_file['original_filename']
+            })
+        except Exception as e:
+            print(f"⚠️ 存入解析结果失败 ({file_dir.name}): {str(e)}")
+
+# 异步解析任务（后台工作线程池）
+_ingest_jobs = None
+_ingest_pool = None
+_ingest_jobs_lock = threading.Lock()
+
+def get_ingest_jobs():
+    """获取解析任务表（首次使用时创建）"""
+    global _ingest_jobs
+    if _ingest_jobs is None:
+        with _ingest_jobs_lock:
+            if _ingest_jobs is None:
+                from config import Config
+                from ingest_jobs import JobStore
+                _ingest_jobs = JobStore(Config.INGEST_JOBS_DB_PATH)
+    return _ingest_jobs
+
+def start_ingest_workers(app):
+    """启动解析工作线程池（每个进程一个），租约过期的任务（如重启前未完成的）会被重新执行"""
+    global _ingest_pool
+    with _ingest_jobs_lock:
+        if _ingest_pool is not None:
+            return _ingest_pool
+    from ingest_jobs import IngestWorkerPool
+    pool = IngestWorkerPool(
+        get_ingest_jobs(),
+        lambda job, progress, cancel_event: _run_ingest_job(app, job, progress, cancel_event),
+        workers=app.config.get('INGEST_WORKERS', 2),
+        lease_seconds=app.config.get('INGEST_JOB_LEASE_SECONDS', 120),
+        max_attempts=app.config.get('INGEST_JOB_MAX_ATTEMPTS', 3)
+    )
+    with _ingest_jobs_lock:
+        if _ingest_pool is None:
+            _ingest_pool = pool
+            pool.start()
+            atexit.register(pool.stop)
+    return _ingest_pool
+
+def _collect_ingest_job_metrics():
+    """抓取时读取各状态的解析任务数"""
+    if _ingest_jobs is None:
+        return []
+    counts = _ingest_jobs.counts()
+    return [
+        ('arborvista_ingest_jobs', 'gauge', "各状态的解析任务数",
+         [({'status': status}, count) for status, count in counts.items()]),
+    ]
+
+metrics.registry.register_collector(_collect_ingest_job_metrics)
+
+def _public_job(job):
+    """任务状态的返回格式（不含保存路径等内部信息）"""
+    return {
+        'job_id': job['job_id'],
+        'library_id': job['library_id'],
+        'status': job['status'],
+        'stage': job['stage'],
+        'total_files': job['total_files'],
+        'done_files': job['done_files'],
+        'attempts': job['attempts'],
+        'cancel_requested': bool(job['cancel_requested']),
+        'error': job['error'],
+        'result': job['result'],
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at']
+    }
+
+def _completed_file_dir(library_dir, file_id):
+    """上一次执行（重启前）已经完成的文件目录"""
+    from catalog import scan_file_dir
+    for file_dir in Path(library_dir).glob(f"*{file_id}*"):
+        if file_dir.is_dir() and not file_dir.name.startswith('temp_'):
+            record = scan_file_dir(file_dir)
+            if record and record['has_markdown']:
+                return file_dir
+    return None
+
+def _run_ingest_job(app, job, progress, cancel_event=None):
+    """
+    执行一个解析任务：复用已有结果、调用MinerU解析其余文件、写入文库目录与各类索引；
+    cancel_event 置位时终止MinerU解析，已完成的文件照常入库
+
+    Returns:
+        任务结果 {success, processed_files, success_count, total_count, message}，失败时带error
+    """
+    library_id = job['library_id']
+    options = job['payload']['options']
+    saved_files = job['payload']['files']
+    library_dir = app.config['OUTPUT_DIR'] / 'libraries' / library_id
+    if not library_dir.exists():
+        return {'success': False, 'error': '文库不存在'}
+
+    print(f"开始执行解析任务 {job['job_id']}: {len(saved_files)} 个文件")
+    print(f"配置参数: OCR={options['is_ocr']}, 公式={options['enable_formula']}, 表格={options['enable_table']}, "
+          f"语言={options['language']}, 模型={options['layout_model']}")
+
+    # 任务被重新执行时（重启恢复），跳过上次已完成的文件
+    done_files, pending_files = [], []
+    for saved_file in saved_files:
+        file_dir = _completed_file_dir(library_dir, saved_file['file_id']) if job['attempts'] > 1 else None
+        if file_dir is not None:
+            done_files.append({'original_name': saved_file['saved_filename'], 'data_id': file_dir.name,
+                               'output_dir': str(file_dir), 'success': True})
+        else:
+            pending_files.append(saved_file)
+
+    # 内容和解析参数都相同的文件直接复用已有结果，其余文件交给MinerU
+    store = get_result_store()
+    if store is not None and pending_files:
+        progress('reusing', len(done_files))
+        reused_files, pending_files = _reuse_stored_results(store, library_dir, pending_files)
+        done_files.extend(reused_files)
+
+    result = {'success': True, 'result': {'processed_files': []}}
+    if pending_files:
+        progress('parsing', len(done_files))
+        done_before = len(done_files)
+        # 直接使用文库目录作为输出目录（本地模式会为每个文件创建对应的子目录）
+        result = process_files_with_mineru_api(
+            [saved_file['file_path'] for saved_file in pending_files],
+            str(library_dir),  # 直接输出到文库目录
+            app,
+            is_ocr=options['is_ocr'],
+            enable_formula=options['enable_formula'],
+            enable_table=options['enable_table'],
+            language=options['language'],
+            layout_model=options['layout_model'],
+            saved_files=pending_files,
+            cancel_event=cancel_event,
+            progress_callback=lambda done, total: progress('parsing', done_before + done)
+        )
+        if result['success'] and store is not None:
+            _store_processing_results(store, result['result'], pending_files)
+        elif not result['success'] and done_files:
+            # 复用的文件已经完成，其余文件按失败返回
+            result = {'success': True, 'result': {'processed_files': [
+                {'original_name': saved_file['saved_filename'], 'success': False, 'error': result['error']}
+                for saved_file in pending_files
+            ]}}
+    if done_files:
+        result['result']['processed_files'] = done_files + list(result['result'].get('processed_files') or [])
+
+    if not result['success']:
+        print(f"批量处理失败: {result['error']}")
+        return {'success': False, 'error': result['error']}
+
+    progress('indexing', sum(1 for item in result['result']['processed_files'] if item.get('success')))
+    _sync_catalog_after_processing(library_id, result['result'])
+
+    # 处理结果已经在最终目录了，只需要整理返回信息
+    processed_files = []
+    success_count = 0
+    for processed_file in result['result']['processed_files']:
+        if processed_file['success']:
+            # 从output_dir中提取目录名（格式：{文件名}-{file_id}）
+            output_dir_path = processed_file.get('output_dir', '')
+            if output_dir_path:
+                # 从路径中提取目录名
+                dir_name = Path(output_dir_path).name
+                # 从目录名中提取file_id（优先匹配上传时生成的file_id，否则取最后一个-后面的部分）
+                saved_file = next((s for s in saved_files if s['file_id'] in dir_name), None)
+                if saved_file:
+                    file_id = saved_file['file_id']
+                elif '-' in dir_name:
+                    file_id = dir_name.rsplit('-', 1)[-1]
+                else:
+                    # 如果没有-，说明可能格式不对，尝试从data_id获取
+                    data_id = processed_file.get('data_id', '')
+                    file_id = data_id.replace('_b1', '') if data_id else ''
+
+                processed_files.append({
+                    'file_id': file_id,
+                    'original_filename': saved_file['original_filename'] if saved_file else processed_file.get('original_name', ''),
+                    'success': True,
+                    'reused': bool(processed_file.get('reused'))
+                })
+                success_count += 1
+                print(f"✅ 文件处理成功: {processed_file.get('original_name', '')} -> {output_dir_path}")
+            else:
+                processed_files.append({
+                    'file_id': '',
+                    'original_filename': processed_file.get('original_name', ''),
+                    'success': False,
+                    'error': '缺少data_id'
+                })
+        else:
+            saved_file = next((s for s in saved_files if s['saved_filename'] == processed_file.get('original_name')), None)
+            processed_files.append({
+                'file_id': '',
+                'original_filename': saved_file['original_filename'] if saved_file else processed_file.get('original_name', ''),
+                'success': False,
+                'error': processed_file.get('error', '处理失败')
+            })
+
+    return {
+        'success': True,
+        'processed_files': processed_files,
+        'success_count': success_count,
+        'total_count': len(saved_files),
+        'message': f'批量处理完成，成功: {success_count}/{len(saved_files)}'
+    }
 
 # Global cache for RAG system instances to avoid repeated initialization
 _rag_system_cache = {}
 _rag_system_lock = None
 
-def get_rag_system():
-    """Get or create a cached RAG system instance"""
-    global _rag_system_cache, _rag_system_lock
+def _get_rag_system_lock():
+    """Lazily create the lock guarding the RAG caches"""
+    global _rag_system_lock
     
     if _rag_system_lock is None:
         import threading
-        _rag_system_lock = threading.Lock()
+        _rag_system_lock = threading.RLock()
+    return _rag_system_lock
+
+def get_rag_system():
+    """Get or create a cached RAG system instance"""
+    global _rag_system_cache
     
+    # The embedding model and index are shared by all users;
+    # per-user LLM clients come from get_user_llm()
     cache_key = "default"
     
-    with _rag_system_lock:
+    with _get_rag_system_lock():
         if cache_key not in _rag_system_cache:
             try:
                 from RAG import PaperRAGSystem
-                _rag_system_cache[cache_key] = PaperRAGSystem()
+                _rag_system_cache[cache_key] = PaperRAGSystem(llm_required=False)
             except Exception as e:
                 print(f"Failed to create RAG system: {str(e)}")
                 raise
         
         return _rag_system_cache[cache_key]
 
+# Per-user LLM client pool, shares the embedding/index layer above
+_llm_pool = None
+
+def get_llm_pool():
+    """Get the global per-user LLM client pool"""
+    global _llm_pool
+    
+    with _get_rag_system_lock():
+        if _llm_pool is None:
+            from llm_pool import LLMClientPool
+            from config import Config
+            _llm_pool = LLMClientPool(
+                max_size=Config.LLM_POOL_SIZE,
+                max_keepalive_connections=Config.LLM_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=Config.LLM_KEEPALIVE_EXPIRY,
+                timeout=Config.LLM_TIMEOUT
+            )
+        return _llm_pool
+
+def get_user_llm(user_id):
+    """
+    获取用户的LLM客户端，用户未填写的配置项回退到全局配置。
+    API Key与Base URL作为一组：用户两项都填写时才使用用户的，否则两项都使用全局配置，
+    避免把服务器的全局Key发送到用户指定的地址
+    
+    Returns:
+        ChatOpenAI客户端，如果API Key或Base URL未配置则返回None
+    """
+    from config import Config
+    
+    user_data = get_user_manager().get_user_by_id(user_id) if user_id else None
+    user_data = user_data or {}
+    
+    if user_data.get('openai_api_key') and user_data.get('openai_base_url'):
+        api_key = user_data['openai_api_key']
+        base_url = user_data['openai_base_url']
+    else:
+        api_key = Config.OPENAI_API_KEY
+        base_url = Config.OPENAI_BASE_URL
+    model = user_data.get('openai_model') or Config.OPENAI_MODEL
+    try:
+        temperature = float(user_data.get('openai_temperature'))
+    except (TypeError, ValueError):
+        temperature = Config.OPENAI_TEMPERATURE
+    
+    if not api_key or not base_url:
+        return None
+    
+    return get_llm_pool().get(
+        user_id or 'default',
+        base_url=base_url,
+        api_key=api_key,
+        model=model,
+        temperature=temperature
+    )
+
+# 相关论文kNN图缓存: library_id -> ((path, mtime), neighbors)
+_related_graph_cache = {}
+
+def _get_related_graph(library_id):
+    """读取文库当前版本的相关论文kNN图，版本和文件未变化时直接使用内存缓存"""
+    from config import Config
+    from index_store import VersionedIndexStore
+    
+    graph_path = VersionedIndexStore(Config.VECTOR_DB_DIR).artifact_path(library_id, 'related.json')
+    try:
+        cache_key = (str(graph_path), graph_path.stat().st_mtime)
+    except FileNotFoundError:
+        _related_graph_cache.pop(library_id, None)
+        return None
+    
+    cached = _related_graph_cache.get(library_id)
+    if cached and cached[0] == cache_key:
+        return cached[1]
+    
+    with open(graph_path, 'r', encoding='utf-8') as f:
+        neighbors = json.load(f).get('neighbors', {})
+    _related_graph_cache[library_id] = (cache_key, neighbors)
+    return neighbors
+
 def get_current_user_id():
     """从请求中获取当前用户ID"""
     # 优先从请求头获取
@@ -460,6 +1162,91 @@ def require_auth(f):
     decorated_function.__name__ = f.__name__
     return decorated_function
 
+# 文库所有者缓存（有界LRU）: library_id -> (上次检查时间, info.json的mtime_ns, (状态, 文库信息))
+# 状态为 'ok' 或 'unreadable'（无法解析）；'missing'（没有info.json）不缓存，避免任意文库ID撑大缓存
+_library_acl_cache = OrderedDict()
+_library_acl_lock = threading.Lock()
+
+def _remember_library_info(library_id, entry):
+    from config import Config
+    with _library_acl_lock:
+        _library_acl_cache[library_id] = entry
+        _library_acl_cache.move_to_end(library_id)
+        while len(_library_acl_cache) > Config.LIBRARY_ACL_CACHE_SIZE:
+            _library_acl_cache.popitem(last=False)
+
+def forget_library_info(library_id):
+    """文库被删除后移除其所有者缓存"""
+    with _library_acl_lock:
+        _library_acl_cache.pop(library_id, None)
+
+def _library_info_path(library_id):
+    from config import Config
+    return Config.OUTPUT_DIR / 'libraries' / library_id / 'info.json'
+
+def get_library_info(library_id):
+    """
+    读取文库信息（按info.json的mtime缓存，RECHECK间隔内直接返回缓存，不访问磁盘）
+    
+    Returns:
+        (状态, 文库信息)，状态为 'ok'、'missing' 或 'unreadable'
+    """
+    from config import Config
+    now = time.monotonic()
+    with _library_acl_lock:
+        entry = _library_acl_cache.get(library_id)
+        if entry:
+            _library_acl_cache.move_to_end(library_id)
+    if entry and now - entry[0] < Config.LIBRARY_ACL_RECHECK_SECONDS:
+        return entry[2]
+    
+    info_file = _library_info_path(library_id)
+    try:
+        mtime = info_file.stat().st_mtime_ns
+    except OSError:
+        forget_library_info(library_id)
+        return ('missing', None)
+    if entry and entry[1] == mtime:
+        _remember_library_info(library_id, (now, mtime, entry[2]))
+        return entry[2]
+    
+    try:
+        with open(info_file, 'r', encoding='utf-8') as f:
+            result = ('ok', json.load(f))
+    except Exception as e:
+        print(f"⚠️ 读取文库信息失败: {str(e)}")
+        result = ('unreadable', None)
+    _remember_library_info(library_id, (now, mtime, result))
+    return result
+
+def cache_library_info(library_id, library_info):
+    """写入info.json后更新所有者缓存"""
+    try:
+        mtime = _library_info_path(library_id).stat().st_mtime_ns
+    except OSError:
+        return
+    _remember_library_info(library_id, (time.monotonic(), mtime, ('ok', library_info)))
+
+def authorize_library(library_id, user_id, require_info=False, allow_unreadable=False):
+    """
+    检查用户是否有权访问文库
+    
+    Args:
+        require_info: 文库必须存在（没有info.json时返回404）；否则没有info.json的旧文库不做检查
+        allow_unreadable: info.json无法解析时放行（否则返回500）
+        
+    Returns:
+        None表示允许访问，否则为 (错误响应, 状态码)
+    """
+    status, library_info = get_library_info(library_id)
+    if status == 'missing':
+        return (jsonify({'error': '文库不存在，请先创建文库'}), 404) if require_info else None
+    if status == 'unreadable':
+        return None if allow_unreadable else (jsonify({'error': '无法读取文库信息'}), 500)
+    if library_info.get('user_id') != user_id:
+        return jsonify({'error': '无权访问此文库'}), 403
+    return None
+
 def register_routes(app):
     """注册应用路由"""
     
@@ -621,6 +1408,10 @@ def register_routes(app):
                 mineru_api_token=data.get('mineru_api_token', '')
             )
             
+            # 释放旧配置对应的LLM客户端
+            if _llm_pool is not None:
+                _llm_pool.invalidate(user_id)
+            
             return jsonify({
                 'success': True,
                 'message': '配置更新成功'
@@ -670,24 +1461,13 @@ def register_routes(app):
             library_dir = app.config['OUTPUT_DIR'] / 'libraries' / library_id
             
             # 验证文库是否存在且属于当前用户
-            info_file = library_dir / 'info.json'
-            if not info_file.exists():
-                return jsonify({'error': '文库不存在，请先创建文库'}), 404
-            
-            # 验证文库是否属于当前用户
-            try:
-                with open(info_file, 'r', encoding='utf-8') as f:
-                    library_info = json.load(f)
-                if library_info.get('user_id') != user_id:
-                    return jsonify({'error': '无权访问此文库'}), 403
-            except Exception as e:
-                print(f"⚠️ 读取文库信息失败: {str(e)}")
-                return jsonify({'error': '无法读取文库信息'}), 500
+            denied = authorize_library(library_id, user_id, require_info=True)
+            if denied:
+                return denied
             
             library_dir.mkdir(parents=True, exist_ok=True)
             
-            # 保存文件并收集路径
-            file_paths = []
+            # 保存文件
             saved_files = []
             
             for file in files:
@@ -698,102 +1478,93 @@ def register_routes(app):
                     new_filename = f"{file_id}.{file_extension}" if file_extension else file_id
                     file_path = input_file_dir / new_filename
                     input_file_dir.mkdir(parents=True, exist_ok=True)
-                    file.save(str(file_path))
+                    # 边写盘边计算内容哈希（用于复用已有解析结果）
+                    file_hash, file_size = save_with_hash(file.stream, file_path)
                     
-                    file_paths.append(str(file_path))
                     saved_files.append({
                         'file_id': file_id,
                         'original_filename': file.filename,
-                        'saved_filename': new_filename
+                        'saved_filename': new_filename,
+                        'file_path': str(file_path),
+                        'file_hash': file_hash,
+                        'file_size': file_size,
+                        'result_key': _result_store_key(app, file_hash, is_ocr, enable_formula, enable_table, language, layout_model)
                     })
                 else:
                     print(f"跳过不支持的文件: {file.filename}")
             
-            if not file_paths:
+            if not saved_files:
                 return jsonify({'error': '没有有效的文件'}), 400
             
-            # 批量处理文件，直接输出到文库目录下
-            try:
-                print("开始调用MinerU API批量处理...")
-                print(f"配置参数: OCR={is_ocr}, 公式={enable_formula}, 表格={enable_table}, 语言={language}, 模型={layout_model}")
-                
-                # 直接使用文库目录作为输出目录（本地模式会为每个文件创建对应的子目录）
-                result = process_files_with_mineru_api(
-                    file_paths, 
-                    str(library_dir),  # 直接输出到文库目录
-                    app, 
-                    is_ocr=is_ocr, 
-                    enable_formula=enable_formula, 
-                    enable_table=enable_table,
-                    language=language,
-                    layout_model=layout_model,
-                    saved_files=saved_files
-                )
-                
-                if result['success']:
-                    print("批量处理成功")
-                    
-                    # 处理结果已经在最终目录了，只需要整理返回信息
-                    processed_files = []
-                    success_count = 0
-                    
-                    for processed_file in result['result']['processed_files']:
-                        if processed_file['success']:
-                            # 从output_dir中提取目录名（格式：{文件名}-{file_id}）
-                            output_dir_path = processed_file.get('output_dir', '')
-                            if output_dir_path:
-                                # 从路径中提取目录名
-                                dir_name = Path(output_dir_path).name
-                                # 从目录名中提取file_id（最后一个-后面的部分）
-                                if '-' in dir_name:
-                                    file_id = dir_name.rsplit('-', 1)[-1]
-                                else:
-                                    # 如果没有-，说明可能格式不对，尝试从data_id获取
-                                    data_id = processed_file.get('data_id', '')
-                                    file_id = data_id.replace('_b1', '') if data_id else ''
-                                
-                                processed_files.append({
-                                    'file_id': file_id,
-                                    'original_filename': processed_file.get('original_name', ''),
-                                    'success': True
-                                })
-                                success_count += 1
-                                print(f"✅ 文件处理成功: {processed_file.get('original_name', '')} -> {output_dir_path}")
-                            else:
-                                processed_files.append({
-                                    'file_id': '',
-                                    'original_filename': processed_file.get('original_name', ''),
-                                    'success': False,
-                                    'error': '缺少data_id'
-                                })
-                        else:
-                            processed_files.append({
-                                'file_id': '',
-                                'original_filename': processed_file.get('original_name', ''),
-                                'success': False,
-                                'error': processed_file.get('error', '处理失败')
-                            })
-                    
-                    return jsonify({
-                        'success': True,
-                        'processed_files': processed_files,
-                        'success_count': success_count,
-                        'total_count': len(file_paths),
-                        'message': f'批量处理完成，成功: {success_count}/{len(file_paths)}'
-                    })
-                else:
-                    print(f"批量处理失败: {result['error']}")
-                    return jsonify({'error': result['error']}), 500
-            except Exception as e:
-                print(f"批量处理异常: {str(e)}")
-                traceback.print_exc()
-                return jsonify({'error': f'批量处理失败: {str(e)}'}), 500
+            # 登记解析任务后立即返回，由后台工作线程解析入库，前端按任务ID查询进度
+            job = get_ingest_jobs().create(user_id, library_id, {
+                'options': {
+                    'is_ocr': is_ocr,
+                    'enable_formula': enable_formula,
+                    'enable_table': enable_table,
+                    'language': language,
+                    'layout_model': layout_model
+                },
+                'files': saved_files
+            }, len(saved_files))
+            if _ingest_pool is not None:
+                _ingest_pool.notify()
+            print(f"📥 已登记解析任务 {job['job_id']}: {len(saved_files)} 个文件 -> {library_id}")
+            
+            return jsonify({
+                'success': True,
+                'job_id': job['job_id'],
+                'status': job['status'],
+                'total_count': len(saved_files),
+                'message': f'已提交 {len(saved_files)} 个文件，正在后台解析'
+            }), 202
                 
         except Exception as e:
             print(f"上传处理异常: {str(e)}")
             traceback.print_exc()
             return jsonify({'error': f'上传失败: {str(e)}'}), 500
 
+    @app.route('/api/jobs', methods=['GET'])
+    @require_auth
+    def list_ingest_jobs():
+        """当前用户最近的解析任务，可按 library_id、status 筛选"""
+        try:
+            limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+        except ValueError:
+            return jsonify({'error': 'limit必须是整数'}), 400
+        jobs = get_ingest_jobs().list(
+            get_current_user_id(),
+            library_id=request.args.get('library_id') or None,
+            status=request.args.get('status') or None,
+            limit=limit
+        )
+        return jsonify({'success': True, 'data': [_public_job(job) for job in jobs]})
+
+    @app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+    @require_auth
+    def cancel_ingest_job(job_id):
+        """取消解析任务：等待中的任务直接取消，运行中的任务终止MinerU解析（已完成的文件保留）"""
+        jobs = get_ingest_jobs()
+        job = jobs.get(job_id)
+        if job is None or job['user_id'] != get_current_user_id():
+            return jsonify({'error': '任务不存在'}), 404
+        if job['status'] not in ('queued', 'running'):
+            return jsonify({'error': '任务已结束'}), 409
+        job = jobs.request_cancel(job_id)
+        # 任务在本进程执行时立即生效，否则由执行它的进程在下一次检查时终止
+        if _ingest_pool is not None:
+            _ingest_pool.cancel(job_id)
+        return jsonify({'success': True, 'job': _public_job(job)})
+
+    @app.route('/api/jobs/<job_id>', methods=['GET'])
+    @require_auth
+    def get_ingest_job(job_id):
+        """解析任务的状态与进度，完成后result为处理结果"""
+        job = get_ingest_jobs().get(job_id)
+        if job is None or job['user_id'] != get_current_user_id():
+            return jsonify({'error': '任务不存在'}), 404
+        return jsonify({'success': True, 'job': _public_job(job)})
+
 
     @app.route('/api/files', methods=['GET'])
     @require_auth
@@ -803,21 +1574,18 @@ def register_routes(app):
             library_id = request.args.get('library_id', '')
             if not library_id:
                 return jsonify({'error': '请提供文库ID'}), 400
-            files = []
-            libraries_dir = app.config['OUTPUT_DIR'] / 'libraries'
-            
-            if libraries_dir.exists():
-                if library_id != 'all':
-                    library_dir = libraries_dir / library_id
-                    if library_dir.exists() and library_dir.is_dir():
-                        files = _collect_files_from_library(library_dir, library_id)
-                else:
-                    for lib_dir in libraries_dir.iterdir():
-                        if lib_dir.is_dir():
-                            files.extend(_collect_files_from_library(lib_dir, lib_dir.name))
-            
-            files.sort(key=lambda x: x['created_at'], reverse=True)
-            return jsonify({'files': files})
+            try:
+                page = get_catalog().page_files(None if library_id == 'all' else library_id, markdown_only=True,
+                                                status=request.args.get('status') or None, **_pagination_args(FILE_SORTS))
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            files = [{
+                'id': record['dir_name'],
+                'library_id': record['library_id'],
+                'filename': record['filename'],
+                'created_at': record['created_at']
+            } for record in page['items']]
+            return jsonify({'files': files, 'total': page['total'], 'next_cursor': page['next_cursor']})
             
         except Exception as e:
             return jsonify({'error': f'获取文件列表失败: {str(e)}'}), 500
@@ -829,16 +1597,9 @@ def register_routes(app):
         try:
             user_id = get_current_user_id()
             # 验证文库是否属于当前用户
-            library_dir = app.config['OUTPUT_DIR'] / 'libraries' / library_id
-            info_file = library_dir / 'info.json'
-            if info_file.exists():
-                try:
-                    with open(info_file, 'r', encoding='utf-8') as f:
-                        library_info = json.load(f)
-                    if library_info.get('user_id') != user_id:
-                        return jsonify({'error': '无权访问此文库'}), 403
-                except:
-                    return jsonify({'error': '无法读取文库信息'}), 500
+            denied = authorize_library(library_id, user_id)
+            if denied:
+                return denied
             
             file_dir, _ = _find_file_directory(library_id, file_id, app.config['OUTPUT_DIR'])
             
@@ -849,14 +1610,8 @@ def register_routes(app):
             if not md_files:
                 return jsonify({'error': '未找到markdown文件'}), 404
             
-            with open(md_files[0], 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            user_id = get_current_user_id()
-            content = _process_image_paths(content, library_id, file_id, user_id=user_id)
-            
-            return jsonify({
-                'content': content,
+            return _markdown_response(md_files[0], ('library', library_id, file_id, user_id), lambda content: {
+                'content': _process_image_paths(content, library_id, file_id, user_id=user_id),
                 'file_id': file_id,
                 'library_id': library_id
             })
@@ -865,6 +1620,109 @@ def register_routes(app):
             print(f"获取文件内容失败: {str(e)}")
             return jsonify({'error': f'获取文件内容失败: {str(e)}'}), 500
 
+    @app.route('/api/libraries/<library_id>/files/<file_id>/sections', methods=['GET'])
+    @require_auth
+    def get_library_file_sections(library_id, file_id):
+        """
+        分段获取文档内容：返回目录（标题及其字节范围）和请求的若干节
+        
+        查询参数:
+            offset: 从该字节偏移所在的节开始返回（默认0）
+            limit: 本次返回内容的大致字节数上限（默认256KB，至少返回一节）
+            start/end: 按节序号返回 [start, end)，指定时忽略offset
+            toc: 为0时不返回目录（后续分段请求使用）
+        """
+        try:
+            user_id = get_current_user_id()
+            denied = authorize_library(library_id, user_id)
+            if denied:
+                return denied
+            
+            try:
+                offset = max(int(request.args.get('offset', 0)), 0)
+                limit = min(max(int(request.args.get('limit', 256 * 1024)), 1), 4 * 1024 * 1024)
+                start_index = request.args.get('start', type=int)
+                end_index = request.args.get('end', type=int)
+            except ValueError:
+                return jsonify({'error': '参数无效'}), 400
+            include_toc = request.args.get('toc', '1') not in ('0', 'false')
+            
+            file_dir, _ = _find_file_directory(library_id, file_id, app.config['OUTPUT_DIR'])
+            if not file_dir or not file_dir.exists():
+                return jsonify({'error': '文件不存在'}), 404
+            
+            md_files = list(file_dir.glob("*.md"))
+            if not md_files:
+                return jsonify({'error': '未找到markdown文件'}), 404
+            md_file = md_files[0]
+            
+            def build_body():
+                from outline import load_outline, read_sections, select_sections
+                outline = load_outline(md_file)
+                selected = select_sections(outline, offset, limit, start_index, end_index)
+                sections = read_sections(md_file, selected)
+                for section in sections:
+                    section['content'] = _process_image_paths(section['content'], library_id, file_id, user_id=user_id)
+                next_offset = selected[-1]['end'] if selected else None
+                payload = {
+                    'file_id': file_id,
+                    'library_id': library_id,
+                    'total_bytes': outline['total_bytes'],
+                    'sections': sections,
+                    'next_offset': next_offset if next_offset is not None and next_offset < outline['total_bytes'] else None
+                }
+                if include_toc:
+                    payload['toc'] = outline['sections']
+                return payload
+            
+            return _cached_json_response(md_file, ('sections', library_id, file_id, user_id, offset, limit,
+                                                   start_index, end_index, include_toc), build_body)
+            
+        except Exception as e:
+            print(f"获取分段内容失败: {str(e)}")
+            return jsonify({'error': f'获取分段内容失败: {str(e)}'}), 500
+
+    @app.route('/api/libraries/<library_id>/search', methods=['GET'])
+    @require_auth
+    def search_library(library_id):
+        """
+        文库全文检索（不调用大模型）
+        
+        查询参数:
+            q: 查询词，空白分隔的多个词须同时出现
+            file_id: 只检索该文档（可选）
+            limit/offset: 分页（默认20条，最多100条）
+        """
+        try:
+            user_id = get_current_user_id()
+            denied = authorize_library(library_id, user_id)
+            if denied:
+                return denied
+            
+            query = (request.args.get('q') or '').strip()
+            if not query:
+                return jsonify({'error': '查询词不能为空'}), 400
+            try:
+                limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+                offset = max(int(request.args.get('offset', 0)), 0)
+            except ValueError:
+                return jsonify({'error': '参数无效'}), 400
+            
+            start = time.perf_counter()
+            _ensure_library_indexed(library_id)
+            result = get_search_index().search(library_id, query, limit=limit, offset=offset,
+                                               file_id=request.args.get('file_id') or None)
+            result.update({
+                'query': query,
+                'library_id': library_id,
+                'took_ms': round((time.perf_counter() - start) * 1000, 2)
+            })
+            return jsonify(result)
+            
+        except Exception as e:
+            print(f"全文检索失败: {str(e)}")
+            return jsonify({'error': f'全文检索失败: {str(e)}'}), 500
+
     @app.route('/api/files/<file_id>/content', methods=['GET'])
     def get_file_content(file_id):
         """获取指定文件的markdown内容"""
@@ -879,15 +1737,9 @@ def register_routes(app):
                 return jsonify({'error': '未找到markdown文件'}), 404
             
             md_file = md_files[0]
-            with open(md_file, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            content = _process_image_paths(content, library_id, file_id)
-            filename = md_file.stem.replace('_', ' ').replace('-', ' ')
-            
-            return jsonify({
-                'content': content,
-                'filename': filename,
+            return _markdown_response(md_file, ('file', library_id, file_id), lambda content: {
+                'content': _process_image_paths(content, library_id, file_id),
+                'filename': md_file.stem.replace('_', ' ').replace('-', ' '),
                 'file_id': file_id,
                 'library_id': library_id
             })
@@ -904,16 +1756,9 @@ def register_routes(app):
             
             # 验证文库是否属于当前用户（如果提供了user_id）
             if user_id:
-                library_dir = app.config['OUTPUT_DIR'] / 'libraries' / library_id
-                info_file = library_dir / 'info.json'
-                if info_file.exists():
-                    try:
-                        with open(info_file, 'r', encoding='utf-8') as f:
-                            library_info = json.load(f)
-                        if library_info.get('user_id') != user_id:
-                            return jsonify({'error': '无权访问此文库'}), 403
-                    except:
-                        pass
+                denied = authorize_library(library_id, user_id, allow_unreadable=True)
+                if denied:
+                    return denied
             
             file_dir, found_library_id = _find_file_directory(library_id, file_id, app.config['OUTPUT_DIR'])
             
@@ -921,8 +1766,8 @@ def register_routes(app):
                 print(f"❌ 图片404: 文件目录不存在 - library_id={library_id}, file_id={file_id}")
                 return jsonify({'error': '文件目录不存在'}), 404
             
-            image_file = file_dir / "images" / image_path
-            if not image_file.exists():
+            response = _image_response(file_dir, image_path, private=bool(user_id))
+            if response is None:
                 # 尝试查找所有可能的图片文件
                 images_dir = file_dir / "images"
                 if images_dir.exists():
@@ -935,14 +1780,6 @@ def register_routes(app):
                     print(f"❌ 图片404: 图片目录不存在 - {images_dir}")
                 return jsonify({'error': '图片不存在'}), 404
             
-            response = send_from_directory(str(image_file.parent), image_path)
-            response.headers['Access-Control-Allow-Origin'] = '*'
-            response.headers['Access-Control-Allow-Methods'] = 'GET'
-            response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
-            response.headers['Cache-Control'] = 'public, max-age=31536000'
-            response.headers['Expires'] = 'Thu, 31 Dec 2025 23:59:59 GMT'
-            response.headers['ETag'] = f'"{image_path}_{image_file.stat().st_mtime}"'
-            
             return response
             
         except Exception as e:
@@ -960,18 +1797,10 @@ def register_routes(app):
             if not file_dir:
                 return jsonify({'error': '文件目录不存在'}), 404
             
-            image_file = file_dir / "images" / image_path
-            if not image_file.exists():
+            response = _image_response(file_dir, image_path)
+            if response is None:
                 return jsonify({'error': '图片不存在'}), 404
             
-            response = send_from_directory(str(image_file.parent), image_path)
-            response.headers['Access-Control-Allow-Origin'] = '*'
-            response.headers['Access-Control-Allow-Methods'] = 'GET'
-            response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
-            response.headers['Cache-Control'] = 'public, max-age=31536000'
-            response.headers['Expires'] = 'Thu, 31 Dec 2025 23:59:59 GMT'
-            response.headers['ETag'] = f'"{image_path}_{image_file.stat().st_mtime}"'
-            
             return response
             
         except Exception as e:
@@ -1029,60 +1858,12 @@ def register_routes(app):
         """获取用户文库列表"""
         try:
             user_id = get_current_user_id()
-            libraries = []
-            libraries_dir = app.config['OUTPUT_DIR'] / 'libraries'
-            
-            if libraries_dir.exists():
-                for library_dir in libraries_dir.iterdir():
-                    if library_dir.is_dir():
-                        # 读取文库信息
-                        library_info = {
-                            'id': library_dir.name,
-                            'name': library_dir.name.replace('_', ' ').title(),
-                            'display_name': library_dir.name.replace('_', ' ').title(),
-                            'created_at': library_dir.stat().st_ctime,
-                            'file_count': 0
-                        }
-                        
-                        # 尝试读取info.json文件获取真实的中文名称和用户ID
-                        info_file = library_dir / 'info.json'
-                        if info_file.exists():
-                            try:
-                                with open(info_file, 'r', encoding='utf-8') as f:
-                                    saved_info = json.load(f)
-                                    library_info['name'] = saved_info.get('name', library_info['name'])
-                                    library_info['display_name'] = saved_info.get('display_name', library_info['name'])
-                                    library_info['created_at'] = saved_info.get('created_at', library_info['created_at'])
-                                    
-                                    # 只返回属于当前用户的文库
-                                    library_user_id = saved_info.get('user_id')
-                                    if library_user_id and library_user_id != user_id:
-                                        continue
-                            except:
-                                # 如果读取失败，跳过此文库
-                                continue
-                        else:
-                            # 如果没有info.json，跳过（可能是旧数据）
-                            continue
-                        
-                        # 统计文件数量
-                        file_count = 0
-                        for file_dir in library_dir.iterdir():
-                            if file_dir.is_dir() and file_dir.name != 'info.json':
-                                # 检查是否有markdown文件
-                                md_files = list(file_dir.glob("*.md"))
-                                if md_files:
-                                    file_count += 1
-                        
-                        library_info['file_count'] = file_count
-                        libraries.append(library_info)
-            
-            # 按创建时间排序
-            libraries.sort(key=lambda x: x['created_at'], reverse=True)
-            print(f"用户 {user_id} 找到 {len(libraries)} 个文库:")
-            for lib in libraries:
-                print(f"  - {lib['id']}: {lib['name']}")
-            return jsonify({'data': libraries})
+            # 默认按创建时间倒序
+            try:
+                page = get_catalog().page_libraries(user_id, **_pagination_args(LIBRARY_SORTS))
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            return jsonify({'data': page['items'], 'total': page['total'], 'next_cursor': page['next_cursor']})
             
         except Exception as e:
             return jsonify({'error': f'获取文库列表失败: {str(e)}'}), 500
@@ -1124,6 +1905,8 @@ def register_routes(app):
             info_file = library_dir / 'info.json'
             with open(info_file, 'w', encoding='utf-8') as f:
                 json.dump(library_info, f, ensure_ascii=False, indent=2)
+            cache_library_info(library_id, library_info)
+            get_catalog().upsert_library(library_info)
             
             return jsonify({
                 'success': True,
@@ -1140,96 +1923,27 @@ def register_routes(app):
         """获取文库中的文件列表"""
         try:
             user_id = get_current_user_id()
-            library_dir = app.config['OUTPUT_DIR'] / 'libraries' / library_id
-            
-            if not library_dir.exists():
-                return jsonify({'data': []})
+            catalog = get_catalog()
             
             # 验证文库是否属于当前用户
-            info_file = library_dir / 'info.json'
-            if info_file.exists():
-                try:
-                    with open(info_file, 'r', encoding='utf-8') as f:
-                        library_info = json.load(f)
-                    if library_info.get('user_id') != user_id:
-                        return jsonify({'error': '无权访问此文库'}), 403
-                except:
-                    return jsonify({'error': '无法读取文库信息'}), 500
-            
-            files = []
-            for file_dir in library_dir.iterdir():
-                if not file_dir.is_dir() or file_dir.name == 'info.json':
-                    continue
-                
-                # Find actual file directory
-                actual_file_dir = file_dir
-                filename_info_file = file_dir / 'filename_info.json'
-                
-                if not filename_info_file.exists():
-                    for sub_dir in file_dir.iterdir():
-                        if sub_dir.is_dir():
-                            potential_info_file = sub_dir / 'filename_info.json'
-                            if potential_info_file.exists():
-                                actual_file_dir = sub_dir
-                                filename_info_file = potential_info_file
-                                break
-                
-                if filename_info_file.exists():
-                    try:
-                        with open(filename_info_file, 'r', encoding='utf-8') as f:
-                            file_info = json.load(f)
-                        # 从filename_info.json获取file_id，如果没有则从目录名提取（去掉_b1后缀）
-                        file_id = file_info.get('file_id')
-                        if not file_id:
-                            # 从目录名提取file_id（去掉_b1后缀和文件名部分）
-                            dir_name = file_dir.name
-                            if '-' in dir_name:
-                                file_id = dir_name.rsplit('-', 1)[-1]
-                            else:
-                                file_id = dir_name.replace('_b1', '')
-                        
-                        files.append({
-                            'id': file_id,
-                            'name': file_info.get('original_filename', file_dir.name),
-                            'created_at': file_info.get('upload_time', datetime.now().isoformat()),
-                            'size': file_info.get('file_size', 0),
-                            'status': file_info.get('status', 'processed'),
-                            'is_ocr': file_info.get('is_ocr', True),
-                            'enable_formula': file_info.get('enable_formula', False)
-                        })
-                    except Exception:
-                        continue
-                else:
-                    # Fallback logic
-                    original_filename = _extract_filename_from_file_dir(file_dir)
-                    full_md_file = actual_file_dir / 'full.md'
-                    status = 'processed' if full_md_file.exists() else 'processing'
-                    
-                    file_size = 0
-                    for file in actual_file_dir.iterdir():
-                        if file.is_file() and file.name.endswith('_origin.pdf'):
-                            file_size = file.stat().st_size
-                            break
-                    
-                    # 从目录名提取file_id（去掉_b1后缀和文件名部分）
-                    dir_name = file_dir.name
-                    if '-' in dir_name:
-                        file_id = dir_name.rsplit('-', 1)[-1]
-                    else:
-                        file_id = dir_name.replace('_b1', '')
-                    
-                    files.append({
-                        'id': file_id,
-                        'name': original_filename,
-                        'created_at': datetime.now().isoformat(),
-                        'size': file_size,
-                        'status': status,
-                        'is_ocr': True,
-                        'enable_formula': False
-                    })
+            denied = authorize_library(library_id, user_id)
+            if denied:
+                return denied
             
-            files.sort(key=lambda x: x['created_at'], reverse=True)
-            return jsonify({'data': files})
+            try:
+                page = catalog.page_files(library_id, status=request.args.get('status') or None, **_pagination_args(FILE_SORTS))
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            files = [{
+                'id': record['file_id'],
+                'name': record['filename'],
+                'created_at': record['upload_time'] or datetime.fromtimestamp(record['created_at']).isoformat(),
+                'size': record['size'],
+                'status': record['status'],
+                'is_ocr': bool(record['is_ocr']),
+                'enable_formula': bool(record['enable_formula'])
+            } for record in page['items']]
+            return jsonify({'data': files, 'total': page['total'], 'next_cursor': page['next_cursor']})
             
         except Exception as e:
             print(f"获取文库文件失败: {str(e)}")
@@ -1247,17 +1961,11 @@ def register_routes(app):
                 return jsonify({'error': '文库不存在'}), 404
             
             # 验证文库是否属于当前用户
-            info_file = library_dir / 'info.json'
-            if info_file.exists():
-                try:
-                    with open(info_file, 'r', encoding='utf-8') as f:
-                        library_info = json.load(f)
-                    if library_info.get('user_id') != user_id:
-                        return jsonify({'error': '无权访问此文库'}), 403
-                except:
-                    return jsonify({'error': '无法读取文库信息'}), 500
+            denied = authorize_library(library_id, user_id)
+            if denied:
+                return denied
             
-            file_dir = _find_file_in_library(library_dir, file_id)
+            file_dir, _ = _find_file_directory(library_id, file_id, app.config['OUTPUT_DIR'])
             if not file_dir or not file_dir.exists():
                 return jsonify({'error': '文件不存在'}), 404
             
@@ -1266,6 +1974,15 @@ def register_routes(app):
             # 如果文库为空，删除文库目录
             if library_dir.exists() and not any(library_dir.iterdir()):
                 shutil.rmtree(library_dir)
+                forget_library_info(library_id)
+            get_catalog().remove_file(library_id, file_id, remove_library=not library_dir.exists())
+            try:
+                if library_dir.exists():
+                    get_search_index().remove_file(library_id, file_id)
+                else:
+                    get_search_index().remove_library(library_id)
+            except Exception as e:
+                print(f"⚠️ 删除检索索引失败: {str(e)}")
             
             return jsonify({'message': '文件删除成功'})
             
@@ -1305,6 +2022,7 @@ def register_routes(app):
             metadata['status'] = 'processing'
             with open(metadata_file, 'w', encoding='utf-8') as f:
                 json.dump(metadata, f, ensure_ascii=False, indent=2)
+            get_catalog().set_file_status(library_id, file_id, 'processing')
             
             # 调用MinerU API处理文件
             try:
@@ -1326,6 +2044,12 @@ def register_routes(app):
                 # 更新元数据
                 with open(metadata_file, 'w', encoding='utf-8') as f:
                     json.dump(metadata, f, ensure_ascii=False, indent=2)
+                if result['success']:
+                    _sync_catalog_after_processing(library_id, {
+                        'processed_files': [{'success': True, 'output_dir': str(file_dir)}]
+                    })
+                else:
+                    get_catalog().set_file_status(library_id, file_id, 'failed')
                 
                 return jsonify({
                     'success': result['success'],
@@ -1337,6 +2061,7 @@ def register_routes(app):
                 metadata['error'] = str(e)
                 with open(metadata_file, 'w', encoding='utf-8') as f:
                     json.dump(metadata, f, ensure_ascii=False, indent=2)
+                get_catalog().set_file_status(library_id, file_id, 'failed')
                 
                 return jsonify({'error': f'文件处理失败: {str(e)}'}), 500
             
@@ -1363,32 +2088,44 @@ def register_routes(app):
             except Exception as e:
                 return jsonify({'error': f'RAG系统初始化失败: {str(e)}'}), 500
             
+            # 分阶段计时（加载向量数据库、问题向量化、检索、prompt组装、LLM调用）
+            from tracing import QueryTrace
+            trace = QueryTrace()
+            
             # 尝试加载向量数据库
-            if not rag_system.load_vector_store(library_id=library_id):
+            with trace.stage('load_vector_store'):
+                loaded = rag_system.load_vector_store(library_id=library_id)
+            if not loaded:
                 return jsonify({
                     'error': f'向量数据库不存在，请先为文库 {library_id} 构建向量数据库',
                     'hint': '可以在问答页面点击"立即构建"按钮来构建向量数据库'
                 }), 404
             
+            # 使用当前用户配置的LLM客户端
+            llm = get_user_llm(get_current_user_id())
+            
             # 根据查询模式选择查询方式
             if query_mode == 'single_paper':
                 # 查询单篇论文
-                result = rag_system.query_with_sources(question, k=4, file_id=file_id)
+                result = rag_system.query_with_sources(question, k=4, file_id=file_id, llm=llm, trace=trace)
             else:
                 # 查询整个数据库
-                result = rag_system.query_with_sources(question, k=4, file_id=None)
+                result = rag_system.query_with_sources(question, k=4, file_id=None, llm=llm, trace=trace)
             
             # 记录日志
             answer = result.get('answer', '')
             query_scope = result.get('query_scope', query_mode)
-            _log_rag_query(library_id, question, answer, file_id=file_id, query_scope=query_scope)
+            timings = result.get('timings')
+            _log_rag_query(library_id, question, answer, file_id=file_id, query_scope=query_scope, timings=timings)
+            metrics.observe_rag_timings(timings)
             
             return jsonify({
                 'success': True,
                 'answer': answer,
                 'sources': result.get('sources', []),
                 'paper_count': result.get('paper_count', 0),
-                'query_scope': query_scope
+                'query_scope': query_scope,
+                'timings': timings
             })
             
         except Exception as e:
@@ -1416,26 +2153,36 @@ def register_routes(app):
             except Exception as e:
                 return jsonify({'error': f'RAG系统初始化失败: {str(e)}'}), 500
             
+            # 分阶段计时（加载向量数据库、问题向量化、检索、prompt组装、LLM调用）
+            from tracing import QueryTrace
+            trace = QueryTrace()
+            
             # 尝试加载向量数据库
-            if not rag_system.load_vector_store(library_id=library_id):
+            with trace.stage('load_vector_store'):
+                loaded = rag_system.load_vector_store(library_id=library_id)
+            if not loaded:
                 return jsonify({
                     'error': f'向量数据库不存在，请先为文库 {library_id} 构建向量数据库',
                     'hint': '可以在问答页面点击"立即构建"按钮来构建向量数据库'
                 }), 404
             
-            # 查询整个文档库
-            result = rag_system.query_with_sources(question, k=4, file_id=None)
+            # 使用当前用户配置的LLM客户端，查询整个文档库
+            llm = get_user_llm(get_current_user_id())
+            result = rag_system.query_with_sources(question, k=4, file_id=None, llm=llm, trace=trace)
             
             # 记录日志
             answer = result.get('answer', '')
-            _log_rag_query(library_id, question, answer, file_id=None, query_scope='all_papers')
+            timings = result.get('timings')
+            _log_rag_query(library_id, question, answer, file_id=None, query_scope='all_papers', timings=timings)
+            metrics.observe_rag_timings(timings)
             
             return jsonify({
                 'success': True,
                 'answer': answer,
                 'sources': result.get('sources', []),
                 'paper_count': result.get('paper_count', 0),
-                'query_scope': result.get('query_scope', 'all_papers')
+                'query_scope': result.get('query_scope', 'all_papers'),
+                'timings': timings
             })
             
         except Exception as e:
@@ -1444,6 +2191,38 @@ def register_routes(app):
             traceback.print_exc()
             return jsonify({'error': f'RAG查询失败: {str(e)}'}), 500
 
+    @app.route('/api/libraries/<library_id>/files/<file_id>/related', methods=['GET'])
+    @require_auth
+    def get_related_papers(library_id, file_id):
+        """获取与指定论文相似的论文（基于构建向量数据库时预计算的kNN图）"""
+        try:
+            user_id = get_current_user_id()
+            # 验证文库是否属于当前用户
+            denied = authorize_library(library_id, user_id)
+            if denied:
+                return denied
+            
+            limit = request.args.get('limit', 10, type=int)
+            
+            neighbors = _get_related_graph(library_id)
+            if neighbors is None:
+                return jsonify({
+                    'data': [],
+                    'exists': False,
+                    'hint': '请先为文库构建向量数据库'
+                })
+            
+            return jsonify({
+                'data': neighbors.get(file_id, [])[:max(limit, 0)],
+                'exists': True,
+                'file_id': file_id,
+                'library_id': library_id
+            })
+            
+        except Exception as e:
+            print(f"获取相关论文失败: {str(e)}")
+            return jsonify({'error': f'获取相关论文失败: {str(e)}'}), 500
+
     @app.route('/api/libraries/<library_id>/build_vector_store', methods=['POST'])
     @require_auth
     def build_library_vector_store(library_id):
@@ -1457,24 +2236,46 @@ def register_routes(app):
             except Exception as e:
                 return jsonify({'error': f'RAG系统初始化失败: {str(e)}'}), 500
             
-            # 加载论文
-            papers = rag_system.load_papers_from_library(library_id=library_id)
+            # 是否预生成论文摘要（请求参数优先，否则使用全局配置）
+            data = request.get_json(silent=True) or {}
+            build_summaries = data.get('build_summaries')
+            if build_summaries is None:
+                build_summaries = app.config.get('RAG_BUILD_SUMMARIES', False)
+            elif not isinstance(build_summaries, bool):
+                # 与上传参数一致：只有 "true"（不区分大小写）视为开启，"false"、"0" 等均为关闭
+                build_summaries = str(build_summaries).strip().lower() == 'true'
+            llm = get_user_llm(get_current_user_id()) if build_summaries else None
+            
+            # 构建向量数据库（同一文库已在构建时等待其完成，不重复构建）
+            result = rag_system.build_library(
+                library_id,
+                build_summaries=build_summaries and llm is not None,
+                llm=llm,
+                summary_workers=app.config.get('RAG_SUMMARY_WORKERS', 4)
+            )
             
-            if not papers:
+            if result['success']:
+                paper_count = result.get('paper_count', 0)
+                message = f'向量数据库构建成功，共处理 {paper_count} 篇论文'
+                if result.get('attached'):
+                    message = f'该文库正在由其他请求构建，已等待其完成，共 {paper_count} 篇论文'
+                return jsonify({
+                    'success': True,
+                    'message': message,
+                    'paper_count': paper_count,
+                    'attached': result.get('attached', False),
+                    'version': result.get('version')
+                })
+            elif result.get('error') == 'no_papers':
                 return jsonify({
                     'success': False,
                     'error': f'文库 {library_id} 中没有找到论文，请先上传论文'
                 }), 404
-            
-            # 构建向量数据库
-            success = rag_system.build_vector_store(papers, library_id=library_id)
-            
-            if success:
+            elif result.get('error') == 'wait_timeout':
                 return jsonify({
-                    'success': True,
-                    'message': f'向量数据库构建成功，共处理 {len(papers)} 篇论文',
-                    'paper_count': len(papers)
-                })
+                    'success': False,
+                    'error': '该文库正在由其他请求构建，等待超时，请稍后查看状态'
+                }), 409
             else:
                 return jsonify({
                     'success': False,
@@ -1503,10 +2304,14 @@ def register_routes(app):
             # Check if vector store exists without actually loading it
             # This prevents overwriting the current vector store in shared instance
             exists, paper_count = rag_system.check_vector_store_exists(library_id=library_id)
+            build = rag_system.index_store.build_status(library_id, rag_system.build_lease_seconds)
             
             return jsonify({
                 'exists': exists,
-                'paper_count': paper_count
+                'paper_count': paper_count,
+                'version': rag_system.index_store.current_version(library_id),
+                'building': build is not None,
+                'build_started_at': build.get('started_at') if build else None
             })
             
         except Exception as e:
@@ -1521,6 +2326,10 @@ def register_routes(app):
 # 创建应用实例
 app = create_app(os.environ.get('FLASK_ENV', 'development'))
 
+if __name__ != '__main__' and app.config.get('INGEST_WORKERS_AUTOSTART', True):
+    # 作为WSGI模块导入时（如 gunicorn app:app）启动解析工作线程，恢复重启前未完成的任务
+    start_ingest_workers(app)
+
 if __name__ == '__main__':
     # 获取本机IP地址，支持外部访问
     import socket
@@ -1548,4 +2357,9 @@ if __name__ == '__main__':
     if server_url:
         print(f"   服务器映射: {server_url}")
     
+    # 调试模式下的重载监视进程只负责重启，解析工作线程在实际处理请求的子进程（WERKZEUG_RUN_MAIN=true）中启动
+    if app.config.get('INGEST_WORKERS_AUTOSTART', True) and (
+            not app.config['DEBUG'] or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'):
+        start_ingest_workers(app)
+    
     app.run(debug=app.config['DEBUG'], host='0.0.0.0', port=port)
\ No newline at end of file
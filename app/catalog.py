@@ -0,0 +1,539 @@
+"""
+文库与文件目录（SQLite）
+保存文库、所有者、文件、状态、大小和时间等信息，列表接口直接查询索引，不再逐个遍历文库目录、
+读取 info.json / filename_info.json 和查找markdown文件；
+上传、删除和处理文件时在事务中更新，目录数据可随时从磁盘重建；
+同时作为 file_id → 文件目录 的位置索引，查看文档和图片时直接查表而不是扫描目录
+
+用法:
+    python app/catalog.py rebuild
+"""
+
+import re
+import sys
+import json
+import base64
+import time
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS libraries (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    display_name TEXT NOT NULL,
+    description TEXT,
+    user_id TEXT,
+    has_info INTEGER NOT NULL DEFAULT 1,
+    created_at REAL NOT NULL,
+    file_count INTEGER NOT NULL DEFAULT 0,
+    markdown_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_libraries_user ON libraries(user_id, created_at);
+CREATE TABLE IF NOT EXISTS files (
+    library_id TEXT NOT NULL,
+    file_id TEXT NOT NULL,
+    dir_name TEXT NOT NULL,
+    content_dir TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    status TEXT NOT NULL,
+    has_markdown INTEGER NOT NULL DEFAULT 0,
+    size INTEGER NOT NULL DEFAULT 0,
+    is_ocr INTEGER NOT NULL DEFAULT 1,
+    enable_formula INTEGER NOT NULL DEFAULT 0,
+    upload_time TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (library_id, file_id)
+);
+CREATE INDEX IF NOT EXISTS idx_files_library_created_id ON files(library_id, created_at, file_id);
+CREATE INDEX IF NOT EXISTS idx_files_file_id ON files(file_id);
+CREATE INDEX IF NOT EXISTS idx_files_dir_name ON files(dir_name);
+CREATE INDEX IF NOT EXISTS idx_files_library_name ON files(library_id, filename COLLATE NOCASE, file_id);
+CREATE INDEX IF NOT EXISTS idx_files_library_size ON files(library_id, size, file_id);
+CREATE INDEX IF NOT EXISTS idx_files_library_status ON files(library_id, status);
+CREATE INDEX IF NOT EXISTS idx_files_library_markdown ON files(library_id, has_markdown);
+"""
+
+# 分页列表支持的排序字段: 参数值 -> SQL表达式
+FILE_SORTS = {'created_at': 'created_at', 'name': 'filename COLLATE NOCASE', 'size': 'size'}
+LIBRARY_SORTS = {'created_at': 'l.created_at', 'name': 'l.display_name COLLATE NOCASE'}
+
+
+UUID_SUFFIX = re.compile(r'([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})(_b\d+)?$')
+
+
+def _file_id_from_dir_name(dir_name: str) -> str:
+    """从目录名提取file_id（本地模式为 {文件名}-{file_id}，在线模式为 {file_id}_b1）"""
+    match = UUID_SUFFIX.search(dir_name)
+    if match:
+        return match.group(1)
+    if '-' in dir_name:
+        return dir_name.rsplit('-', 1)[-1]
+    return dir_name.replace('_b1', '')
+
+
+def encode_cursor(payload: Dict) -> str:
+    """分页游标：排序值、末行主键和查询条件的URL安全编码"""
+    data = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Dict:
+    """解析分页游标（无效时抛出ValueError）"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise ValueError('无效的分页游标')
+    if not isinstance(payload, dict) or not isinstance(payload.get('after'), list):
+        raise ValueError('无效的分页游标')
+    return payload
+
+
+def _prefix_range(prefix: str) -> Tuple[str, str]:
+    """名称前缀对应的范围（可以使用 COLLATE NOCASE 索引，不需要LIKE全表扫描）"""
+    return prefix, prefix + '\U0010ffff'
+
+
+def _filename_from_dir_name(dir_name: str) -> str:
+    if '.pdf-' in dir_name:
+        return dir_name.split('.pdf-')[0] + '.pdf'
+    return '未命名文档'
+
+
+def scan_file_dir(file_dir: Path) -> Optional[Dict]:
+    """
+    从磁盘读取一个文件目录的信息
+
+    Args:
+        file_dir: 文库下的文件目录（MinerU结果可能在其 *_b1 子目录中）
+
+    Returns:
+        文件记录，目录不存在时返回None
+    """
+    if not file_dir.is_dir():
+        return None
+
+    # 实际内容目录：含filename_info.json的子目录（或 *_b1 子目录）
+    content_dir = file_dir
+    info_file = file_dir / 'filename_info.json'
+    if not info_file.exists():
+        for sub_dir in file_dir.iterdir():
+            if sub_dir.is_dir() and ((sub_dir / 'filename_info.json').exists() or sub_dir.name.endswith('_b1')):
+                content_dir = sub_dir
+                info_file = sub_dir / 'filename_info.json'
+                break
+
+    file_info = {}
+    if info_file.exists():
+        try:
+            with open(info_file, 'r', encoding='utf-8') as f:
+                file_info = json.load(f)
+        except Exception:
+            file_info = {}
+
+    md_files = list(content_dir.glob("*.md"))
+    size = file_info.get('file_size') or 0
+    if not size:
+        for item in content_dir.glob('*_origin.pdf'):
+            size = item.stat().st_size
+            break
+
+    created_at = md_files[0].stat().st_ctime if md_files else file_dir.stat().st_ctime
+    return {
+        'file_id': file_info.get('file_id') or _file_id_from_dir_name(file_dir.name),
+        'dir_name': file_dir.name,
+        'content_dir': str(content_dir.relative_to(file_dir.parent)),
+        'filename': file_info.get('original_filename') or _filename_from_dir_name(file_dir.name),
+        'status': file_info.get('status') or ('processed' if md_files else 'processing'),
+        'has_markdown': 1 if md_files else 0,
+        'size': size,
+        'is_ocr': 1 if file_info.get('is_ocr', True) else 0,
+        'enable_formula': 1 if file_info.get('enable_formula', False) else 0,
+        'upload_time': file_info.get('upload_time'),
+        'created_at': created_at
+    }
+
+
+def scan_library_dir(library_dir: Path) -> Dict:
+    """从磁盘读取文库信息（info.json缺失时has_info为0）"""
+    default_name = library_dir.name.replace('_', ' ').title()
+    library = {
+        'id': library_dir.name,
+        'name': default_name,
+        'display_name': default_name,
+        'description': '',
+        'user_id': None,
+        'has_info': 0,
+        'created_at': library_dir.stat().st_ctime
+    }
+    info_file = library_dir / 'info.json'
+    if info_file.exists():
+        try:
+            with open(info_file, 'r', encoding='utf-8') as f:
+                saved_info = json.load(f)
+            library.update({
+                'name': saved_info.get('name', default_name),
+                'display_name': saved_info.get('display_name', saved_info.get('name', default_name)),
+                'description': saved_info.get('description', ''),
+                'user_id': saved_info.get('user_id'),
+                'has_info': 1,
+                'created_at': saved_info.get('created_at', library['created_at'])
+            })
+        except Exception:
+            # 与原先一致：info.json无法读取的文库不出现在列表中
+            library['has_info'] = -1
+    return library
+
+
+class LibraryCatalog:
+    """文库与文件目录"""
+
+    def __init__(self, db_path: Path, libraries_dir: Path):
+        """
+        Args:
+            db_path: SQLite数据库路径
+            libraries_dir: 文库根目录（data/output/libraries）
+        """
+        self.db_path = Path(db_path)
+        self.libraries_dir = Path(libraries_dir)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._rebuild_lock = threading.Lock()
+        # 位置查询的内存缓存: (library_id或None, file_id) -> (内容目录, library_id)，任何写入都会清空
+        self._locations: Dict[Tuple, Tuple[Path, str]] = {}
+        self._max_locations = 100000
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        """每个线程一个连接（WAL模式下读不阻塞写）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ---------- 重建 ----------
+
+    def is_empty(self) -> bool:
+        conn = self._conn()
+        return conn.execute("SELECT 1 FROM libraries LIMIT 1").fetchone() is None
+
+    def rebuild(self) -> Dict[str, int]:
+        """从磁盘重建整个目录（单个事务，重建期间读请求看到的是旧数据）"""
+        with self._rebuild_lock:
+            libraries, files = [], []
+            if self.libraries_dir.exists():
+                for library_dir in self.libraries_dir.iterdir():
+                    if not library_dir.is_dir():
+                        continue
+                    libraries.append(scan_library_dir(library_dir))
+                    for file_dir in library_dir.iterdir():
+                        if file_dir.is_dir() and not file_dir.name.startswith('temp_'):
+                            record = scan_file_dir(file_dir)
+                            if record:
+                                record['library_id'] = library_dir.name
+                                files.append(record)
+
+            conn = self._conn()
+            self._locations.clear()
+            with conn:
+                conn.execute("DELETE FROM files")
+                conn.execute("DELETE FROM libraries")
+                for library in libraries:
+                    self._upsert_library(conn, library)
+                for record in files:
+                    self._upsert_file(conn, record['library_id'], record)
+                self._refresh_counts(conn)
+            return {'libraries': len(libraries), 'files': len(files)}
+
+    # ---------- 更新 ----------
+
+    @staticmethod
+    def _refresh_counts(conn: sqlite3.Connection, library_id: Optional[str] = None):
+        """
+        重新计算文库的文件数和已有markdown的文件数（在写入文件的同一事务中调用）
+
+        只统计一个文库时走 (library_id, has_markdown) 索引；列表接口直接读取这两列，不再逐页COUNT
+        """
+        sql = """UPDATE libraries SET
+                     file_count = (SELECT COUNT(*) FROM files f WHERE f.library_id = libraries.id),
+                     markdown_count = (SELECT COUNT(*) FROM files f WHERE f.library_id = libraries.id AND f.has_markdown = 1)"""
+        if library_id is None:
+            conn.execute(sql)
+        else:
+            conn.execute(sql + " WHERE id = ?", (library_id,))
+
+    @staticmethod
+    def _upsert_library(conn: sqlite3.Connection, library: Dict):
+        # 更新文库信息时保留已有的文件计数
+        conn.execute(
+            """INSERT INTO libraries (id, name, display_name, description, user_id, has_info, created_at)
+               VALUES (:id, :name, :display_name, :description, :user_id, :has_info, :created_at)
+               ON CONFLICT(id) DO UPDATE SET name = excluded.name, display_name = excluded.display_name,
+                   description = excluded.description, user_id = excluded.user_id,
+                   has_info = excluded.has_info, created_at = excluded.created_at""",
+            {
+                'id': library['id'],
+                'name': library.get('name') or library['id'],
+                'display_name': library.get('display_name') or library.get('name') or library['id'],
+                'description': library.get('description', ''),
+                'user_id': library.get('user_id'),
+                'has_info': library.get('has_info', 1),
+                'created_at': library.get('created_at') or time.time()
+            }
+        )
+
+    @staticmethod
+    def _upsert_file(conn: sqlite3.Connection, library_id: str, record: Dict):
+        values = dict(record, library_id=library_id, updated_at=time.time())
+        conn.execute(
+            """INSERT OR REPLACE INTO files (library_id, file_id, dir_name, content_dir, filename, status, has_markdown,
+                   size, is_ocr, enable_formula, upload_time, created_at, updated_at)
+               VALUES (:library_id, :file_id, :dir_name, :content_dir, :filename, :status, :has_markdown,
+                   :size, :is_ocr, :enable_formula, :upload_time, :created_at, :updated_at)""",
+            values
+        )
+
+    def upsert_library(self, library_info: Dict):
+        """创建/更新文库（传入与info.json相同的字段）"""
+        conn = self._conn()
+        with conn:
+            self._upsert_library(conn, dict(library_info, has_info=1))
+
+    def sync_files(self, library_id: str, file_dirs: Iterable[Path]) -> int:
+        """
+        在一个事务中按磁盘内容更新文库中的若干文件目录（处理完成后调用）
+
+        Returns:
+            更新的文件数
+        """
+        records = [record for record in (scan_file_dir(Path(d)) for d in file_dirs) if record]
+        conn = self._conn()
+        self._locations.clear()
+        with conn:
+            if conn.execute("SELECT 1 FROM libraries WHERE id = ?", (library_id,)).fetchone() is None:
+                self._upsert_library(conn, scan_library_dir(self.libraries_dir / library_id))
+            for record in records:
+                self._upsert_file(conn, library_id, record)
+            self._refresh_counts(conn, library_id)
+        return len(records)
+
+    def set_file_status(self, library_id: str, file_id: str, status: str):
+        """更新文件状态（不影响文库的文件计数）"""
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "UPDATE files SET status = ?, updated_at = ? WHERE library_id = ? AND file_id = ?",
+                (status, time.time(), library_id, file_id)
+            )
+
+    def remove_file(self, library_id: str, file_id: str, remove_library: bool = False):
+        """删除文件记录（file_id也可以是目录名）；remove_library为True时同时删除文库记录（文库目录已被删除）"""
+        conn = self._conn()
+        self._locations.clear()
+        with conn:
+            conn.execute("DELETE FROM files WHERE library_id = ? AND (file_id = ? OR dir_name = ?)", (library_id, file_id, file_id))
+            if remove_library:
+                conn.execute("DELETE FROM files WHERE library_id = ?", (library_id,))
+                conn.execute("DELETE FROM libraries WHERE id = ?", (library_id,))
+            else:
+                self._refresh_counts(conn, library_id)
+
+    # ---------- 查询 ----------
+
+    def get_library(self, library_id: str) -> Optional[Dict]:
+        row = self._conn().execute("SELECT * FROM libraries WHERE id = ?", (library_id,)).fetchone()
+        return dict(row) if row else None
+
+    def locate(self, file_id: str, library_id: Optional[str] = None) -> Optional[Tuple[Path, str]]:
+        """
+        查找文件的内容目录
+
+        Args:
+            file_id: 文件ID或文件目录名（/api/files 返回的id为目录名）
+            library_id: 只在该文库中查找（None表示所有文库）
+
+        Returns:
+            (内容目录, library_id)，未记录或目录已不存在时返回None
+        """
+        key = (library_id, file_id)
+        location = self._locations.get(key)
+        if location is None:
+            sql = "SELECT library_id, content_dir FROM files WHERE (file_id = ? OR dir_name = ?)"
+            params: list = [file_id, file_id]
+            if library_id is not None:
+                sql += " AND library_id = ?"
+                params.append(library_id)
+            row = self._conn().execute(sql + " LIMIT 1", params).fetchone()
+            if row is None:
+                return None
+            location = (self.libraries_dir / row['library_id'] / row['content_dir'], row['library_id'])
+            if len(self._locations) >= self._max_locations:
+                self._locations.clear()
+            self._locations[key] = location
+        # 目录可能已被其他副本或手动删除
+        if not location[0].is_dir():
+            self._locations.pop(key, None)
+            return None
+        return location
+
+    def list_files(self, library_id: Optional[str] = None, markdown_only: bool = False) -> List[Dict]:
+        """文库中的文件（library_id为None时为所有文库），按创建时间倒序"""
+        sql = "SELECT * FROM files"
+        conditions, params = [], []
+        if library_id is not None:
+            conditions.append("library_id = ?")
+            params.append(library_id)
+        if markdown_only:
+            conditions.append("has_markdown = 1")
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY created_at DESC"
+        return [dict(row) for row in self._conn().execute(sql, params).fetchall()]
+
+    def page_files(self, library_id: Optional[str] = None, sort: str = 'created_at', order: str = 'desc',
+                   status: Optional[str] = None, name_prefix: Optional[str] = None, markdown_only: bool = False,
+                   limit: Optional[int] = None, cursor: Optional[str] = None,
+                   with_total: bool = False) -> Dict:
+        """
+        按游标分页列出文件（排序和筛选都在SQLite中完成，每页的代价与文库大小无关）
+
+        Args:
+            library_id: 文库ID（None表示所有文库）
+            sort: created_at / name / size
+            order: asc / desc
+            status: 只返回该状态的文件
+            name_prefix: 文件名前缀（ASCII字母不区分大小写）
+            markdown_only: 只返回已有markdown的文件
+            limit: 每页数量（None表示不分页）
+            cursor: 上一页返回的next_cursor
+            with_total: 翻页（传入cursor）时也返回总数
+
+        Returns:
+            {'items': [...], 'total': 满足筛选条件的总数（翻页且未要求时为None）, 'next_cursor': 下一页游标或None}
+        """
+        if sort not in FILE_SORTS or order not in ('asc', 'desc'):
+            raise ValueError('不支持的排序方式')
+        sort_expr = FILE_SORTS[sort]
+        conditions, params = [], []
+        if library_id is not None:
+            conditions.append("library_id = ?")
+            params.append(library_id)
+        if markdown_only:
+            conditions.append("has_markdown = 1")
+        if status:
+            conditions.append("status = ?")
+            params.append(status)
+        if name_prefix:
+            low, high = _prefix_range(name_prefix)
+            conditions.append("filename COLLATE NOCASE >= ? AND filename COLLATE NOCASE < ?")
+            params.extend([low, high])
+        query_key = [library_id, sort, order, status, name_prefix, markdown_only]
+        where = (" WHERE " + " AND ".join(conditions)) if conditions else ""
+
+        conn = self._conn()
+        total = None
+        if cursor is None or with_total:
+            if library_id is not None and not status and not name_prefix:
+                # 只按文库（和是否有markdown）筛选时直接读取文库的计数列
+                row = conn.execute("SELECT file_count, markdown_count FROM libraries WHERE id = ?",
+                                   (library_id,)).fetchone()
+                total = (row['markdown_count'] if markdown_only else row['file_count']) if row else 0
+            else:
+                total = conn.execute("SELECT COUNT(*) FROM files" + where, params).fetchone()[0]
+        # 文库内file_id唯一，跨文库列出时再加上library_id，保证排序稳定
+        key_columns = ['file_id'] if library_id is not None else ['library_id', 'file_id']
+        return self._page(conn, "SELECT * FROM files", conditions, params, sort_expr, order,
+                          key_columns, sort, query_key, limit, cursor, total)
+
+    def page_libraries(self, user_id: str, sort: str = 'created_at', order: str = 'desc',
+                       name_prefix: Optional[str] = None, limit: Optional[int] = None,
+                       cursor: Optional[str] = None, with_total: bool = False) -> Dict:
+        """按游标分页列出用户可见的文库（参数与返回值同page_files）"""
+        if sort not in LIBRARY_SORTS or order not in ('asc', 'desc'):
+            raise ValueError('不支持的排序方式')
+        conditions = ["l.has_info = 1", "(l.user_id = ? OR l.user_id IS NULL OR l.user_id = '')"]
+        params: list = [user_id]
+        if name_prefix:
+            low, high = _prefix_range(name_prefix)
+            conditions.append("l.display_name COLLATE NOCASE >= ? AND l.display_name COLLATE NOCASE < ?")
+            params.extend([low, high])
+        query_key = [user_id, sort, order, name_prefix]
+
+        conn = self._conn()
+        total = None
+        if cursor is None or with_total:
+            total = conn.execute("SELECT COUNT(*) FROM libraries l WHERE " + " AND ".join(conditions), params).fetchone()[0]
+        base = "SELECT l.id, l.name, l.display_name, l.created_at, l.markdown_count AS file_count FROM libraries l"
+        return self._page(conn, base, conditions, params, LIBRARY_SORTS[sort], order,
+                          ['id'], sort, query_key, limit, cursor, total, key_prefix='l.')
+
+    def _page(self, conn: sqlite3.Connection, base_sql: str, conditions: List[str], params: list,
+              sort_expr: str, order: str, key_columns: List[str], sort: str, query_key: list,
+              limit: Optional[int], cursor: Optional[str], total: Optional[int], key_prefix: str = '') -> Dict:
+        """键集分页：WHERE (排序值, 主键) 在游标之后 ORDER BY 排序值, 主键 LIMIT n"""
+        conditions = list(conditions)
+        params = list(params)
+        comparison = '<' if order == 'desc' else '>'
+        if cursor:
+            payload = decode_cursor(cursor)
+            if payload.get('query') != query_key or len(payload['after']) != len(key_columns) + 1:
+                raise ValueError('分页游标与查询条件不一致')
+            columns = ', '.join([sort_expr] + [key_prefix + column for column in key_columns])
+            placeholders = ', '.join('?' * (len(key_columns) + 1))
+            # 单独的排序值范围条件让带COLLATE的排序（按名称）也能在索引上定位起点
+            conditions.append(f"{sort_expr} {comparison}= ?")
+            conditions.append(f"({columns}) {comparison} ({placeholders})")
+            params.append(payload['after'][0])
+            params.extend(payload['after'])
+
+        direction = order.upper()
+        sql = base_sql
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += f" ORDER BY {sort_expr} {direction}, " + ", ".join(f"{key_prefix}{column} {direction}" for column in key_columns)
+        if limit is not None:
+            # 多取一行判断是否还有下一页
+            sql += " LIMIT ?"
+            params.append(limit + 1)
+        rows = [dict(row) for row in conn.execute(sql, params).fetchall()]
+
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            sort_value = {'name': last.get('filename', last.get('display_name')),
+                          'size': last.get('size')}.get(sort, last.get('created_at'))
+            next_cursor = encode_cursor({
+                'query': query_key,
+                'after': [sort_value] + [last[column] for column in key_columns]
+            })
+        return {'items': rows, 'total': total, 'next_cursor': next_cursor}
+
+
+def main(argv: Optional[List[str]] = None):
+    import argparse
+    from config import Config
+
+    parser = argparse.ArgumentParser(description="文库与文件目录")
+    parser.add_argument('command', choices=['rebuild'], help="rebuild: 从磁盘重建目录")
+    args = parser.parse_args(argv)
+
+    catalog = LibraryCatalog(Config.CATALOG_DB_PATH, Config.OUTPUT_DIR / 'libraries')
+    start = time.perf_counter()
+    counts = catalog.rebuild()
+    print(f"✅ 目录重建完成: {counts['libraries']} 个文库，{counts['files']} 个文件（{time.perf_counter() - start:.2f}s）")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
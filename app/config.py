@@ -7,7 +7,8 @@ class Config:
     
     # 基础路径配置
     BASE_DIR = Path(__file__).parent.parent
-    DATA_DIR = BASE_DIR / "data"
+    # 数据目录可通过环境变量指定（如压测时使用独立目录）
+    DATA_DIR = Path(os.environ.get('DATA_DIR') or BASE_DIR / "data")
     INPUT_DIR = DATA_DIR / "input"
     OUTPUT_DIR = DATA_DIR / "output"
     LOGS_DIR = DATA_DIR / "logs"
@@ -28,6 +29,12 @@ class Config:
     MINERU_API_TOKEN = os.environ.get('MINERU_API_TOKEN')
     MINERU_USE_LOCAL = os.environ.get('MINERU_USE_LOCAL', 'false').lower() == 'true'
     MINERU_LOCAL_URL = os.environ.get('MINERU_LOCAL_URL', 'http://127.0.0.1:30000')
+    MINERU_API_BASE_URL = os.environ.get('MINERU_API_BASE_URL', 'https://mineru.net/api/v4')
+    # 在线模式轮询批次状态的间隔（秒）
+    MINERU_POLL_INTERVAL = float(os.environ.get('MINERU_POLL_INTERVAL', '10'))
+    # 本地模式：同时运行的MinerU进程数（按vLLM后端的承载能力设置，同一进程内的所有任务共享）与单个文件的超时（秒）
+    MINERU_LOCAL_CONCURRENCY = int(os.environ.get('MINERU_LOCAL_CONCURRENCY', '2'))
+    MINERU_LOCAL_TIMEOUT = float(os.environ.get('MINERU_LOCAL_TIMEOUT', '600'))
     
     # RAG/LLM配置
     OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
@@ -35,9 +42,89 @@ class Config:
     OPENAI_MODEL = os.environ.get('OPENAI_MODEL', 'gpt-5')
     OPENAI_TEMPERATURE = float(os.environ.get('OPENAI_TEMPERATURE', '0.7'))
     
+    # 按用户LLM客户端池配置
+    LLM_POOL_SIZE = int(os.environ.get('LLM_POOL_SIZE', '32'))
+    LLM_KEEPALIVE_CONNECTIONS = int(os.environ.get('LLM_KEEPALIVE_CONNECTIONS', '8'))
+    LLM_KEEPALIVE_EXPIRY = float(os.environ.get('LLM_KEEPALIVE_EXPIRY', '60'))
+    LLM_TIMEOUT = float(os.environ.get('LLM_TIMEOUT', '120'))
+    
     # 向量数据库配置
     VECTOR_DB_DIR = DATA_DIR / "vectorDatabase"
     
+    # 构建向量数据库时是否预生成论文摘要，以及生成摘要的最大并发LLM调用数
+    RAG_BUILD_SUMMARIES = os.environ.get('RAG_BUILD_SUMMARIES', 'false').lower() == 'true'
+    RAG_SUMMARY_WORKERS = int(os.environ.get('RAG_SUMMARY_WORKERS', '4'))
+    
+    # 两级检索：文库论文数超过阈值时，先按论文级向量选出top N篇论文，再在其中检索文本块
+    RAG_PAPER_TOP_N = int(os.environ.get('RAG_PAPER_TOP_N', '5'))
+    RAG_HIERARCHICAL_MIN_PAPERS = int(os.environ.get('RAG_HIERARCHICAL_MIN_PAPERS', '10'))
+    
+    # 相关论文kNN图中每篇论文保留的相似论文数
+    RAG_RELATED_TOP_N = int(os.environ.get('RAG_RELATED_TOP_N', '10'))
+    
+    # 邻接文本块扩展：命中块向前后各扩展的块数（0表示关闭），以及问答上下文的字符预算
+    RAG_NEIGHBOR_CHUNKS = int(os.environ.get('RAG_NEIGHBOR_CHUNKS', '1'))
+    RAG_CONTEXT_CHARS = int(os.environ.get('RAG_CONTEXT_CHARS', '4000'))
+    
+    # 版本化索引：每个文库保留的历史版本数（含当前版本），以及内存中缓存的已加载文库数
+    RAG_INDEX_KEEP_VERSIONS = int(os.environ.get('RAG_INDEX_KEEP_VERSIONS', '2'))
+    RAG_INDEX_CACHE_SIZE = int(os.environ.get('RAG_INDEX_CACHE_SIZE', '4'))
+    
+    # 构建租约（多副本共享存储时协调同一文库的构建）：租约时长与等待其他构建完成的最长时间（秒）
+    RAG_BUILD_LEASE_SECONDS = float(os.environ.get('RAG_BUILD_LEASE_SECONDS', '60'))
+    RAG_BUILD_WAIT_TIMEOUT = float(os.environ.get('RAG_BUILD_WAIT_TIMEOUT', '1800'))
+    
+    # 文库与文件目录（SQLite），以及启动时是否从磁盘重建（目录为空时总会重建）
+    CATALOG_DB_PATH = Path(os.environ.get('CATALOG_DB_PATH') or DATA_DIR / "catalog.sqlite")
+    CATALOG_REBUILD_ON_START = os.environ.get('CATALOG_REBUILD_ON_START', 'false').lower() == 'true'
+    
+    # 文库全文检索索引（SQLite FTS5）
+    SEARCH_INDEX_DB_PATH = Path(os.environ.get('SEARCH_INDEX_DB_PATH') or DATA_DIR / "search_index.sqlite")
+    
+    # 异步解析任务：任务数据库路径、工作线程数（同时执行的解析任务数）、租约时长（秒，进程退出后
+    # 超过该时长任务由其他进程或重启后的进程接管）、单个任务最多执行次数
+    INGEST_JOBS_DB_PATH = Path(os.environ.get('INGEST_JOBS_DB_PATH') or DATA_DIR / "ingest_jobs.sqlite")
+    INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', '2'))
+    # 为false时后端进程不启动解析工作线程（如只导入app做维护脚本，或由单独的进程执行解析任务）
+    INGEST_WORKERS_AUTOSTART = os.environ.get('INGEST_WORKERS_AUTOSTART', 'true').lower() == 'true'
+    INGEST_JOB_LEASE_SECONDS = float(os.environ.get('INGEST_JOB_LEASE_SECONDS', '120'))
+    INGEST_JOB_MAX_ATTEMPTS = int(os.environ.get('INGEST_JOB_MAX_ATTEMPTS', '3'))
+    
+    # 解析结果去重：内容相同且解析参数相同的上传直接复用已有结果（硬链接），不再调用MinerU
+    # MINERU_MODEL_VERSION 参与去重键，升级MinerU模型后修改它可使旧结果失效
+    RESULT_STORE_ENABLED = os.environ.get('RESULT_STORE_ENABLED', 'true').lower() == 'true'
+    RESULT_STORE_DIR = Path(os.environ.get('RESULT_STORE_DIR') or DATA_DIR / "result_store")
+    MINERU_MODEL_VERSION = os.environ.get('MINERU_MODEL_VERSION', 'vlm')
+    
+    # 文档内容缓存（改写后的响应体及gzip/brotli版本）的内存上限（字节），0表示不缓存
+    CONTENT_CACHE_MAX_BYTES = int(os.environ.get('CONTENT_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+    
+    # 图片响应：浏览器缓存时长（秒），以及由前端代理发送文件内容的方式
+    # IMAGE_SENDFILE 为空时由Flask发送；x-accel-redirect（nginx）返回 IMAGE_ACCEL_REDIRECT_PREFIX + 相对OUTPUT_DIR的路径；
+    # x-sendfile（Apache mod_xsendfile / lighttpd）返回文件绝对路径
+    IMAGE_CACHE_MAX_AGE = int(os.environ.get('IMAGE_CACHE_MAX_AGE', '86400'))
+    IMAGE_SENDFILE = os.environ.get('IMAGE_SENDFILE', '').strip().lower()
+    IMAGE_ACCEL_REDIRECT_PREFIX = os.environ.get('IMAGE_ACCEL_REDIRECT_PREFIX', '/_protected_output/')
+    
+    # 图片版本（需要Pillow）：预设宽度、WebP/JPEG压缩质量、是否在处理完成时预先生成（否则首次请求时生成）
+    IMAGE_VARIANT_WIDTHS = os.environ.get('IMAGE_VARIANT_WIDTHS', '480,960,1600')
+    IMAGE_WEBP_QUALITY = int(os.environ.get('IMAGE_WEBP_QUALITY', '80'))
+    IMAGE_VARIANTS_AT_INGEST = os.environ.get('IMAGE_VARIANTS_AT_INGEST', 'false').lower() == 'true'
+    
+    # 文库所有者缓存：间隔多久（秒）才重新检查info.json的mtime，0表示每次请求都检查
+    LIBRARY_ACL_RECHECK_SECONDS = float(os.environ.get('LIBRARY_ACL_RECHECK_SECONDS', '2'))
+    LIBRARY_ACL_CACHE_SIZE = int(os.environ.get('LIBRARY_ACL_CACHE_SIZE', '10000'))
+    
+    # 查询日志：单个文件大小上限（超过后轮转并gzip压缩）、压缩文件保留天数、待写入队列长度与批量写入间隔（秒）
+    QUERY_LOG_MAX_BYTES = int(os.environ.get('QUERY_LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+    QUERY_LOG_RETENTION_DAYS = int(os.environ.get('QUERY_LOG_RETENTION_DAYS', '30'))
+    QUERY_LOG_QUEUE_SIZE = int(os.environ.get('QUERY_LOG_QUEUE_SIZE', '10000'))
+    QUERY_LOG_FLUSH_INTERVAL = float(os.environ.get('QUERY_LOG_FLUSH_INTERVAL', '1.0'))
+    
+    # /metrics 访问控制：携带 Authorization: Bearer <METRICS_TOKEN>，或客户端地址在允许列表中（逗号分隔，支持CIDR）
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None
+    METRICS_ALLOWED_IPS = [item.strip() for item in os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',') if item.strip()]
+    
     # 应用信息
     APP_NAME = "览树"
     APP_VERSION = "1.0.0"
@@ -67,9 +154,9 @@ class Config:
     def init_app(cls, app):
         """初始化应用配置"""
         # 确保必要的目录存在
-        cls.INPUT_DIR.mkdir(exist_ok=True)
-        cls.OUTPUT_DIR.mkdir(exist_ok=True)
-        cls.LOGS_DIR.mkdir(exist_ok=True)
+        cls.INPUT_DIR.mkdir(parents=True, exist_ok=True)
+        cls.OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+        cls.LOGS_DIR.mkdir(parents=True, exist_ok=True)
         
         # 设置Flask配置
         app.config['SECRET_KEY'] = cls.SECRET_KEY
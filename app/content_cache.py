@@ -0,0 +1,166 @@
+"""
+文档内容缓存
+按 (markdown文件, mtime, 图片路径改写方式) 缓存改写后的JSON响应体及其gzip/brotli压缩版本，
+并为每个版本生成强ETag，重复查看同一文档时无需再读文件、跑正则和序列化，浏览器缓存有效时只返回304
+"""
+
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional
+
+try:
+    import brotli
+except ImportError:
+    # brotli为可选依赖，未安装时只提供gzip
+    brotli = None
+
+
+# 小于该大小的响应不压缩
+MIN_COMPRESS_BYTES = 1024
+
+
+def parse_accept_encoding(header: Optional[str]) -> Dict[str, float]:
+    """解析Accept-Encoding为 {编码: q值}"""
+    result = {}
+    for part in (header or '').split(','):
+        token, _, params = part.strip().partition(';')
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        result[token] = q
+    return result
+
+
+class CachedContent:
+    """一份响应体及其压缩版本"""
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.etag = hashlib.sha1(body).hexdigest()[:32]
+        self._variants: Dict[str, bytes] = {}
+        # 同一编码只压缩一次：并发的首次请求等待第一个请求压缩完成
+        self._compress_lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + sum(len(v) for v in self._variants.values())
+
+    def choose_encoding(self, accept_encoding: Optional[str]) -> Optional[str]:
+        """按客户端支持选择压缩方式（优先brotli），不压缩时返回None"""
+        if len(self.body) < MIN_COMPRESS_BYTES:
+            return None
+        accepted = parse_accept_encoding(accept_encoding)
+        if brotli is not None and accepted.get('br', 0) > 0:
+            return 'br'
+        if accepted.get('gzip', 0) > 0:
+            return 'gzip'
+        return None
+
+    def compress(self, encoding: str) -> bytes:
+        """压缩响应体（不缓存结果，由ContentCache.encoded()计入缓存大小后保存）"""
+        if encoding == 'br':
+            return brotli.compress(self.body, quality=5)
+        return gzip.compress(self.body, compresslevel=6)
+
+    def etag_for(self, encoding: Optional[str]) -> str:
+        """各编码版本的强ETag（内容不同，ETag也不同）"""
+        return f'"{self.etag}-{encoding}"' if encoding else f'"{self.etag}"'
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        """If-None-Match是否命中（任一编码版本的ETag都视为同一内容）"""
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == '*':
+            return True
+        for tag in if_none_match.split(','):
+            tag = tag.strip()
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            tag = tag.strip('"')
+            if tag == self.etag or tag.rsplit('-', 1)[0] == self.etag:
+                return True
+        return False
+
+
+class ContentCache:
+    """按总字节数淘汰的LRU缓存"""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, CachedContent]" = OrderedDict()
+        self._lock = threading.Lock()
+        # 已缓存条目（含压缩版本）的总字节数，随插入、压缩和淘汰增量维护
+        self._bytes = 0
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, key: Hashable) -> Optional[CachedContent]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry
+
+    def put(self, key: Hashable, body: bytes) -> CachedContent:
+        entry = CachedContent(body)
+        if self.max_bytes <= 0:
+            return entry
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.size
+            self._entries[key] = entry
+            self._bytes += entry.size
+            self._evict()
+        return entry
+
+    def encoded(self, key: Hashable, entry: CachedContent, encoding: Optional[str]) -> bytes:
+        """
+        返回条目指定编码的响应体；首次请求该编码时压缩，压缩版本计入缓存大小并按需淘汰
+
+        Args:
+            key: 条目的缓存键（条目已被淘汰时压缩版本只保存在条目上，不计入缓存）
+            entry: get()/put() 返回的条目
+            encoding: choose_encoding() 选出的编码，None表示不压缩
+        """
+        if encoding is None:
+            return entry.body
+        data = entry._variants.get(encoding)
+        if data is not None:
+            return data
+        with entry._compress_lock:
+            data = entry._variants.get(encoding)
+            if data is not None:
+                return data
+            data = entry.compress(encoding)
+            with self._lock:
+                entry._variants[encoding] = data
+                if self._entries.get(key) is entry:
+                    self._bytes += len(data)
+                    self._evict()
+        return data
+
+    def _evict(self):
+        """淘汰最久未使用的条目直到总大小不超过上限（至少保留一个条目，需持有锁）"""
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, oldest = self._entries.popitem(last=False)
+            self._bytes -= oldest.size
+            self._stats['evictions'] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            result = dict(self._stats)
+            result['entries'] = len(self._entries)
+            result['bytes'] = self._bytes
+        return result
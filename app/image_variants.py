@@ -0,0 +1,193 @@
+"""
+文档图片的WebP与多宽度版本
+按请求的 Accept 和宽度参数 w 选择图片版本：浏览器支持WebP时返回WebP，指定宽度时缩放到
+不小于该宽度的最小预设宽度；生成的版本保存在原图旁的 images/.variants/ 中，原图更新后重新生成。
+未安装Pillow时始终返回原图
+"""
+
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+try:
+    from PIL import Image, features
+    WEBP_SUPPORTED = features.check('webp')
+except ImportError:
+    # Pillow为可选依赖，未安装时不生成任何版本
+    Image = None
+    WEBP_SUPPORTED = False
+
+
+VARIANTS_DIRNAME = '.variants'
+# 可以转换的原图格式（GIF可能是动图，保持原样）
+SOURCE_SUFFIXES = {'.jpg', '.jpeg', '.png', '.bmp', '.webp'}
+_SAVE_FORMATS = {'.webp': 'WEBP', '.jpg': 'JPEG', '.jpeg': 'JPEG', '.png': 'PNG', '.bmp': 'PNG'}
+
+
+def parse_widths(value: str) -> List[int]:
+    """解析逗号分隔的预设宽度"""
+    widths = set()
+    for part in (value or '').split(','):
+        part = part.strip()
+        if part.isdigit() and int(part) > 0:
+            widths.add(int(part))
+    return sorted(widths)
+
+
+def accepts_webp(accept: Optional[str]) -> bool:
+    """Accept头是否接受image/webp"""
+    for part in (accept or '').split(','):
+        token, _, params = part.strip().partition(';')
+        if token.strip().lower() != 'image/webp':
+            continue
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+class ImageVariants:
+    """图片版本的选择与生成"""
+
+    def __init__(self, widths: Iterable[int] = (480, 960, 1600), webp_quality: int = 80):
+        """
+        Args:
+            widths: 预设宽度，请求的宽度会向上取到其中之一，避免为任意宽度生成文件
+            webp_quality: WebP与JPEG的压缩质量
+        """
+        self.widths = sorted(set(widths))
+        self.webp_quality = webp_quality
+        self._stats = {'generated': 0, 'failed': 0}
+        self._stats_lock = threading.Lock()
+        # 原图宽度缓存: (路径, mtime_ns) -> 宽度，只读取图片头
+        self._source_widths: Dict[tuple, int] = {}
+        self._max_source_widths = 10000
+
+    @property
+    def enabled(self) -> bool:
+        return Image is not None
+
+    def snap_width(self, width: Optional[int]) -> Optional[int]:
+        """把请求的宽度取到不小于它的最小预设宽度，超过所有预设宽度时返回None（原始宽度）"""
+        if not width or width <= 0:
+            return None
+        for preset in self.widths:
+            if preset >= width:
+                return preset
+        return None
+
+    @staticmethod
+    def variant_path(image_file: Path, width: Optional[int], suffix: str) -> Path:
+        """版本文件路径: images/.variants/{原文件名}.{w宽度|full}{后缀}"""
+        label = f"w{width}" if width else "full"
+        return image_file.parent / VARIANTS_DIRNAME / f"{image_file.name}.{label}{suffix}"
+
+    def select(self, image_file: Path, accept: Optional[str] = None, width: Optional[int] = None) -> Path:
+        """
+        选择要返回的图片文件
+
+        Args:
+            image_file: 原图
+            accept: 请求的Accept头
+            width: 请求的显示宽度（像素）
+
+        Returns:
+            版本文件，不需要或无法生成时返回原图
+        """
+        image_file = Path(image_file)
+        suffix = image_file.suffix.lower()
+        if not self.enabled or suffix not in SOURCE_SUFFIXES:
+            return image_file
+        width = self.snap_width(width)
+        webp = WEBP_SUPPORTED and accepts_webp(accept)
+        target_suffix = '.webp' if webp else suffix
+        if width is None and target_suffix == suffix:
+            return image_file
+
+        try:
+            source_stat = image_file.stat()
+            # 原图不比预设宽度宽时不缩放
+            if width is not None and self._source_width(image_file, source_stat.st_mtime_ns) <= width:
+                width = None
+                if target_suffix == suffix:
+                    return image_file
+            target = self.variant_path(image_file, width, target_suffix)
+            try:
+                target_stat = target.stat()
+            except FileNotFoundError:
+                target_stat = None
+            if target_stat is None or target_stat.st_mtime_ns < source_stat.st_mtime_ns:
+                if not self._generate(image_file, target, width):
+                    return image_file
+                target_stat = target.stat()
+        except Exception:
+            return image_file
+        # 转换后反而更大（如本来就很小的PNG）时返回原图
+        if target_stat.st_size >= source_stat.st_size:
+            return image_file
+        return target
+
+    def _source_width(self, image_file: Path, mtime_ns: int) -> int:
+        key = (str(image_file), mtime_ns)
+        width = self._source_widths.get(key)
+        if width is None:
+            with Image.open(image_file) as img:
+                width = img.width
+            if len(self._source_widths) >= self._max_source_widths:
+                self._source_widths.clear()
+            self._source_widths[key] = width
+        return width
+
+    def _generate(self, image_file: Path, target: Path, width: Optional[int]) -> bool:
+        """生成一个版本（先写临时文件再原子替换，并发请求重复生成也不会读到半个文件）"""
+        tmp_path = target.with_name(f"{target.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            target.parent.mkdir(exist_ok=True)
+            with Image.open(image_file) as img:
+                img.load()
+                if width and img.width > width:
+                    height = max(1, round(img.height * width / img.width))
+                    img = img.resize((width, height), Image.LANCZOS)
+                fmt = _SAVE_FORMATS[target.suffix.lower()]
+                if fmt == 'JPEG' and img.mode not in ('RGB', 'L'):
+                    img = img.convert('RGB')
+                elif fmt == 'WEBP' and img.mode not in ('RGB', 'RGBA'):
+                    img = img.convert('RGBA' if 'A' in img.getbands() or 'transparency' in img.info else 'RGB')
+                options = {'quality': self.webp_quality} if fmt in ('WEBP', 'JPEG') else {'optimize': True}
+                img.save(tmp_path, format=fmt, **options)
+            os.replace(tmp_path, target)
+            self._count('generated')
+            return True
+        except Exception as e:
+            self._count('failed')
+            print(f"⚠️ 生成图片版本失败 ({image_file.name}): {str(e)}")
+            try:
+                tmp_path.unlink()
+            except OSError:
+                pass
+            return False
+
+    def build_all(self, images_dir: Path) -> int:
+        """预先为目录中的所有图片生成WebP版本（原始宽度及各预设宽度），返回生成的图片数"""
+        if not self.enabled or not WEBP_SUPPORTED or not Path(images_dir).is_dir():
+            return 0
+        count = 0
+        for image_file in Path(images_dir).iterdir():
+            if image_file.is_file() and image_file.suffix.lower() in SOURCE_SUFFIXES:
+                for width in [None] + self.widths:
+                    self.select(image_file, 'image/webp', width)
+                count += 1
+        return count
+
+    def _count(self, key: str):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return dict(self._stats)
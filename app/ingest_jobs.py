@@ -0,0 +1,469 @@
+"""
+异步解析任务
+上传请求只保存文件并登记任务（SQLite），由后台常驻的工作线程池执行MinerU解析和入库，前端按任务ID查询进度。
+运行中的任务持有租约并定期续期；进程退出后租约过期，任务会被重新领取执行，因此后端重启后未完成的任务会自动恢复。
+取消等待中的任务直接生效；运行中的任务由执行它的进程在下一次检查时终止
+
+用法:
+    python app/ingest_jobs.py selfcheck    # 在临时数据库上检查租约过期重领、执行次数上限和解析中取消
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    user_id TEXT,
+    library_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stage TEXT,
+    payload TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    total_files INTEGER NOT NULL DEFAULT 0,
+    done_files INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    updated_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs(user_id, created_at);
+"""
+
+# queued: 等待执行  running: 执行中（持有租约）  completed: 完成  failed: 失败  cancelled: 已取消
+JOB_STATUSES = ('queued', 'running', 'completed', 'failed', 'cancelled')
+FINISHED_STATUSES = ('completed', 'failed', 'cancelled')
+
+
+class JobStore:
+    """解析任务表（多个进程共享同一数据库时，领取任务是原子的）"""
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        """每个线程一个连接（WAL模式下读不阻塞写）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row, with_payload: bool = False) -> Dict:
+        job = dict(row)
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        payload = job.pop('payload')
+        if with_payload:
+            job['payload'] = json.loads(payload)
+        return job
+
+    def create(self, user_id: Optional[str], library_id: str, payload: Dict, total_files: int) -> Dict:
+        """登记一个等待执行的任务"""
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT INTO jobs (job_id, user_id, library_id, status, stage, payload, total_files,"
+                " created_at, updated_at) VALUES (?, ?, ?, 'queued', 'queued', ?, ?, ?, ?)",
+                (job_id, user_id, library_id, json.dumps(payload, ensure_ascii=False), total_files, now, now)
+            )
+        return self.get(job_id)
+
+    def get(self, job_id: str, with_payload: bool = False) -> Optional[Dict]:
+        row = self._conn().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._to_dict(row, with_payload) if row else None
+
+    def list(self, user_id: Optional[str], library_id: Optional[str] = None,
+             status: Optional[str] = None, limit: int = 20) -> List[Dict]:
+        """用户最近的任务（按创建时间倒序）"""
+        where, params = ["user_id IS ?"], [user_id]
+        if library_id:
+            where.append("library_id = ?")
+            params.append(library_id)
+        if status:
+            where.append("status = ?")
+            params.append(status)
+        rows = self._conn().execute(
+            f"SELECT * FROM jobs WHERE {' AND '.join(where)} ORDER BY created_at DESC LIMIT ?",
+            params + [limit]
+        ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def claim(self, worker: str, lease_seconds: float, max_attempts: int) -> Optional[Dict]:
+        """
+        领取一个任务：等待中的任务，或租约已过期的运行中任务（执行它的进程已退出）
+
+        Returns:
+            带payload的任务，没有可领取的任务时返回None
+        """
+        conn = self._conn()
+        while True:
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued' OR (status = 'running' AND lease_until < ?)"
+                    " ORDER BY created_at LIMIT 1", (now,)
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                if row['cancel_requested']:
+                    # 执行它的进程在取消生效前退出了
+                    conn.execute(
+                        "UPDATE jobs SET status = 'cancelled', stage = 'cancelled', worker = NULL,"
+                        " lease_until = NULL, updated_at = ?, finished_at = ? WHERE job_id = ?",
+                        (now, now, row['job_id'])
+                    )
+                    conn.execute("COMMIT")
+                    continue
+                if row['attempts'] >= max_attempts:
+                    # 多次执行都没能完成（如每次都导致进程退出），不再重试
+                    conn.execute(
+                        "UPDATE jobs SET status = 'failed', stage = 'failed', error = ?, worker = NULL,"
+                        " lease_until = NULL, updated_at = ?, finished_at = ? WHERE job_id = ?",
+                        (f'任务执行了 {row["attempts"]} 次仍未完成', now, now, row['job_id'])
+                    )
+                    conn.execute("COMMIT")
+                    continue
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', stage = 'starting', worker = ?, lease_until = ?,"
+                    " attempts = attempts + 1, started_at = COALESCE(started_at, ?), updated_at = ?"
+                    " WHERE job_id = ?",
+                    (worker, now + lease_seconds, now, now, row['job_id'])
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            return self.get(row['job_id'], with_payload=True)
+
+    def renew(self, job_ids: List[str], worker: str, lease_seconds: float):
+        """为本进程执行中的任务续租"""
+        if not job_ids:
+            return
+        now = time.time()
+        with self._conn() as conn:
+            conn.executemany(
+                "UPDATE jobs SET lease_until = ? WHERE job_id = ? AND worker = ? AND status = 'running'",
+                [(now + lease_seconds, job_id, worker) for job_id in job_ids]
+            )
+
+    def update_progress(self, job_id: str, worker: str, stage: str, done_files: Optional[int] = None):
+        with self._conn() as conn:
+            conn.execute(
+                "UPDATE jobs SET stage = ?, done_files = COALESCE(?, done_files), updated_at = ?"
+                " WHERE job_id = ? AND worker = ?",
+                (stage, done_files, time.time(), job_id, worker)
+            )
+
+    def finish(self, job_id: str, worker: str, status: str, result: Optional[Dict] = None,
+               error: Optional[str] = None) -> bool:
+        """记录任务结果（租约已被其他进程接管时不覆盖）"""
+        now = time.time()
+        with self._conn() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, stage = ?, result = ?, error = ?, worker = NULL, lease_until = NULL,"
+                " updated_at = ?, finished_at = ? WHERE job_id = ? AND worker = ?",
+                (status, status, json.dumps(result, ensure_ascii=False) if result is not None else None,
+                 error, now, now, job_id, worker)
+            )
+        return cursor.rowcount > 0
+
+    def request_cancel(self, job_id: str) -> Optional[Dict]:
+        """取消任务：等待中的任务直接标记为已取消，运行中的任务标记取消请求"""
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'cancelled', stage = 'cancelled', updated_at = ?, finished_at = ?"
+                " WHERE job_id = ? AND status = 'queued'", (now, now, job_id)
+            )
+            conn.execute(
+                "UPDATE jobs SET cancel_requested = 1, updated_at = ? WHERE job_id = ? AND status = 'running'",
+                (now, job_id)
+            )
+        return self.get(job_id)
+
+    def cancel_requested(self, job_ids: List[str]) -> List[str]:
+        """其中已请求取消的任务"""
+        if not job_ids:
+            return []
+        placeholders = ','.join('?' * len(job_ids))
+        rows = self._conn().execute(
+            f"SELECT job_id FROM jobs WHERE cancel_requested = 1 AND job_id IN ({placeholders})", job_ids
+        ).fetchall()
+        return [row['job_id'] for row in rows]
+
+    def counts(self) -> Dict[str, int]:
+        """各状态的任务数"""
+        counts = {status: 0 for status in JOB_STATUSES}
+        for row in self._conn().execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status"):
+            counts[row['status']] = row['n']
+        return counts
+
+
+class IngestWorkerPool:
+    """常驻的解析工作线程池"""
+
+    def __init__(self, store: JobStore, handler: Callable[[Dict, Callable, threading.Event], Dict], workers: int = 2,
+                 lease_seconds: float = 120, max_attempts: int = 3, poll_interval: float = 5.0):
+        """
+        Args:
+            store: 任务表
+            handler: 执行任务的函数 handler(job, progress, cancel_event)，返回结果字典（success为False时任务记为失败），
+                     progress(stage, done_files=None) 用于汇报进度，cancel_event 在任务被取消或进程退出时置位
+            workers: 工作线程数（同时执行的任务数）
+            lease_seconds: 租约时长，进程退出后超过该时长任务才会被重新领取
+            max_attempts: 单个任务最多执行的次数
+            poll_interval: 空闲时检查其他进程遗留任务的间隔（秒），本进程提交的任务会立即唤醒工作线程
+        """
+        self.store = store
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._wakeup = threading.Condition()
+        self._pending_wakeups = 0
+        self._stop = threading.Event()
+        # 执行中的任务: job_id -> 取消事件
+        self._active: Dict[str, threading.Event] = {}
+        self._active_lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+
+    def start(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"ingest-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        heartbeat = threading.Thread(target=self._heartbeat, name="ingest-heartbeat", daemon=True)
+        heartbeat.start()
+        self._threads.append(heartbeat)
+        print(f"🧵 解析任务工作线程已启动: {self.workers} 个")
+
+    def stop(self, timeout: float = 5.0):
+        """停止领取任务并中断执行中的任务（它们的租约过期后由重启的进程重新执行）"""
+        self._stop.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        with self._active_lock:
+            events = list(self._active.values())
+        for event in events:
+            event.set()
+        deadline = time.time() + timeout
+        while self.active_count() and time.time() < deadline:
+            time.sleep(0.1)
+
+    def cancel(self, job_id: str) -> bool:
+        """取消本进程中执行的任务，任务不在本进程时返回False"""
+        with self._active_lock:
+            event = self._active.get(job_id)
+        if event is None:
+            return False
+        event.set()
+        return True
+
+    def notify(self):
+        """有新任务时唤醒一个空闲的工作线程"""
+        with self._wakeup:
+            self._pending_wakeups += 1
+            self._wakeup.notify()
+
+    def active_count(self) -> int:
+        with self._active_lock:
+            return len(self._active)
+
+    def _wait(self):
+        with self._wakeup:
+            if self._pending_wakeups == 0:
+                self._wakeup.wait(self.poll_interval)
+            self._pending_wakeups = max(0, self._pending_wakeups - 1)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job = self.store.claim(self.worker_id, self.lease_seconds, self.max_attempts)
+            except Exception as e:
+                print(f"⚠️ 领取解析任务失败: {str(e)}")
+                job = None
+            if job is None:
+                self._wait()
+                continue
+            self._execute(job)
+
+    def _execute(self, job: Dict):
+        job_id = job['job_id']
+        cancel_event = threading.Event()
+        with self._active_lock:
+            self._active[job_id] = cancel_event
+        if job['attempts'] > 1:
+            print(f"🔁 恢复解析任务 {job_id}（第 {job['attempts']} 次执行）")
+
+        def progress(stage: str, done_files: Optional[int] = None):
+            try:
+                self.store.update_progress(job_id, self.worker_id, stage, done_files)
+            except Exception as e:
+                print(f"⚠️ 更新任务进度失败 ({job_id}): {str(e)}")
+
+        try:
+            result = self.handler(job, progress, cancel_event)
+            if self._stop.is_set():
+                # 进程退出中断的任务保留为运行中，租约过期后重新执行
+                print(f"⏸️ 解析任务 {job_id} 因进程退出中断")
+            elif cancel_event.is_set():
+                self.store.finish(job_id, self.worker_id, 'cancelled', result)
+                print(f"🛑 解析任务 {job_id} 已取消")
+            elif result.get('success'):
+                self.store.finish(job_id, self.worker_id, 'completed', result)
+            else:
+                self.store.finish(job_id, self.worker_id, 'failed', result, result.get('error') or '处理失败')
+        except Exception as e:
+            traceback.print_exc()
+            self.store.finish(job_id, self.worker_id, 'failed', error=f'任务执行失败: {str(e)}')
+        finally:
+            with self._active_lock:
+                self._active.pop(job_id, None)
+
+    def _heartbeat(self):
+        # 在租约时长的三分之一时续租，留出两次失败的余量；取消请求（可能来自其他进程）每秒检查一次
+        renew_interval = max(1.0, self.lease_seconds / 3)
+        last_renew = time.time()
+        while not self._stop.wait(1.0):
+            with self._active_lock:
+                active = dict(self._active)
+            if not active:
+                continue
+            try:
+                for job_id in self.store.cancel_requested(list(active)):
+                    active[job_id].set()
+                if time.time() - last_renew >= renew_interval:
+                    self.store.renew(list(active), self.worker_id, self.lease_seconds)
+                    last_renew = time.time()
+            except Exception as e:
+                print(f"⚠️ 解析任务续租失败: {str(e)}")
+
+
+def selfcheck() -> List[str]:
+    """
+    在临时数据库上检查任务表和工作线程池的关键行为
+
+    Returns:
+        未通过的检查项（为空表示全部通过）
+    """
+    import shutil
+    import tempfile
+
+    failures = []
+
+    def check(name: str, condition: bool):
+        print(f"   {'✅' if condition else '❌'} {name}")
+        if not condition:
+            failures.append(name)
+
+    tmp_dir = Path(tempfile.mkdtemp(prefix='ingest_jobs_check_'))
+    try:
+        store = JobStore(tmp_dir / 'jobs.sqlite')
+
+        # 租约过期后由其他进程重新领取，原进程的结果不再覆盖
+        job = store.create('u', 'lib', {}, 1)
+        first = store.claim('worker-a', lease_seconds=0.2, max_attempts=3)
+        check("领取等待中的任务", first is not None and first['job_id'] == job['job_id'] and first['attempts'] == 1)
+        check("租约有效期内不能被重复领取", store.claim('worker-b', lease_seconds=0.2, max_attempts=3) is None)
+        time.sleep(0.3)
+        second = store.claim('worker-b', lease_seconds=60, max_attempts=3)
+        check("租约过期后被重新领取", second is not None and second['job_id'] == job['job_id']
+              and second['attempts'] == 2 and second['worker'] == 'worker-b')
+        check("原执行者的结果不覆盖接管者", not store.finish(job['job_id'], 'worker-a', 'completed', {}))
+        check("接管者记录结果", store.finish(job['job_id'], 'worker-b', 'completed', {'success': True})
+              and store.get(job['job_id'])['status'] == 'completed')
+
+        # 达到最多执行次数的任务不再领取，记为失败
+        job = store.create('u', 'lib', {}, 1)
+        check("领取新任务", store.claim('worker-a', lease_seconds=0.1, max_attempts=1) is not None)
+        time.sleep(0.2)
+        check("超过最多执行次数后不再领取", store.claim('worker-b', lease_seconds=60, max_attempts=1) is None)
+        check("超过最多执行次数的任务记为失败", store.get(job['job_id'])['status'] == 'failed')
+
+        # 等待中的任务取消后直接生效；执行者退出前请求的取消在重新领取时生效
+        job = store.create('u', 'lib', {}, 1)
+        check("取消等待中的任务", store.request_cancel(job['job_id'])['status'] == 'cancelled'
+              and store.claim('worker-a', lease_seconds=60, max_attempts=3) is None)
+        job = store.create('u', 'lib', {}, 1)
+        store.claim('worker-a', lease_seconds=0.1, max_attempts=3)
+        store.request_cancel(job['job_id'])
+        time.sleep(0.2)
+        check("执行者退出后取消请求在重新领取时生效",
+              store.claim('worker-b', lease_seconds=60, max_attempts=3) is None
+              and store.get(job['job_id'])['status'] == 'cancelled')
+
+        # 解析中的任务被（其他进程）取消：心跳线程置位取消事件，任务记为已取消
+        parsing = threading.Event()
+
+        def handler(job, progress, cancel_event):
+            progress('parsing', 0)
+            parsing.set()
+            cancelled = cancel_event.wait(10)
+            return {'success': not cancelled, 'error': '已取消' if cancelled else None}
+
+        pool = IngestWorkerPool(store, handler, workers=1, lease_seconds=60, max_attempts=3, poll_interval=0.1)
+        pool.start()
+        try:
+            job = store.create('u', 'lib', {}, 1)
+            pool.notify()
+            check("工作线程开始解析", parsing.wait(5) and store.get(job['job_id'])['stage'] == 'parsing')
+            store.request_cancel(job['job_id'])
+            deadline = time.time() + 5
+            while store.get(job['job_id'])['status'] == 'running' and time.time() < deadline:
+                time.sleep(0.1)
+            check("解析中的任务被取消", store.get(job['job_id'])['status'] == 'cancelled' and pool.active_count() == 0)
+        finally:
+            pool.stop()
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return failures
+
+
+def main(argv: Optional[List[str]] = None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="异步解析任务")
+    parser.add_argument('command', choices=['selfcheck'], help="selfcheck: 在临时数据库上检查任务表的关键行为")
+    parser.parse_args(argv)
+
+    print("🔎 检查解析任务表与工作线程池")
+    failures = selfcheck()
+    if failures:
+        print(f"❌ {len(failures)} 项检查未通过")
+        return 1
+    print("✅ 全部检查通过")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
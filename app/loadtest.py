@@ -0,0 +1,620 @@
+"""
+端到端HTTP压测工具
+启动本地的假OpenAI服务（可配置首token延迟、逐token延迟和流式输出）与假MinerU v4服务（返回预制的结果ZIP），
+在独立的数据目录中启动后端，按目标RPS发送混合流量（上传、列表、内容、图片、RAG），统计各路由的吞吐、延迟分位数和错误率
+
+用法:
+    python app/loadtest.py --rps 20 --duration 60
+    python app/loadtest.py --rps 50 --mix list=5,content=5,image=5,rag=1 --output data/loadtest/result.json
+    python app/loadtest.py --token-latency 0.02 --completion-tokens 200 --seed-files 10
+"""
+
+import io
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import socket
+import zipfile
+import argparse
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+
+DEFAULT_MIX = "upload=1,list=4,content=4,image=4,rag=2"
+
+# 最小的PDF文件（后端只按扩展名校验，内容交给假MinerU服务）
+FAKE_PDF = b"%PDF-1.4\n1 0 obj<<>>endobj\ntrailer<<>>\n%%EOF\n"
+
+# 1x1 像素的PNG图片
+FAKE_IMAGE = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000100e221bc330000000049454e44ae426082"
+)
+
+
+def build_canned_zip(sections: int = 8, images: int = 3, seed: int = 0) -> bytes:
+    """生成与MinerU结果结构一致的ZIP：full.md（含图片引用）和images目录"""
+    rng = random.Random(seed)
+    words = ["transformer", "attention", "retrieval", "embedding", "benchmark", "latency",
+             "throughput", "index", "corpus", "model", "dataset", "evaluation", "论文", "检索", "向量"]
+    lines = ["# Synthetic Paper", ""]
+    for s in range(sections):
+        lines.append(f"## {s + 1} Section")
+        lines.append("")
+        for _ in range(3):
+            lines.append(" ".join(rng.choice(words) for _ in range(120)))
+            lines.append("")
+        if s < images:
+            lines.append(f"![Figure {s + 1}](images/fig{s + 1}.png)")
+            lines.append("")
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("full.md", "\n".join(lines))
+        zf.writestr("layout.json", json.dumps({"pdf_info": []}))
+        for i in range(images):
+            zf.writestr(f"images/fig{i + 1}.png", FAKE_IMAGE)
+    return buffer.getvalue()
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    """不打印访问日志的请求处理器"""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send_json(self, data: Dict, status: int = 200):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeOpenAIHandler(_QuietHandler):
+    """OpenAI兼容的 /v1/chat/completions，按配置模拟首token延迟与逐token生成"""
+
+    ttft = 0.2
+    token_latency = 0.01
+    completion_tokens = 64
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/models'):
+            return self._send_json({'object': 'list', 'data': [{'id': 'fake-model', 'object': 'model'}]})
+        self._send_json({'error': 'not found'}, 404)
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            return self._send_json({'error': 'not found'}, 404)
+
+        request_body = json.loads(self._read_body() or b"{}")
+        model = request_body.get('model', 'fake-model')
+        prompt_chars = sum(len(str(m.get('content', ''))) for m in request_body.get('messages', []))
+        prompt_tokens = max(1, prompt_chars // 4)
+        tokens = [f"token{i} " for i in range(self.completion_tokens)]
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+
+        time.sleep(self.ttft)
+        if not request_body.get('stream'):
+            time.sleep(self.token_latency * len(tokens))
+            return self._send_json({
+                'id': completion_id,
+                'object': 'chat.completion',
+                'created': created,
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': "".join(tokens)},
+                    'finish_reason': 'stop'
+                }],
+                'usage': {
+                    'prompt_tokens': prompt_tokens,
+                    'completion_tokens': len(tokens),
+                    'total_tokens': prompt_tokens + len(tokens)
+                }
+            })
+
+        # 流式输出（SSE，逐token发送）
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        for i, token in enumerate(tokens):
+            chunk = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': created,
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'delta': {'role': 'assistant', 'content': token} if i == 0 else {'content': token},
+                    'finish_reason': None
+                }]
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+            time.sleep(self.token_latency)
+        final = {
+            'id': completion_id,
+            'object': 'chat.completion.chunk',
+            'created': created,
+            'model': model,
+            'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]
+        }
+        self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode('utf-8'))
+        self.wfile.flush()
+
+
+class FakeMinerUHandler(_QuietHandler):
+    """
+    MinerU v4 批量接口：申请上传链接 -> PUT上传 -> 轮询批次结果 -> 下载结果ZIP
+
+    每个批次在创建 processing_delay 秒后变为done，下载返回预制的ZIP
+    """
+
+    processing_delay = 1.0
+    zip_bytes = b""
+    batches: Dict[str, Dict] = {}
+    lock = threading.Lock()
+
+    def _base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def do_POST(self):
+        if not self.path.startswith('/api/v4/file-urls/batch'):
+            return self._send_json({'code': -1, 'msg': 'not found'}, 404)
+
+        request_body = json.loads(self._read_body() or b"{}")
+        files = request_body.get('files', [])
+        batch_id = uuid.uuid4().hex
+        with self.lock:
+            self.batches[batch_id] = {'created_at': time.time(), 'files': files}
+        self._send_json({
+            'code': 0,
+            'msg': 'ok',
+            'data': {
+                'batch_id': batch_id,
+                'file_urls': [f"{self._base_url()}/upload/{batch_id}/{i}" for i in range(len(files))]
+            }
+        })
+
+    def do_PUT(self):
+        if not self.path.startswith('/upload/'):
+            return self._send_json({'code': -1, 'msg': 'not found'}, 404)
+        self._read_body()
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        match = re.match(r'^/api/v4/extract-results/batch/([0-9a-f]+)', self.path)
+        if match:
+            with self.lock:
+                batch = self.batches.get(match.group(1))
+            if not batch:
+                return self._send_json({'code': -1, 'msg': 'batch not found'}, 404)
+            done = time.time() - batch['created_at'] >= self.processing_delay
+            results = []
+            for i, file in enumerate(batch['files']):
+                item = {
+                    'file_name': file.get('name', ''),
+                    'data_id': file.get('data_id', ''),
+                    'state': 'done' if done else 'running'
+                }
+                if done:
+                    item['full_zip_url'] = f"{self._base_url()}/zips/{match.group(1)}/{i}.zip"
+                results.append(item)
+            return self._send_json({'code': 0, 'msg': 'ok', 'data': {'batch_id': match.group(1), 'extract_result': results}})
+
+        if self.path.startswith('/zips/'):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/zip')
+            self.send_header('Content-Length', str(len(self.zip_bytes)))
+            self.end_headers()
+            self.wfile.write(self.zip_bytes)
+            return
+
+        self._send_json({'code': -1, 'msg': 'not found'}, 404)
+
+
+def start_server(handler_class) -> Tuple[ThreadingHTTPServer, str]:
+    """在随机端口上启动HTTP服务，返回 (服务, 基础URL)"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}"
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_backend(port: int, data_dir: Path, openai_url: str, mineru_url: str) -> subprocess.Popen:
+    """在子进程中启动后端（指向假服务和独立的数据目录），避免与压测客户端争用GIL"""
+    env = dict(os.environ)
+    env.update({
+        'FLASK_ENV': 'production',
+        'SECRET_KEY': env.get('SECRET_KEY') or uuid.uuid4().hex,
+        'DATA_DIR': str(data_dir),
+        'OPENAI_BASE_URL': f"{openai_url}/v1",
+        'OPENAI_API_KEY': 'loadtest',
+        'OPENAI_MODEL': 'fake-model',
+        'MINERU_USE_LOCAL': 'false',
+        'MINERU_API_TOKEN': 'loadtest',
+        'MINERU_API_BASE_URL': f"{mineru_url}/api/v4",
+        'MINERU_POLL_INTERVAL': '0.2',
+        'NO_PROXY': '127.0.0.1,localhost'
+    })
+    return subprocess.Popen(
+        [sys.executable, str(Path(__file__).resolve()), 'serve-backend', '--port', str(port)],
+        env=env,
+        stdout=subprocess.DEVNULL if not env.get('LOADTEST_VERBOSE') else None,
+        stderr=subprocess.STDOUT if not env.get('LOADTEST_VERBOSE') else None
+    )
+
+
+def serve_backend(port: int):
+    """子进程入口：以多线程模式运行后端"""
+    sys.path.insert(0, str(Path(__file__).parent))
+    from app import app
+    app.run(host='127.0.0.1', port=port, threaded=True, debug=False, use_reloader=False)
+
+
+def wait_until_ready(base_url: str, timeout: float = 120) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{base_url}/api/health", timeout=2).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    return False
+
+
+class LoadTestClient:
+    """压测客户端：准备用户、文库和种子文件，并执行各类请求"""
+
+    IMAGE_URL_PATTERN = re.compile(r'\]\((/api/libraries/[^)\s]+/images/[^)\s]+)\)')
+
+    def __init__(self, base_url: str, timeout: float = 120):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.trust_env = False
+        adapter = requests.adapters.HTTPAdapter(pool_connections=64, pool_maxsize=256)
+        self.session.mount('http://', adapter)
+        self.user_id = None
+        self.library_id = None
+        self.file_ids: List[str] = []
+        self.image_urls: List[str] = []
+        self.rng = random.Random()
+
+    def _headers(self) -> Dict:
+        return {'X-User-ID': self.user_id} if self.user_id else {}
+
+    def setup(self, seed_files: int, build_index: bool):
+        """注册压测用户、创建文库、上传种子文件并（可选）构建向量数据库"""
+        username = f"lt{uuid.uuid4().hex[:10]}"
+        response = self.session.post(f"{self.base_url}/api/auth/register",
+                                     json={'username': username, 'password': uuid.uuid4().hex}, timeout=self.timeout)
+        response.raise_for_status()
+        self.user_id = response.json()['user']['user_id']
+
+        response = self.session.post(f"{self.base_url}/api/libraries", json={'name': f"loadtest_{username}"},
+                                     headers=self._headers(), timeout=self.timeout)
+        response.raise_for_status()
+        self.library_id = response.json()['library']['id']
+
+        # 上传只登记解析任务，等待全部任务完成后再读取文件列表
+        job_ids = []
+        for _ in range(seed_files):
+            response = self.upload()
+            if response.status_code == 202:
+                job_ids.append(response.json()['job_id'])
+        self.wait_for_jobs(job_ids)
+        self.refresh_files()
+        print(f"📚 种子数据: 文库 {self.library_id}，{len(self.file_ids)} 个文件，{len(self.image_urls)} 张图片")
+
+        if build_index:
+            print("🔄 正在构建向量数据库...")
+            response = self.session.post(f"{self.base_url}/api/libraries/{self.library_id}/build_vector_store",
+                                         json={}, headers=self._headers(), timeout=1800)
+            if response.status_code != 200:
+                print(f"⚠️ 构建向量数据库失败，RAG请求将返回错误: {response.text[:200]}")
+
+    def wait_for_jobs(self, job_ids: List[str], timeout: float = 600):
+        deadline = time.time() + timeout
+        pending = list(job_ids)
+        while pending and time.time() < deadline:
+            response = self.session.get(f"{self.base_url}/api/jobs/{pending[0]}",
+                                        headers=self._headers(), timeout=self.timeout)
+            if response.status_code != 200 or response.json()['job']['status'] in ('completed', 'failed'):
+                pending.pop(0)
+            else:
+                time.sleep(0.5)
+        if pending:
+            print(f"⚠️ {len(pending)} 个解析任务未在 {timeout:.0f} 秒内完成")
+
+    def refresh_files(self):
+        response = self.session.get(f"{self.base_url}/api/libraries/{self.library_id}/files",
+                                    headers=self._headers(), timeout=self.timeout)
+        response.raise_for_status()
+        self.file_ids = [f['id'] for f in response.json().get('data', [])]
+        self.image_urls = []
+        for file_id in self.file_ids[:20]:
+            response = self.content(file_id)
+            if response.status_code == 200:
+                self.image_urls.extend(self.IMAGE_URL_PATTERN.findall(response.json().get('content', '')))
+
+    def upload(self) -> requests.Response:
+        files = {'files': (f"paper_{uuid.uuid4().hex[:8]}.pdf", FAKE_PDF, 'application/pdf')}
+        return self.session.post(f"{self.base_url}/api/upload", files=files,
+                                 data={'library_id': self.library_id}, headers=self._headers(), timeout=self.timeout)
+
+    def list_files(self) -> requests.Response:
+        return self.session.get(f"{self.base_url}/api/libraries/{self.library_id}/files",
+                                headers=self._headers(), timeout=self.timeout)
+
+    def content(self, file_id: Optional[str] = None) -> requests.Response:
+        file_id = file_id or self.rng.choice(self.file_ids)
+        return self.session.get(f"{self.base_url}/api/libraries/{self.library_id}/files/{file_id}/content",
+                                headers=self._headers(), timeout=self.timeout)
+
+    def image(self) -> requests.Response:
+        return self.session.get(f"{self.base_url}{self.rng.choice(self.image_urls)}", timeout=self.timeout)
+
+    def rag(self) -> requests.Response:
+        question = self.rng.choice(["这些论文的主要方法是什么？", "哪些论文讨论了检索延迟？", "What datasets are used?"])
+        if self.file_ids and self.rng.random() < 0.5:
+            url = f"{self.base_url}/api/libraries/{self.library_id}/files/{self.rng.choice(self.file_ids)}/rag"
+        else:
+            url = f"{self.base_url}/api/libraries/{self.library_id}/rag"
+        return self.session.post(url, json={'question': question}, headers=self._headers(), timeout=self.timeout)
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """解析 "list=4,rag=1" 形式的流量配比"""
+    weights = {}
+    for item in filter(None, mix.split(',')):
+        name, _, weight = item.partition('=')
+        weights[name.strip()] = float(weight or 1)
+    return {name: weight for name, weight in weights.items() if weight > 0}
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def summarize(samples: List[Dict], duration: float) -> Dict:
+    """按路由汇总吞吐、延迟分位数和错误率"""
+    routes: Dict[str, List[Dict]] = {}
+    for sample in samples:
+        routes.setdefault(sample['route'], []).append(sample)
+
+    summary = {}
+    for route, items in sorted(routes.items()):
+        latencies = sorted(item['latency_ms'] for item in items)
+        errors = [item for item in items if not item['ok']]
+        status_counts: Dict[str, int] = {}
+        for item in items:
+            status_counts[str(item['status'])] = status_counts.get(str(item['status']), 0) + 1
+        summary[route] = {
+            'count': len(items),
+            'throughput_rps': round(len(items) / duration, 3) if duration else 0,
+            'error_rate': round(len(errors) / len(items), 4),
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p90_ms': round(percentile(latencies, 90), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'max_ms': round(latencies[-1], 2),
+            'status': status_counts
+        }
+    return summary
+
+
+def run_load(client: LoadTestClient, rps: float, duration: float, mix: Dict[str, float], concurrency: int) -> Dict:
+    """
+    开环压测：按固定间隔发出请求，不等待前一个请求完成，队列积压体现为调度延迟
+
+    Returns:
+        汇总结果
+    """
+    actions = {
+        'upload': client.upload,
+        'list': client.list_files,
+        'content': client.content,
+        'image': client.image,
+        'rag': client.rag
+    }
+    # 缺少前置数据的路由不参与压测
+    if not client.file_ids:
+        mix = {k: v for k, v in mix.items() if k not in ('content', 'rag')}
+    if not client.image_urls:
+        mix.pop('image', None)
+    routes = [route for route in mix if route in actions]
+    weights = [mix[route] for route in routes]
+    if not routes:
+        raise ValueError("没有可执行的路由，请检查 --mix")
+
+    samples: List[Dict] = []
+    samples_lock = threading.Lock()
+    rng = random.Random(0)
+
+    def execute(route: str, scheduled_at: float):
+        started = time.perf_counter()
+        try:
+            response = actions[route]()
+            status, ok = response.status_code, response.status_code < 400
+        except requests.RequestException as e:
+            status, ok = type(e).__name__, False
+        finished = time.perf_counter()
+        with samples_lock:
+            samples.append({
+                'route': route,
+                'status': status,
+                'ok': ok,
+                'latency_ms': (finished - started) * 1000,
+                'dispatch_lag_ms': (started - scheduled_at) * 1000
+            })
+
+    interval = 1.0 / rps
+    start = time.perf_counter()
+    next_at = start
+    sent = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while next_at - start < duration:
+            now = time.perf_counter()
+            if next_at > now:
+                time.sleep(next_at - now)
+            executor.submit(execute, rng.choices(routes, weights)[0], next_at)
+            sent += 1
+            next_at += interval
+    elapsed = time.perf_counter() - start
+
+    lags = sorted(s['dispatch_lag_ms'] for s in samples)
+    ok_count = sum(1 for s in samples if s['ok'])
+    return {
+        'target_rps': rps,
+        'duration_s': round(elapsed, 2),
+        'sent': sent,
+        'completed': len(samples),
+        'throughput_rps': round(len(samples) / elapsed, 3),
+        'success_rps': round(ok_count / elapsed, 3),
+        'error_rate': round(1 - ok_count / len(samples), 4) if samples else 0,
+        'dispatch_lag_p99_ms': round(percentile(lags, 99), 2),
+        'routes': summarize(samples, elapsed)
+    }
+
+
+def print_report(report: Dict):
+    print(f"\n📊 目标 {report['target_rps']} RPS，实际完成 {report['throughput_rps']} RPS"
+          f"（成功 {report['success_rps']} RPS），错误率 {report['error_rate']:.2%}，"
+          f"调度延迟p99 {report['dispatch_lag_p99_ms']}ms")
+    print(f"\n{'route':<10}{'count':>8}{'rps':>9}{'err%':>8}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}  status")
+    for route, stats in report['routes'].items():
+        print(f"{route:<10}{stats['count']:>8}{stats['throughput_rps']:>9}{stats['error_rate'] * 100:>8.2f}"
+              f"{stats['p50_ms']:>10}{stats['p90_ms']:>10}{stats['p99_ms']:>10}{stats['max_ms']:>10}  {stats['status']}")
+
+
+def main(argv: Optional[List[str]] = None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv[:1] == ['serve-backend']:
+        parser = argparse.ArgumentParser()
+        parser.add_argument('--port', type=int, required=True)
+        serve_backend(parser.parse_args(argv[1:]).port)
+        return 0
+
+    parser = argparse.ArgumentParser(description="端到端HTTP压测（本地假OpenAI与假MinerU服务）")
+    parser.add_argument('--rps', type=float, default=10, help="目标每秒请求数")
+    parser.add_argument('--duration', type=float, default=30, help="压测时长（秒）")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f"流量配比（默认 {DEFAULT_MIX}）")
+    parser.add_argument('--concurrency', type=int, default=64, help="最大并发请求数")
+    parser.add_argument('--seed-files', type=int, default=5, help="压测前上传的种子文件数")
+    parser.add_argument('--no-build', action='store_true', help="不构建向量数据库（RAG请求将返回错误）")
+    parser.add_argument('--ttft', type=float, default=0.2, help="假LLM首token延迟（秒）")
+    parser.add_argument('--token-latency', type=float, default=0.01, help="假LLM每个token的生成延迟（秒）")
+    parser.add_argument('--completion-tokens', type=int, default=64, help="假LLM每次生成的token数")
+    parser.add_argument('--mineru-delay', type=float, default=1.0, help="假MinerU处理一个批次的耗时（秒）")
+    parser.add_argument('--zip', help="使用指定的MinerU结果ZIP代替生成的ZIP")
+    parser.add_argument('--target', help="压测已运行的后端（需自行将其指向假服务），不启动子进程")
+    parser.add_argument('--data-dir', help="后端数据目录（默认使用临时目录，结束后删除）")
+    parser.add_argument('--output', help="结果保存路径（JSON）")
+    args = parser.parse_args(argv)
+
+    FakeOpenAIHandler.ttft = args.ttft
+    FakeOpenAIHandler.token_latency = args.token_latency
+    FakeOpenAIHandler.completion_tokens = args.completion_tokens
+    FakeMinerUHandler.processing_delay = args.mineru_delay
+    FakeMinerUHandler.zip_bytes = Path(args.zip).read_bytes() if args.zip else build_canned_zip()
+
+    openai_server, openai_url = start_server(FakeOpenAIHandler)
+    mineru_server, mineru_url = start_server(FakeMinerUHandler)
+    print(f"🤖 假OpenAI服务: {openai_url}/v1")
+    print(f"📄 假MinerU服务: {mineru_url}/api/v4")
+
+    temp_dir = None
+    backend = None
+    try:
+        if args.target:
+            base_url = args.target
+        else:
+            if args.data_dir:
+                data_dir = Path(args.data_dir)
+            else:
+                temp_dir = tempfile.TemporaryDirectory(prefix="arborvista-loadtest-")
+                data_dir = Path(temp_dir.name)
+            port = _free_port()
+            base_url = f"http://127.0.0.1:{port}"
+            backend = start_backend(port, data_dir, openai_url, mineru_url)
+            print(f"🚀 启动后端: {base_url}（数据目录 {data_dir}）")
+
+        if not wait_until_ready(base_url):
+            print("❌ 后端未能启动")
+            return 1
+
+        client = LoadTestClient(base_url)
+        client.setup(args.seed_files, build_index=not args.no_build and 'rag' in parse_mix(args.mix))
+
+        print(f"🔥 开始压测: {args.rps} RPS × {args.duration}s，配比 {args.mix}")
+        report = run_load(client, args.rps, args.duration, parse_mix(args.mix), args.concurrency)
+        report['config'] = {
+            'mix': args.mix,
+            'concurrency': args.concurrency,
+            'ttft_s': args.ttft,
+            'token_latency_s': args.token_latency,
+            'completion_tokens': args.completion_tokens,
+            'mineru_delay_s': args.mineru_delay,
+            'seed_files': args.seed_files
+        }
+        print_report(report)
+
+        if args.output:
+            output = Path(args.output)
+            output.parent.mkdir(parents=True, exist_ok=True)
+            with open(output, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            print(f"\n✅ 结果已保存到: {output}")
+        return 0
+    finally:
+        if backend:
+            backend.terminate()
+            try:
+                backend.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                backend.kill()
+        openai_server.shutdown()
+        mineru_server.shutdown()
+        if temp_dir:
+            temp_dir.cleanup()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+"""
+Prometheus文本格式的指标
+轻量的线程安全注册表（Counter、Gauge、Histogram），不依赖prometheus_client；
+抓取时只遍历内存中的序列，开销与序列数成正比
+"""
+
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple, object] = {}
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        lines = self._header()
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """可增可减的当前值"""
+    type_name = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """按桶统计的分布（累计桶计数 + 总和 + 次数）"""
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+        lines = self._header()
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = ("le", _format_value(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+# 抓取时回调的采集函数返回: [(指标名, 类型, 说明, [(标签字典, 值), ...]), ...]
+Collector = Callable[[], List[Tuple[str, str, str, List[Tuple[Dict, float]]]]]
+
+
+class MetricsRegistry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Collector] = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, collector: Collector):
+        """注册抓取时才计算的指标（如缓存状态），避免在热路径上维护"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        """导出Prometheus文本格式（text/plain; version=0.0.4）"""
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collector in collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                print(f"⚠️ 指标采集失败: {str(e)}")
+                continue
+            for name, type_name, documentation, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {type_name}")
+                for labels, value in samples:
+                    names = tuple(labels)
+                    lines.append(f"{name}{_format_labels(names, tuple(labels[n] for n in names))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# HTTP请求
+HTTP_REQUESTS = registry.counter('arborvista_http_requests_total', "HTTP请求数", ('route', 'method', 'status'))
+HTTP_LATENCY = registry.histogram('arborvista_http_request_duration_seconds', "HTTP请求耗时（秒）", ('route', 'method'))
+HTTP_IN_FLIGHT = registry.gauge('arborvista_http_requests_in_flight', "正在处理的HTTP请求数")
+
+# RAG查询
+RAG_STAGE_LATENCY = registry.histogram('arborvista_rag_stage_duration_seconds', "RAG查询各阶段耗时（秒）", ('stage',))
+LLM_LATENCY = registry.histogram('arborvista_llm_request_duration_seconds', "LLM调用耗时（秒）", ('purpose',))
+LLM_TOKENS = registry.counter('arborvista_llm_tokens_total', "LLM token用量", ('type',))
+
+# MinerU解析
+MINERU_JOBS_IN_PROGRESS = registry.gauge('arborvista_mineru_jobs_in_progress', "正在进行的MinerU解析批次数", ('mode',))
+INGEST_DURATION = registry.histogram(
+    'arborvista_ingest_duration_seconds', "文件解析入库耗时（秒）", ('mode', 'status'),
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800)
+)
+INGEST_FILES = registry.counter('arborvista_ingest_files_total', "解析入库的文件数", ('mode', 'status'))
+
+
+def observe_rag_timings(timings: Optional[Dict]):
+    """根据RAG查询返回的timings更新阶段耗时、LLM耗时和token用量"""
+    if not timings:
+        return
+    for stage, ms in (timings.get('stages') or {}).items():
+        RAG_STAGE_LATENCY.observe(ms / 1000, stage=stage)
+    if 'llm' in (timings.get('stages') or {}):
+        LLM_LATENCY.observe(timings['stages']['llm'] / 1000, purpose='rag')
+    for token_type in ('prompt_tokens', 'completion_tokens'):
+        if timings.get(token_type):
+            LLM_TOKENS.inc(timings[token_type], type=token_type.replace('_tokens', ''))
@@ -4,14 +4,38 @@ import zipfile
 import time
 import uuid
 import shutil
+import signal
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib.parse import urlparse
 from pathlib import Path
 
+
+class MinerUCancelled(Exception):
+    """处理被取消"""
+
+
+# 本地模式：每个vLLM后端同时运行的MinerU进程数上限（进程内所有批次共享）
+_local_slot_lock = threading.Lock()
+_local_slot_semaphores = {}
+
+
+def _local_slots(local_url, size):
+    """获取本地后端的并发槽位（BoundedSemaphore，可用作with语句）"""
+    key = (local_url, size)
+    with _local_slot_lock:
+        semaphore = _local_slot_semaphores.get(key)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(max(1, size))
+            _local_slot_semaphores[key] = semaphore
+        return semaphore
+
+
 class MinerUAPI:
     """MinerU API客户端 - 支持在线API和本地调用"""
     
-    def __init__(self, token=None, base_url="https://mineru.net/api/v4", use_local=False, local_url="http://127.0.0.1:30000"):
+    def __init__(self, token=None, base_url="https://mineru.net/api/v4", use_local=False, local_url="http://127.0.0.1:30000", poll_interval=10, local_concurrency=2, local_timeout=600):
         """
         初始化MinerU客户端
         
@@ -20,9 +44,15 @@ class MinerUAPI:
             base_url: MinerU API base URL (默认: https://mineru.net/api/v4)
             use_local: 是否使用本地vLLM后端 (默认: False)
             local_url: 本地vLLM后端URL (默认: http://127.0.0.1:30000)
+            poll_interval: 在线模式轮询批次状态的间隔秒数 (默认: 10)
+            local_concurrency: 本地模式同时运行的MinerU进程数，按vLLM后端的承载能力设置 (默认: 2)
+            local_timeout: 本地模式单个文件的处理超时秒数 (默认: 600)
         """
         self.use_local = use_local
         self.local_url = local_url
+        self.poll_interval = poll_interval
+        self.local_concurrency = max(1, int(local_concurrency))
+        self.local_timeout = float(local_timeout)
         
         if not use_local:
             # Online mode
@@ -73,18 +103,21 @@ class MinerUAPI:
                     "MinerU command check failed. Please ensure MinerU is properly installed."
                 )
     
-    def process_files_batch(self, file_paths, output_dir, batch_index=0, max_files_per_batch=200, language="en", is_ocr=True, enable_formula=True, enable_table=True, layout_model="doclayout_yolo", file_id_map=None, original_filename_map=None):
+    def process_files_batch(self, file_paths, output_dir, batch_index=0, max_files_per_batch=200, language="en", is_ocr=True, enable_formula=True, enable_table=True, layout_model="doclayout_yolo", file_id_map=None, original_filename_map=None, cancel_event=None, progress_callback=None):
         """批量处理文件 - 支持在线API和本地调用
         
         Args:
             file_id_map: 文件路径到file_id的映射字典，用于本地模式时指定正确的file_id
             original_filename_map: 文件路径到原始文件名的映射字典，用于生成目录名
+            cancel_event: threading.Event，置位后取消处理（本地模式终止MinerU进程，在线模式停止轮询）
+            progress_callback: 本地模式每完成一个文件调用一次 progress_callback(已完成数, 总数)
         """
         if self.use_local:
-            # Local mode: process files sequentially
+            # Local mode: process files concurrently with bounded parallelism
             return self._process_local_batch(
                 file_paths, output_dir, is_ocr, enable_formula,
-                enable_table, language, layout_model, file_id_map=file_id_map, original_filename_map=original_filename_map
+                enable_table, language, layout_model, file_id_map=file_id_map, original_filename_map=original_filename_map,
+                cancel_event=cancel_event, progress_callback=progress_callback
             )
         else:
             # Online mode - 严格按照test_input.py和test_output.py的逻辑
@@ -112,7 +145,7 @@ class MinerUAPI:
                 # 第二步：等待处理完成 - 轮询检查状态
                 print("⏳ 等待处理完成...")
                 max_wait_time = 300  # 最大等待5分钟
-                check_interval = 10   # 每10秒检查一次
+                check_interval = self.poll_interval   # 默认每10秒检查一次
                 start_time = time.time()
                 
                 while time.time() - start_time < max_wait_time:
@@ -120,7 +153,8 @@ class MinerUAPI:
                     status_result = self.check_batch_status(batch_id)
                     if not status_result['success']:
                         print(f"❌ 检查批次状态失败: {status_result['error']}")
-                        time.sleep(check_interval)
+                        if self._wait_poll(check_interval, cancel_event):
+                            return {'success': False, 'error': '已取消'}
                         continue
                     
                     if status_result['is_complete']:
@@ -128,7 +162,8 @@ class MinerUAPI:
                         break
                     else:
                         print(f"⏳ 批次处理中: {status_result['completed_files']}/{status_result['total_files']} (已等待 {int(time.time() - start_time)} 秒)")
-                        time.sleep(check_interval)
+                        if self._wait_poll(check_interval, cancel_event):
+                            return {'success': False, 'error': '已取消'}
                 else:
                     return {
                         'success': False,
@@ -157,6 +192,14 @@ class MinerUAPI:
                     'error': f'批量处理失败: {str(e)}'
                 }
     
+    @staticmethod
+    def _wait_poll(interval, cancel_event=None):
+        """等待一个轮询间隔，期间被取消时返回True"""
+        if cancel_event is None:
+            time.sleep(interval)
+            return False
+        return cancel_event.wait(interval)
+    
     def _process_local_batch(
         self,
         file_paths,
@@ -167,25 +210,29 @@ class MinerUAPI:
         language="en",
         layout_model="doclayout_yolo",
         file_id_map=None,
-        original_filename_map=None
+        original_filename_map=None,
+        cancel_event=None,
+        progress_callback=None
     ):
-        """使用本地MinerU vLLM后端批量处理文件
+        """使用本地MinerU vLLM后端批量处理文件（多个文件并发，并发数受 local_concurrency 限制）
         
         Args:
             file_paths: 文件路径列表
             output_dir: 输出目录（最终目标目录，每个文件会创建对应的子目录）
             file_id_map: 文件路径到file_id的映射字典，如果提供则使用指定的file_id
             original_filename_map: 文件路径到原始文件名的映射字典，用于生成目录名
+            cancel_event: threading.Event，置位后不再启动新文件，并终止正在运行的MinerU进程
+            progress_callback: 每完成一个文件调用一次 progress_callback(已完成数, 总数)
         """
-        results = []
         base_output_path = Path(output_dir)
         base_output_path.mkdir(parents=True, exist_ok=True)
+        total = len(file_paths)
+        workers = max(1, min(self.local_concurrency, total))
         
-        print(f"🚀 开始本地批量处理 {len(file_paths)} 个文件")
+        print(f"🚀 开始本地批量处理 {total} 个文件（并发 {workers}，单文件超时 {self.local_timeout:.0f} 秒）")
         
-        for idx, file_path in enumerate(file_paths, 1):
+        def process_one(idx, file_path):
             file_path_obj = Path(file_path)
-            print(f"处理文件 {idx}/{len(file_paths)}: {file_path_obj.name}")
             
             # 获取file_id：优先使用file_id_map，否则使用文件名
             if file_id_map and file_path in file_id_map:
@@ -204,44 +251,74 @@ class MinerUAPI:
             
             # 生成目录名：{文件名}-{file_id}
             dir_name = f"{filename_part}-{file_id}"
-            
-            # 为每个文件创建最终目标目录（直接输出到这里）
             file_output_dir = base_output_path / dir_name
-            file_output_dir.mkdir(parents=True, exist_ok=True)
-            print(f"📁 文件输出目录: {file_output_dir}")
             
-            result = self._process_local(
-                file_path_obj,
-                file_output_dir,  # 直接输出到最终目录
-                is_ocr,
-                enable_formula,
-                enable_table,
-                language,
-                layout_model,
-                file_id=file_id
-            )
+            # 同一vLLM后端的MinerU进程总数受限（同一进程内的多个批次共享）
+            with _local_slots(self.local_url, self.local_concurrency):
+                if cancel_event is not None and cancel_event.is_set():
+                    result = {'success': False, 'error': '已取消'}
+                else:
+                    print(f"处理文件 {idx}/{total}: {file_path_obj.name}")
+                    # 为每个文件创建最终目标目录（直接输出到这里）
+                    file_output_dir.mkdir(parents=True, exist_ok=True)
+                    print(f"📁 文件输出目录: {file_output_dir}")
+                    result = self._process_local(
+                        file_path_obj,
+                        file_output_dir,  # 直接输出到最终目录
+                        is_ocr,
+                        enable_formula,
+                        enable_table,
+                        language,
+                        layout_model,
+                        file_id=file_id,
+                        cancel_event=cancel_event
+                    )
             
             # 转换结果格式以匹配API模式的返回格式
             if result['success']:
-                data_id = f"{file_id}_b1"
-                
-                results.append({
+                return {
                     'original_name': file_path_obj.name,
-                    'data_id': data_id,
+                    'data_id': f"{file_id}_b1",
                     'output_dir': str(file_output_dir),
                     'success': True
-                })
-            else:
-                results.append({
-                    'original_name': file_path_obj.name,
-                    'data_id': '',
-                    'output_dir': None,
-                    'success': False,
-                    'error': result.get('error', '处理失败')
-                })
+                }
+            # 失败或取消时不留下不完整的输出目录
+            shutil.rmtree(file_output_dir, ignore_errors=True)
+            return {
+                'original_name': file_path_obj.name,
+                'data_id': '',
+                'output_dir': None,
+                'success': False,
+                'error': result.get('error', '处理失败')
+            }
+        
+        # 结果按输入顺序返回
+        results = [None] * total
+        done = 0
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mineru-local") as executor:
+            futures = {executor.submit(process_one, idx, file_path): idx - 1
+                       for idx, file_path in enumerate(file_paths, 1)}
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    results[index] = {
+                        'original_name': Path(file_paths[index]).name,
+                        'data_id': '',
+                        'output_dir': None,
+                        'success': False,
+                        'error': f'Processing failed: {str(e)}'
+                    }
+                done += 1
+                if progress_callback is not None:
+                    try:
+                        progress_callback(done, total)
+                    except Exception as e:
+                        print(f"⚠️ 进度回调失败: {str(e)}")
         
         success_count = sum(1 for r in results if r['success'])
-        return {
+        summary = {
             'success': success_count > 0,
             'processed_files': results,
             'success_count': success_count,
@@ -249,6 +326,48 @@ class MinerUAPI:
             'output_dir': str(base_output_path),
             'message': f'批量处理完成，成功: {success_count}/{len(results)}'
         }
+        if not success_count:
+            # 与在线模式一致，全部失败时带上错误信息
+            summary['error'] = results[0]['error'] if results else '没有文件'
+        return summary
+    
+    def _run_mineru(self, cmd, cancel_event=None):
+        """运行MinerU命令，超过 local_timeout 或被取消时终止整个进程组
+        
+        Returns:
+            subprocess.CompletedProcess
+        
+        Raises:
+            subprocess.TimeoutExpired: 超时
+            MinerUCancelled: 被取消
+        """
+        # 独立的进程组，终止时连同MinerU启动的子进程一起结束
+        popen_kwargs = {'start_new_session': True} if os.name == 'posix' else {}
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, **popen_kwargs)
+        deadline = time.monotonic() + self.local_timeout
+        while True:
+            try:
+                stdout, stderr = proc.communicate(timeout=1)
+                return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+            except subprocess.TimeoutExpired:
+                cancelled = cancel_event is not None and cancel_event.is_set()
+                if not cancelled and time.monotonic() < deadline:
+                    continue
+                self._kill_process(proc)
+                proc.communicate()
+                if cancelled:
+                    raise MinerUCancelled()
+                raise subprocess.TimeoutExpired(cmd, self.local_timeout)
+    
+    @staticmethod
+    def _kill_process(proc):
+        try:
+            if os.name == 'posix':
+                os.killpg(proc.pid, signal.SIGKILL)
+            else:
+                proc.kill()
+        except (ProcessLookupError, PermissionError):
+            pass
     
     def _process_local(
         self,
@@ -259,7 +378,8 @@ class MinerUAPI:
         enable_table: bool = True,
         language: str = "en",
         layout_model: str = "doclayout_yolo",
-        file_id: str = None
+        file_id: str = None,
+        cancel_event=None
     ):
         """使用本地MinerU vLLM后端处理单个文件
         
@@ -267,6 +387,7 @@ class MinerUAPI:
             input_path: 输入文件路径
             output_path: 输出目录（MinerU会在这里创建子目录）
             file_id: 文件ID，如果提供则使用此ID，否则使用input_path.stem
+            cancel_event: threading.Event，置位时终止MinerU进程
         """
         try:
             # Build mineru command
@@ -278,13 +399,8 @@ class MinerUAPI:
                 "-u", self.local_url
             ]
             
-            # Execute command
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=600  # 10 minutes timeout
-            )
+            # Execute command（超时或取消时终止MinerU进程）
+            result = self._run_mineru(cmd, cancel_event)
             
             if result.returncode == 0:
                 # MinerU 会在输出目录下创建子目录，需要将内容移动到目标目录
@@ -461,7 +577,12 @@ class MinerUAPI:
         except subprocess.TimeoutExpired:
             return {
                 'success': False,
-                'error': 'Processing timeout (exceeded 10 minutes)'
+                'error': f'Processing timeout (exceeded {self.local_timeout:.0f} seconds)'
+            }
+        except MinerUCancelled:
+            return {
+                'success': False,
+                'error': '已取消'
             }
         except Exception as e:
             return {
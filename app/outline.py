@@ -0,0 +1,183 @@
+"""
+文档大纲索引
+处理完成时解析markdown标题，把每一节在文件中的字节偏移写入同目录下的 outline.json，
+分段内容接口据此只读取请求的字节范围，前端可以先显示目录和首屏内容，滚动时再按需加载
+"""
+
+import bisect
+import json
+import os
+import re
+from pathlib import Path
+from typing import Dict, List, Optional
+
+OUTLINE_FILENAME = 'outline.json'
+OUTLINE_VERSION = 1
+
+# 单节超过该大小时在段落边界拆分，避免一次请求返回整章
+MAX_SECTION_BYTES = 64 * 1024
+
+_HEADING_PATTERN = re.compile(rb'^ {0,3}(#{1,6})[ \t]+(.+?)[ \t#]*$')
+
+
+def parse_outline(data: bytes, max_section_bytes: int = MAX_SECTION_BYTES) -> List[Dict]:
+    """
+    把markdown原文切分为按标题划分的节
+
+    Args:
+        data: markdown文件的原始字节
+        max_section_bytes: 单节的大小上限，超过后在代码块/公式块之外的空行处拆分
+
+    Returns:
+        [{index, level, title, start, end}]，按文件顺序排列且首尾相接覆盖整个文件；
+        第一个标题之前的内容为 level=0 的节，拆分出的后续部分带 continued=True
+    """
+    # 先按标题确定各节起点（跳过代码块和公式块中的 #）
+    headings = []
+    split_points = []
+    in_code = False
+    in_math = False
+    offset = 0
+    for line in data.splitlines(keepends=True):
+        stripped = line.strip()
+        if stripped.startswith(b'```') or stripped.startswith(b'~~~'):
+            in_code = not in_code
+        elif not in_code and stripped == b'$$':
+            in_math = not in_math
+        elif not in_code and not in_math:
+            match = _HEADING_PATTERN.match(line.rstrip(b'\r\n'))
+            if match:
+                title = match.group(2).decode('utf-8', errors='replace').strip()
+                headings.append((offset, len(match.group(1)), title))
+            elif not stripped:
+                # 空行之后是可拆分位置
+                split_points.append(offset + len(line))
+        offset += len(line)
+    total = len(data)
+
+    starts = [(0, 0, '')] if not headings or headings[0][0] > 0 else []
+    starts.extend(headings)
+
+    sections = []
+    for i, (start, level, title) in enumerate(starts):
+        end = starts[i + 1][0] if i + 1 < len(starts) else total
+        if level == 0 and end == start:
+            continue
+        piece_start = start
+        continued = False
+        while end - piece_start > max_section_bytes:
+            # 找上限之内最后一个可拆分位置
+            pos = bisect.bisect_right(split_points, piece_start + max_section_bytes) - 1
+            if pos < 0 or split_points[pos] <= piece_start or split_points[pos] >= end:
+                break
+            cut = split_points[pos]
+            sections.append(_section(len(sections), level, title, piece_start, cut, continued))
+            piece_start = cut
+            continued = True
+        sections.append(_section(len(sections), level, title, piece_start, end, continued))
+    return sections
+
+
+def _section(index: int, level: int, title: str, start: int, end: int, continued: bool) -> Dict:
+    section = {'index': index, 'level': level, 'title': title, 'start': start, 'end': end}
+    if continued:
+        section['continued'] = True
+    return section
+
+
+def outline_path(md_file: Path) -> Path:
+    """markdown文件对应的大纲索引路径"""
+    return Path(md_file).with_name(OUTLINE_FILENAME)
+
+
+def build_outline(md_file: Path) -> Dict:
+    """解析markdown并写入 outline.json（写入失败时仍返回大纲）"""
+    md_file = Path(md_file)
+    stat = md_file.stat()
+    with open(md_file, 'rb') as f:
+        data = f.read()
+    outline = {
+        'version': OUTLINE_VERSION,
+        'markdown': md_file.name,
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'total_bytes': len(data),
+        'sections': parse_outline(data)
+    }
+    path = outline_path(md_file)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(outline, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"⚠️ 写入大纲索引失败 ({path}): {str(e)}")
+        try:
+            tmp_path.unlink()
+        except OSError:
+            pass
+    return outline
+
+
+def load_outline(md_file: Path) -> Dict:
+    """读取大纲索引，不存在或markdown已修改时重新生成"""
+    md_file = Path(md_file)
+    stat = md_file.stat()
+    try:
+        with open(outline_path(md_file), 'r', encoding='utf-8') as f:
+            outline = json.load(f)
+        if (outline.get('version') == OUTLINE_VERSION and outline.get('markdown') == md_file.name
+                and outline.get('mtime_ns') == stat.st_mtime_ns and outline.get('size') == stat.st_size):
+            return outline
+    except (OSError, ValueError):
+        pass
+    return build_outline(md_file)
+
+
+def build_outlines(content_dir: Path) -> Optional[Dict]:
+    """为内容目录中的markdown生成大纲索引（处理完成后调用）"""
+    md_files = list(Path(content_dir).glob("*.md"))
+    if not md_files:
+        return None
+    return build_outline(md_files[0])
+
+
+def read_sections(md_file: Path, sections: List[Dict]) -> List[Dict]:
+    """按字节范围读取若干节的原文"""
+    result = []
+    with open(md_file, 'rb') as f:
+        for section in sections:
+            f.seek(section['start'])
+            data = f.read(section['end'] - section['start'])
+            item = dict(section)
+            item['content'] = data.decode('utf-8', errors='replace')
+            result.append(item)
+    return result
+
+
+def select_sections(outline: Dict, offset: int = 0, limit: int = 256 * 1024,
+                    start_index: Optional[int] = None, end_index: Optional[int] = None) -> List[Dict]:
+    """
+    选择要返回的节
+
+    Args:
+        outline: 大纲索引
+        offset: 字节偏移，返回包含该位置的节及其后续各节
+        limit: 返回内容的大致字节数上限（至少返回一节）
+        start_index/end_index: 按节序号选择 [start_index, end_index)，指定时忽略offset
+    """
+    sections = outline['sections']
+    if start_index is not None:
+        end_index = len(sections) if end_index is None else end_index
+        return sections[max(start_index, 0):max(end_index, 0)]
+
+    selected = []
+    size = 0
+    for section in sections:
+        if section['end'] <= offset:
+            continue
+        if selected and size + (section['end'] - section['start']) > limit:
+            break
+        selected.append(section)
+        size += section['end'] - section['start']
+    return selected
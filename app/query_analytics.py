@@ -0,0 +1,521 @@
+"""
+查询日志分析与回放
+把 data/logs 下的查询日志（{library_id}_query.jsonl 及轮转后的 .jsonl.gz，兼容旧版多行文本格式的 _query.log）
+增量导入本地SQLite索引，按文库统计高频问题、各阶段延迟分布和答案缓存的潜在命中率；
+并可用不同的索引/缓存配置回放日志中的真实问题，对比配置变更对性能的影响
+
+用法:
+    python app/query_analytics.py index
+    python app/query_analytics.py report --library library_d8fd90da --top 20
+    python app/query_analytics.py replay --library library_d8fd90da --retrieval-only --neighbor-chunks 0
+    python app/query_analytics.py replay --library library_d8fd90da --vector-store-path /tmp/new_index --output replay.json
+"""
+
+import io
+import re
+import sys
+import gzip
+import json
+import time
+import sqlite3
+import zipfile
+import hashlib
+import argparse
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from config import Config
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS queries (
+    id INTEGER PRIMARY KEY,
+    record_hash TEXT UNIQUE NOT NULL,
+    library_id TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    file_id TEXT,
+    query_scope TEXT,
+    question TEXT NOT NULL,
+    question_key TEXT NOT NULL,
+    answer_chars INTEGER,
+    total_ms REAL,
+    stages TEXT,
+    chunks INTEGER,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_queries_library_time ON queries(library_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_queries_library_key ON queries(library_id, question_key);
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    inode INTEGER,
+    size INTEGER,
+    offset INTEGER
+);
+"""
+
+# 旧版loguru文本日志中每条记录的首行
+LEGACY_HEADER = re.compile(r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d+) \| INFO\s+\| (\S+) \| 📝 RAG Query\s*$')
+LEGACY_FIELDS = {
+    '📚 Library:': 'library_id',
+    '📄 File ID:': 'file_id',
+    '🔍 Scope:': 'query_scope',
+    '❓ Question:': 'question',
+    '⏱️ Timings:': 'timings',
+}
+
+
+def normalize_question(question: str) -> str:
+    """问题归一化（小写、合并空白、去掉结尾标点），用于统计重复问题"""
+    text = re.sub(r'\s+', ' ', (question or '').strip().lower())
+    return text.rstrip('?？。.!！ ')
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def distribution(values: List[float]) -> Dict:
+    """延迟分布（毫秒）"""
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'p50_ms': round(percentile(values, 50), 2),
+        'p90_ms': round(percentile(values, 90), 2),
+        'p99_ms': round(percentile(values, 99), 2),
+        'max_ms': round(values[-1], 2),
+        'mean_ms': round(sum(values) / len(values), 2)
+    }
+
+
+class QueryLogIndex:
+    """查询日志的SQLite索引"""
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.db_path))
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    # ---------- 导入 ----------
+
+    def ingest_dir(self, logs_dir: Path) -> Dict[str, int]:
+        """
+        增量导入日志目录：当前日志文件从上次读到的位置继续，已导入的压缩文件跳过；
+        同一条记录（按内容哈希）只保存一次，轮转前后重复读取不会重复计数
+
+        Returns:
+            {文件名: 新增记录数}
+        """
+        logs_dir = Path(logs_dir)
+        result = {}
+        patterns = ('*_query.jsonl', '*_query.*.jsonl.gz', '*_query.log', '*_query.*.log.zip')
+        for pattern in patterns:
+            for path in sorted(logs_dir.glob(pattern)):
+                added = self._ingest_file(path)
+                if added:
+                    result[path.name] = added
+        self.conn.commit()
+        return result
+
+    def _ingest_file(self, path: Path) -> int:
+        stat = path.stat()
+        row = self.conn.execute("SELECT inode, size, offset FROM sources WHERE path = ?", (str(path),)).fetchone()
+        appendable = path.suffix in ('.jsonl', '.log')
+        offset = 0
+        if row is not None:
+            if not appendable and row['size'] == stat.st_size:
+                return 0
+            if appendable and row['inode'] == stat.st_ino and stat.st_size >= row['offset']:
+                if stat.st_size == row['offset']:
+                    return 0
+                offset = row['offset']
+
+        if path.suffix == '.jsonl':
+            records, offset = self._read_jsonl(path, offset)
+        elif path.name.endswith('.jsonl.gz'):
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                records = list(self._parse_jsonl_lines(f))
+        elif path.suffix == '.log':
+            # 旧版文本日志的记录跨多行，只能整体重新解析（依靠内容哈希去重）
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                records = list(self._parse_legacy(f))
+            offset = stat.st_size
+        else:
+            records = []
+            with zipfile.ZipFile(path) as zf:
+                for name in zf.namelist():
+                    with zf.open(name) as member:
+                        records.extend(self._parse_legacy(io.TextIOWrapper(member, encoding='utf-8', errors='replace')))
+
+        added = sum(self._insert(record) for record in records)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO sources (path, inode, size, offset) VALUES (?, ?, ?, ?)",
+            (str(path), stat.st_ino, stat.st_size, offset if appendable else stat.st_size)
+        )
+        return added
+
+    def _read_jsonl(self, path: Path, offset: int) -> Tuple[List[Tuple[str, Dict]], int]:
+        """从offset开始读取完整的行（写线程可能正写到一半，最后不完整的行留到下次）"""
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        end = data.rfind(b'\n') + 1
+        lines = data[:end].decode('utf-8', errors='replace').splitlines()
+        return list(self._parse_jsonl_lines(lines)), offset + end
+
+    @staticmethod
+    def _parse_jsonl_lines(lines) -> Iterator[Tuple[str, Dict]]:
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield line, json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+    @staticmethod
+    def _parse_legacy(lines) -> Iterator[Tuple[str, Dict]]:
+        """解析旧版loguru多行文本日志"""
+        record, raw, answer_lines = None, [], None
+
+        def finish():
+            if record is None:
+                return None
+            record['answer'] = "\n".join(answer_lines or []).rstrip("\n")
+            return "\n".join(raw), record
+
+        for line in lines:
+            line = line.rstrip("\n")
+            header = LEGACY_HEADER.match(line)
+            if header:
+                done = finish()
+                if done:
+                    yield done
+                timestamp = header.group(1).replace(' ', 'T')
+                record, raw, answer_lines = {'timestamp': timestamp, 'library_id': header.group(2)}, [line], None
+                continue
+            if record is None:
+                continue
+            raw.append(line)
+            if answer_lines is not None:
+                answer_lines.append(line)
+                continue
+            stripped = line.strip()
+            if stripped.startswith('💬 Answer:'):
+                answer_lines = []
+                continue
+            for prefix, field in LEGACY_FIELDS.items():
+                if stripped.startswith(prefix):
+                    value = stripped[len(prefix):].strip()
+                    if field == 'timings':
+                        try:
+                            value = json.loads(value)
+                        except json.JSONDecodeError:
+                            value = None
+                    record[field] = None if value == 'N/A' else value
+                    break
+        done = finish()
+        if done:
+            yield done
+
+    def _insert(self, item: Tuple[str, Dict]) -> int:
+        raw, record = item
+        question = record.get('question')
+        library_id = record.get('library_id')
+        if not question or not library_id:
+            return 0
+        timings = record.get('timings') or {}
+        cursor = self.conn.execute(
+            """INSERT OR IGNORE INTO queries (record_hash, library_id, timestamp, file_id, query_scope, question,
+                   question_key, answer_chars, total_ms, stages, chunks, prompt_tokens, completion_tokens)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (
+                hashlib.sha1(raw.encode('utf-8')).hexdigest(),
+                library_id,
+                record.get('timestamp') or '',
+                record.get('file_id'),
+                record.get('query_scope'),
+                question,
+                normalize_question(question),
+                len(record.get('answer') or ''),
+                timings.get('total_ms'),
+                json.dumps(timings.get('stages') or {}),
+                timings.get('chunks'),
+                timings.get('prompt_tokens'),
+                timings.get('completion_tokens'),
+            )
+        )
+        return cursor.rowcount
+
+    # ---------- 查询 ----------
+
+    def libraries(self) -> List[str]:
+        return [row[0] for row in self.conn.execute("SELECT DISTINCT library_id FROM queries ORDER BY library_id")]
+
+    def queries(self, library_id: str, since: Optional[str] = None, limit: Optional[int] = None) -> List[sqlite3.Row]:
+        """按时间顺序返回文库的查询记录"""
+        sql = "SELECT * FROM queries WHERE library_id = ?"
+        params: list = [library_id]
+        if since:
+            sql += " AND timestamp >= ?"
+            params.append(since)
+        sql += " ORDER BY timestamp, id"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return self.conn.execute(sql, params).fetchall()
+
+    def report(self, library_id: str, top: int = 10, since: Optional[str] = None, ttl: Optional[float] = None) -> Dict:
+        """
+        文库的查询统计
+
+        Args:
+            top: 高频问题数
+            since: 只统计该时间（ISO格式）之后的查询
+            ttl: 估算答案缓存命中率时的缓存有效期（秒，None表示不过期）
+        """
+        rows = self.queries(library_id, since)
+        report = {'library_id': library_id, 'queries': len(rows)}
+        if not rows:
+            return report
+        report['first'] = rows[0]['timestamp']
+        report['last'] = rows[-1]['timestamp']
+
+        # 高频问题
+        counts: Dict[str, List] = {}
+        for row in rows:
+            entry = counts.setdefault(row['question_key'], [0, row['question']])
+            entry[0] += 1
+        report['top_questions'] = [
+            {'question': question, 'count': count}
+            for count, question in sorted(counts.values(), key=lambda x: -x[0])[:top]
+        ]
+        report['distinct_questions'] = len(counts)
+
+        # 延迟分布
+        stage_values: Dict[str, List[float]] = {}
+        for row in rows:
+            for stage, ms in json.loads(row['stages'] or '{}').items():
+                stage_values.setdefault(stage, []).append(ms)
+        report['latency'] = {'total': distribution([row['total_ms'] for row in rows])}
+        report['latency'].update({stage: distribution(values) for stage, values in stage_values.items()})
+        report['tokens'] = {
+            'prompt': sum(row['prompt_tokens'] or 0 for row in rows),
+            'completion': sum(row['completion_tokens'] or 0 for row in rows)
+        }
+
+        # 答案缓存的潜在命中：同一范围（论文/全库）下此前已出现过的相同问题
+        seen: Dict[Tuple, float] = {}
+        hits, saved_ms = 0, 0.0
+        for row in rows:
+            key = (row['query_scope'], row['file_id'], row['question_key'])
+            ts = _parse_time(row['timestamp'])
+            previous = seen.get(key)
+            if previous is not None and (ttl is None or ts - previous <= ttl):
+                hits += 1
+                saved_ms += row['total_ms'] or 0
+            else:
+                seen[key] = ts
+        report['answer_cache'] = {
+            'ttl_s': ttl,
+            'hits': hits,
+            'hit_rate': round(hits / len(rows), 4),
+            'saved_ms': round(saved_ms, 1)
+        }
+        return report
+
+
+def _parse_time(timestamp: str) -> float:
+    try:
+        return datetime.fromisoformat(timestamp).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def print_report(report: Dict):
+    print(f"\n📚 {report['library_id']}: {report['queries']} 次查询", end="")
+    if not report['queries']:
+        print()
+        return
+    print(f"（{report['first']} ~ {report['last']}，不同问题 {report['distinct_questions']} 个）")
+
+    print("\n❓ 高频问题:")
+    for item in report['top_questions']:
+        print(f"  {item['count']:>5}  {item['question'][:80]}")
+
+    print("\n⏱️ 延迟分布（毫秒）:")
+    print(f"  {'阶段':<20}{'次数':>8}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    for stage, dist in report['latency'].items():
+        if dist['count']:
+            print(f"  {stage:<20}{dist['count']:>8}{dist['p50_ms']:>10}{dist['p90_ms']:>10}{dist['p99_ms']:>10}{dist['max_ms']:>10}")
+
+    cache = report['answer_cache']
+    ttl = f"{cache['ttl_s']}s" if cache['ttl_s'] else "不过期"
+    print(f"\n💾 答案缓存潜在命中（有效期 {ttl}）: {cache['hits']} 次，命中率 {cache['hit_rate']:.1%}，可节省 {cache['saved_ms'] / 1000:.1f}s")
+    print(f"🔢 Token: prompt {report['tokens']['prompt']}，completion {report['tokens']['completion']}")
+
+
+def replay(rows: List[sqlite3.Row], library_id: str, args) -> Dict:
+    """用指定配置回放日志中的问题，返回回放与原始记录的各阶段延迟分布"""
+    sys.path.insert(0, str(Path(__file__).parent.parent / "agent"))
+    from RAG import PaperRAGSystem
+    from tracing import QueryTrace
+
+    rag = PaperRAGSystem(vector_store_path=args.vector_store_path, llm_required=not args.retrieval_only)
+    if args.index_cache_size is not None:
+        rag.index_cache_size = args.index_cache_size
+    if args.neighbor_chunks is not None:
+        rag.neighbor_window = args.neighbor_chunks
+    if args.context_chars is not None:
+        rag.context_chars = args.context_chars
+    if args.paper_top_n is not None:
+        rag.paper_top_n = args.paper_top_n
+    if args.hierarchical_min_papers is not None:
+        rag.hierarchical_min_papers = args.hierarchical_min_papers
+
+    replayed, original, errors = [], [], 0
+    for i, row in enumerate(rows, 1):
+        trace = QueryTrace()
+        with trace.stage('load_vector_store'):
+            loaded = rag.load_vector_store(library_id)
+        if not loaded:
+            raise RuntimeError(f"无法加载文库 {library_id} 的向量数据库")
+        if args.retrieval_only:
+            rag.retrieve(row['question'], args.k, row['file_id'], trace)
+            timings = trace.to_dict()
+        else:
+            result = rag.query_with_sources(row['question'], args.k, row['file_id'], trace=trace)
+            timings = result['timings']
+            errors += 1 if result.get('error') or result['answer'].startswith('❌') else 0
+        replayed.append(timings)
+        original.append({'total_ms': row['total_ms'], 'stages': json.loads(row['stages'] or '{}')})
+        if i % 50 == 0:
+            print(f"  已回放 {i}/{len(rows)}")
+
+    def summarize(items: List[Dict]) -> Dict:
+        stages: Dict[str, List[float]] = {}
+        for item in items:
+            for stage, ms in (item.get('stages') or {}).items():
+                stages.setdefault(stage, []).append(ms)
+        result = {stage: distribution(values) for stage, values in stages.items()}
+        if not args.retrieval_only:
+            result['total'] = distribution([item.get('total_ms') for item in items])
+        return result
+
+    config = {name: getattr(args, name) for name in (
+        'vector_store_path', 'index_cache_size', 'neighbor_chunks', 'context_chars',
+        'paper_top_n', 'hierarchical_min_papers', 'k', 'retrieval_only'
+    )}
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'library_id': library_id,
+        'queries': len(rows),
+        'errors': errors,
+        'config': config,
+        'replayed': summarize(replayed),
+        'original': summarize(original),
+        'index_cache': {k: v for k, v in rag.runtime_stats().items() if k.startswith('index_cache')}
+    }
+
+
+def print_replay(result: Dict):
+    print(f"\n🔁 回放 {result['library_id']}: {result['queries']} 个问题，错误 {result['errors']}")
+    print(f"  配置: {json.dumps({k: v for k, v in result['config'].items() if v is not None}, ensure_ascii=False)}")
+    print(f"\n  {'阶段':<20}{'原始p50':>10}{'回放p50':>10}{'原始p99':>10}{'回放p99':>10}")
+    for stage, dist in result['replayed'].items():
+        before = result['original'].get(stage, {})
+        print(f"  {stage:<20}{before.get('p50_ms', '-'):>10}{dist.get('p50_ms', '-'):>10}"
+              f"{before.get('p99_ms', '-'):>10}{dist.get('p99_ms', '-'):>10}")
+    print(f"\n  索引缓存: {json.dumps(result['index_cache'])}")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="查询日志分析与回放")
+    parser.add_argument('--logs-dir', default=str(Config.LOGS_DIR), help="查询日志目录")
+    parser.add_argument('--db', help="索引数据库路径（默认 <logs-dir>/query_index.sqlite）")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('index', help="增量导入查询日志")
+
+    report_parser = commands.add_parser('report', help="高频问题、延迟分布与答案缓存潜在命中率")
+    report_parser.add_argument('--library', help="文库ID（默认全部文库）")
+    report_parser.add_argument('--top', type=int, default=10, help="显示的高频问题数")
+    report_parser.add_argument('--since', help="只统计该时间之后的查询（ISO格式，如 2025-11-01）")
+    report_parser.add_argument('--ttl', type=float, help="估算答案缓存命中率时的缓存有效期（秒）")
+    report_parser.add_argument('--json', action='store_true', help="输出JSON")
+
+    replay_parser = commands.add_parser('replay', help="用不同的索引/缓存配置回放日志中的问题")
+    replay_parser.add_argument('--library', required=True, help="文库ID")
+    replay_parser.add_argument('--since', help="只回放该时间之后的查询")
+    replay_parser.add_argument('--limit', type=int, help="最多回放的问题数")
+    replay_parser.add_argument('--distinct', action='store_true', help="相同问题只回放一次")
+    replay_parser.add_argument('--retrieval-only', action='store_true', help="只回放检索，不调用LLM")
+    replay_parser.add_argument('--vector-store-path', help="使用其他向量数据库目录（如新配置构建的索引）")
+    replay_parser.add_argument('--index-cache-size', type=int, help="覆盖 RAG_INDEX_CACHE_SIZE")
+    replay_parser.add_argument('--neighbor-chunks', type=int, help="覆盖 RAG_NEIGHBOR_CHUNKS")
+    replay_parser.add_argument('--context-chars', type=int, help="覆盖 RAG_CONTEXT_CHARS")
+    replay_parser.add_argument('--paper-top-n', type=int, help="覆盖 RAG_PAPER_TOP_N")
+    replay_parser.add_argument('--hierarchical-min-papers', type=int, help="覆盖 RAG_HIERARCHICAL_MIN_PAPERS")
+    replay_parser.add_argument('--k', type=int, default=4, help="每次检索的文本块数")
+    replay_parser.add_argument('--output', help="结果保存路径（JSON）")
+    args = parser.parse_args(argv)
+
+    logs_dir = Path(args.logs_dir)
+    index = QueryLogIndex(Path(args.db) if args.db else logs_dir / "query_index.sqlite")
+    try:
+        # 每次分析前先增量导入，保证统计包含最新的查询
+        added = index.ingest_dir(logs_dir)
+        if args.command == 'index':
+            for name, count in added.items():
+                print(f"  📥 {name}: {count} 条")
+            print(f"✅ 导入完成，新增 {sum(added.values())} 条记录")
+            return 0
+
+        if args.command == 'report':
+            libraries = [args.library] if args.library else index.libraries()
+            reports = [index.report(library_id, args.top, args.since, args.ttl) for library_id in libraries]
+            if args.json:
+                print(json.dumps(reports, ensure_ascii=False, indent=2))
+            else:
+                for report in reports:
+                    print_report(report)
+            return 0
+
+        rows = index.queries(args.library, args.since)
+        if args.distinct:
+            seen, unique = set(), []
+            for row in rows:
+                key = (row['file_id'], row['question_key'])
+                if key not in seen:
+                    seen.add(key)
+                    unique.append(row)
+            rows = unique
+        rows = rows[:args.limit] if args.limit else rows
+        if not rows:
+            print(f"❌ 文库 {args.library} 没有可回放的查询")
+            return 1
+        result = replay(rows, args.library, args)
+        print_replay(result)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+            print(f"\n✅ 结果已保存到: {args.output}")
+        return 0
+    finally:
+        index.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,243 @@
+"""
+RAG查询日志
+请求线程只把记录放入有界队列，由唯一的后台写线程按文库路由到各自的JSONL文件，
+批量写入并在文件超过大小上限时轮转、gzip压缩和清理过期文件。
+每条记录只序列化、写入一次，开销与文库数量无关。
+多个worker进程写同一个文库的日志时，写入和轮转都持有该文库的文件锁，写入前核对缓存的文件句柄
+是否仍是当前路径上的文件（inode），已被其他进程轮转时重新打开，不会写进已改名或删除的文件。
+"""
+
+import gzip
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows：没有跨进程文件锁，只支持单进程写日志
+    fcntl = None
+
+
+class QueryLogWriter:
+    """单写线程的结构化查询日志"""
+
+    def __init__(self, logs_dir: Path, max_bytes: int = 10 * 1024 * 1024, retention_days: int = 30,
+                 queue_size: int = 10000, flush_interval: float = 1.0, batch_size: int = 500,
+                 max_open_files: int = 64):
+        """
+        Args:
+            logs_dir: 日志目录
+            max_bytes: 单个日志文件的大小上限，超过后轮转并压缩
+            retention_days: 轮转后的压缩文件保留天数
+            queue_size: 待写入记录的队列长度，队列满时丢弃新记录（不阻塞请求）
+            flush_interval: 后台线程最长等待多久写一批（秒）
+            batch_size: 每批最多写入的记录数
+            max_open_files: 同时保持打开的日志文件数（按最近使用淘汰）
+        """
+        self.logs_dir = Path(logs_dir)
+        self.max_bytes = max_bytes
+        self.retention_days = retention_days
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_open_files = max_open_files
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._files: "OrderedDict[str, object]" = OrderedDict()
+        self._thread: Optional[threading.Thread] = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._stats = {'written': 0, 'dropped': 0, 'rotations': 0, 'errors': 0}
+        self._stats_lock = threading.Lock()
+
+    def log_path(self, library_id: str) -> Path:
+        """文库当前的日志文件路径"""
+        return self.logs_dir / f"{library_id}_query.jsonl"
+
+    def _lock_path(self, library_id: str) -> Path:
+        return self.logs_dir / f".{library_id}_query.lock"
+
+    def _ensure_started(self):
+        # fork出的子进程（如多worker部署）需要重新启动自己的写线程
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._files = OrderedDict()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="query-log-writer", daemon=True)
+            self._thread.start()
+
+    def write(self, library_id: str, record: Dict) -> bool:
+        """
+        提交一条记录（非阻塞）
+
+        Returns:
+            是否成功入队；队列已满时丢弃并返回False
+        """
+        self._ensure_started()
+        record = dict(record)
+        record.setdefault('timestamp', datetime.now().isoformat(timespec='milliseconds'))
+        record.setdefault('library_id', library_id)
+        try:
+            self._queue.put_nowait((library_id, record))
+            return True
+        except queue.Full:
+            self._count('dropped')
+            return False
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """等待已提交的记录全部写入磁盘（用于退出前和测试）"""
+        if self._thread is None or self._pid != os.getpid():
+            return True
+        done = threading.Event()
+        try:
+            self._queue.put((None, done), timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def _count(self, key: str, amount: int = 1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def stats(self) -> Dict:
+        """写入统计"""
+        with self._stats_lock:
+            result = dict(self._stats)
+        result['queued'] = self._queue.qsize()
+        return result
+
+    def _run(self):
+        while True:
+            batch = []
+            try:
+                batch.append(self._queue.get(timeout=self.flush_interval))
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write_batch(batch)
+
+    def _write_batch(self, batch: List):
+        # 按文库分组，每个文件每批只写一次
+        grouped: "OrderedDict[str, List[str]]" = OrderedDict()
+        waiters = []
+        for library_id, record in batch:
+            if library_id is None:
+                waiters.append(record)
+                continue
+            try:
+                line = json.dumps(record, ensure_ascii=False, default=str)
+            except Exception as e:
+                self._count('errors')
+                print(f"⚠️ 查询日志序列化失败: {str(e)}")
+                continue
+            grouped.setdefault(library_id, []).append(line)
+
+        for library_id, lines in grouped.items():
+            try:
+                rotated = None
+                with self._locked(library_id):
+                    f = self._open(library_id)
+                    f.write("\n".join(lines) + "\n")
+                    f.flush()
+                    self._count('written', len(lines))
+                    if os.fstat(f.fileno()).st_size >= self.max_bytes:
+                        rotated = self._rotate(library_id)
+                # 改名后其他进程不会再写入该文件，压缩可以在锁外进行
+                if rotated is not None:
+                    self._compress(library_id, rotated)
+            except Exception as e:
+                self._count('errors')
+                print(f"⚠️ 写入查询日志失败 ({library_id}): {str(e)}")
+
+        for done in waiters:
+            done.set()
+
+    def _locked(self, library_id: str):
+        """持有文库日志的跨进程锁（写入与轮转互斥）"""
+        return _FileLock(self._lock_path(library_id))
+
+    def _open(self, library_id: str):
+        """打开文库当前的日志文件（需持有文库日志的锁）；缓存的句柄已被其他进程轮转时重新打开"""
+        path = self.log_path(library_id)
+        f = self._files.get(library_id)
+        if f is not None:
+            try:
+                current = os.stat(path)
+                cached = os.fstat(f.fileno())
+                if (current.st_ino, current.st_dev) == (cached.st_ino, cached.st_dev):
+                    self._files.move_to_end(library_id)
+                    return f
+            except FileNotFoundError:
+                pass
+            del self._files[library_id]
+            f.close()
+        self.logs_dir.mkdir(parents=True, exist_ok=True)
+        f = open(path, 'a', encoding='utf-8')
+        self._files[library_id] = f
+        while len(self._files) > self.max_open_files:
+            _, oldest = self._files.popitem(last=False)
+            oldest.close()
+        return f
+
+    def _rotate(self, library_id: str) -> Path:
+        """把当前日志文件改名为 {library_id}_query.{时间}.{pid}.jsonl（需持有文库日志的锁），返回改名后的路径"""
+        f = self._files.pop(library_id, None)
+        if f is not None:
+            f.close()
+        path = self.log_path(library_id)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        rotated = path.with_name(f"{library_id}_query.{stamp}.{os.getpid()}.jsonl")
+        os.replace(path, rotated)
+        self._count('rotations')
+        return rotated
+
+    def _compress(self, library_id: str, rotated: Path):
+        """压缩轮转出的文件为 .jsonl.gz 并清理过期的压缩文件"""
+        with open(rotated, 'rb') as src, gzip.open(f"{rotated}.gz", 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        rotated.unlink()
+        self._cleanup(library_id)
+
+    def _cleanup(self, library_id: str):
+        if self.retention_days <= 0:
+            return
+        cutoff = time.time() - self.retention_days * 86400
+        for archived in self.logs_dir.glob(f"{library_id}_query.*.jsonl.gz"):
+            try:
+                if archived.stat().st_mtime < cutoff:
+                    archived.unlink()
+            except OSError:
+                pass
+
+
+class _FileLock:
+    """基于flock的跨进程互斥锁（没有fcntl时不加锁）"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._fd = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._fd = os.open(self.path, os.O_CREAT | os.O_RDWR, 0o644)
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
@@ -0,0 +1,189 @@
+"""
+MinerU解析结果的内容寻址存储
+上传时边写盘边计算SHA-256，解析成功后把结果目录以 (文件哈希, OCR, 公式, 表格, 语言, 布局模型, 模型版本) 为键
+硬链接进存储；再次上传内容和参数都相同的文件时，直接把已有结果硬链接（无法硬链接时复制）到目标文库，
+不再调用MinerU。存储中的文件只读共享，各文档自己的信息文件和派生索引不进入存储
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import BinaryIO, Dict, Optional, Tuple
+
+from image_variants import VARIANTS_DIRNAME
+from outline import OUTLINE_FILENAME
+
+CHUNK_SIZE = 1024 * 1024
+MANIFEST_FILENAME = 'manifest.json'
+CONTENT_DIRNAME = 'content'
+# 每个文档各自的信息文件（会被原地改写）和派生索引，不进入存储，也不从存储链接出去
+EXCLUDED_NAMES = {'filename_info.json', 'metadata.json', OUTLINE_FILENAME, VARIANTS_DIRNAME}
+
+
+def save_with_hash(stream: BinaryIO, path: Path) -> Tuple[str, int]:
+    """
+    把上传流写入文件，同时计算SHA-256（先写临时文件再重命名，不会留下半个文件）
+
+    Returns:
+        (十六进制哈希, 字节数)
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, 'wb') as f:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            tmp_path.unlink()
+        except OSError:
+            pass
+        raise
+    return digest.hexdigest(), size
+
+
+def result_key(file_hash: str, is_ocr: bool, enable_formula: bool, enable_table: bool,
+               language: str, layout_model: str, model_version: str) -> str:
+    """解析结果的存储键：文件内容和所有传给MinerU、影响解析结果的参数"""
+    payload = json.dumps([file_hash, bool(is_ocr), bool(enable_formula), bool(enable_table),
+                          language or '', layout_model or '', model_version or ''], separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def link_tree(src: Path, dst: Path) -> Dict[str, int]:
+    """
+    用硬链接复制目录树（跳过 EXCLUDED_NAMES），跨文件系统等无法硬链接时复制文件
+
+    Returns:
+        {'linked': 硬链接的文件数, 'copied': 复制的文件数}
+    """
+    counts = {'linked': 0, 'copied': 0}
+    src = Path(src)
+    dst = Path(dst)
+    for root, dirs, files in os.walk(src):
+        dirs[:] = [name for name in dirs if name not in EXCLUDED_NAMES]
+        target_root = dst / Path(root).relative_to(src)
+        target_root.mkdir(parents=True, exist_ok=True)
+        for name in files:
+            if name in EXCLUDED_NAMES or name.endswith('.tmp'):
+                continue
+            source_file = os.path.join(root, name)
+            target_file = target_root / name
+            try:
+                os.link(source_file, target_file)
+                counts['linked'] += 1
+            except OSError:
+                shutil.copy2(source_file, target_file)
+                counts['copied'] += 1
+    return counts
+
+
+class ResultStore:
+    """按键保存解析结果目录，条目写完后整体重命名，读到的条目总是完整的"""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self._stats = {'hits': 0, 'misses': 0, 'stored': 0}
+        self._stats_lock = threading.Lock()
+
+    def entry_dir(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def lookup(self, key: str) -> Optional[Dict]:
+        """查找条目，返回其manifest（不存在时返回None）"""
+        try:
+            with open(self.entry_dir(key) / MANIFEST_FILENAME, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            self._count('misses')
+            return None
+        self._count('hits')
+        return manifest
+
+    def put(self, key: str, content_dir: Path, info: Optional[Dict] = None) -> bool:
+        """
+        把解析结果的内容目录存入存储（已存在时不覆盖）
+
+        Args:
+            key: result_key() 生成的键
+            content_dir: 含markdown和images的内容目录
+            info: 写入manifest的附加信息（文件哈希、解析参数等）
+
+        Returns:
+            是否新存入
+        """
+        entry = self.entry_dir(key)
+        if (entry / MANIFEST_FILENAME).exists():
+            return False
+        tmp_entry = self.root / 'tmp' / f"{key}.{uuid.uuid4().hex}"
+        try:
+            counts = link_tree(content_dir, tmp_entry / CONTENT_DIRNAME)
+            manifest = dict(info or {})
+            manifest.update({
+                'key': key,
+                'files': counts['linked'] + counts['copied'],
+                'stored_at': time.time()
+            })
+            with open(tmp_entry / MANIFEST_FILENAME, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+            entry.parent.mkdir(parents=True, exist_ok=True)
+            # 并发存入同一个键时只有一个重命名成功
+            os.rename(tmp_entry, entry)
+        except OSError as e:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            if not (entry / MANIFEST_FILENAME).exists():
+                print(f"⚠️ 解析结果存入失败 ({key[:12]}): {str(e)}")
+            return False
+        self._count('stored')
+        return True
+
+    def materialize(self, key: str, target_dir: Path, filename_info: Optional[Dict] = None) -> bool:
+        """
+        把条目的内容链接到目标目录（目标目录不能已存在）
+
+        Args:
+            key: 条目的键
+            target_dir: 文库下新文件的目录
+            filename_info: 写入目标目录 filename_info.json 的文档信息
+
+        Returns:
+            是否成功，条目不存在时返回False
+        """
+        source = self.entry_dir(key) / CONTENT_DIRNAME
+        if not source.is_dir():
+            return False
+        target_dir = Path(target_dir)
+        # temp_ 前缀的目录不会被文库目录重建扫描到
+        tmp_target = target_dir.with_name(f"temp_{target_dir.name}_{uuid.uuid4().hex[:8]}")
+        try:
+            link_tree(source, tmp_target)
+            if filename_info is not None:
+                with open(tmp_target / 'filename_info.json', 'w', encoding='utf-8') as f:
+                    json.dump(filename_info, f, ensure_ascii=False, indent=2)
+            os.rename(tmp_target, target_dir)
+        except OSError as e:
+            shutil.rmtree(tmp_target, ignore_errors=True)
+            print(f"⚠️ 复用解析结果失败 ({key[:12]}): {str(e)}")
+            return False
+        return True
+
+    def _count(self, key: str):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return dict(self._stats)
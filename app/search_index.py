@@ -0,0 +1,393 @@
+"""
+文库全文检索（SQLite FTS5）
+把每篇文档的 full.md 按段落切块建立倒排索引，中日韩文字按"相邻两字+末字"切分，
+英文等按单词切分，查询时不调用大模型，直接返回按BM25排序的命中、高亮片段和字符偏移；
+上传处理完成和删除文件时增量更新，索引可随时从文库目录重建
+
+用法:
+    python app/search_index.py rebuild [--force]
+"""
+
+import re
+import sys
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    library_id TEXT NOT NULL,
+    file_id TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    md_path TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    indexed_at REAL NOT NULL,
+    PRIMARY KEY (library_id, file_id)
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    id INTEGER PRIMARY KEY,
+    library_id TEXT NOT NULL,
+    file_id TEXT NOT NULL,
+    char_start INTEGER NOT NULL,
+    byte_start INTEGER NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_chunks_file ON chunks(library_id, file_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(tokens, library_key, tokenize = 'unicode61 remove_diacritics 2');
+"""
+
+# 每块的目标字符数（在段落边界切分）
+CHUNK_CHARS = 800
+# 片段在命中位置前后保留的字符数
+SNIPPET_CONTEXT = 60
+
+_CJK = (r'぀-ヿ㐀-䶿一-鿿가-힯豈-﫿')
+_UNIT_PATTERN = re.compile(rf'[{_CJK}]+|[^\W_{_CJK}]+')
+_CJK_RUN = re.compile(rf'[{_CJK}]+')
+_PARAGRAPH_BREAK = re.compile(r'\n[ \t]*\n')
+
+
+def _cjk_tokens(run: str) -> List[str]:
+    """中日韩文字切分为相邻两字，再加末字（单字查询可前缀匹配任意位置的字）"""
+    if len(run) == 1:
+        return [run]
+    return [run[i:i + 2] for i in range(len(run) - 1)] + [run[-1]]
+
+
+def tokenize(text: str) -> List[str]:
+    """索引用的词序列（小写）"""
+    tokens = []
+    for unit in _UNIT_PATTERN.findall(text.lower()):
+        if _CJK_RUN.fullmatch(unit):
+            tokens.extend(_cjk_tokens(unit))
+        else:
+            tokens.append(unit)
+    return tokens
+
+
+def library_key(library_id: str) -> str:
+    """文库ID对应的单个索引词（文库ID中的符号会被分词器切开）"""
+    return 'lib' + hashlib.sha1(library_id.encode('utf-8')).hexdigest()[:16]
+
+
+def parse_query(query: str) -> Tuple[Optional[str], List[re.Pattern]]:
+    """
+    把查询转换为FTS5表达式和用于定位高亮的正则
+
+    空白分隔的每一组作为一个短语（各组之间为AND）；中文短语匹配连续的两字词，
+    单个汉字按前缀匹配
+
+    Returns:
+        (FTS5表达式, 高亮正则列表)，查询中没有可检索的字词时表达式为None
+    """
+    phrases, patterns = [], []
+    for group in query.split():
+        units = _UNIT_PATTERN.findall(group.lower())
+        if not units:
+            continue
+        tokens, pieces = [], []
+        for unit in units:
+            if _CJK_RUN.fullmatch(unit):
+                tokens.extend([unit[i:i + 2] for i in range(len(unit) - 1)] or [unit])
+                pieces.extend(unit)
+            else:
+                tokens.append(unit)
+                pieces.append(unit)
+        if len(tokens) == 1 and len(tokens[0]) == 1 and _CJK_RUN.fullmatch(tokens[0]):
+            phrases.append(f'"{tokens[0]}" *')
+        else:
+            phrases.append('"' + ' '.join(tokens) + '"')
+        patterns.append(re.compile(r'[\W_]*'.join(re.escape(p) for p in pieces), re.IGNORECASE))
+    if not phrases:
+        return None, []
+    return ' AND '.join(phrases), patterns
+
+
+def split_chunks(text: str, chunk_chars: int = CHUNK_CHARS) -> List[Tuple[int, int, str]]:
+    """
+    在段落边界把文档切成约chunk_chars字符的块
+
+    Returns:
+        [(字符偏移, 字节偏移, 块文本)]
+    """
+    chunks = []
+    start = 0
+    byte_start = 0
+    length = len(text)
+    while start < length:
+        end = min(start + chunk_chars, length)
+        if end < length:
+            match = _PARAGRAPH_BREAK.search(text, end)
+            end = match.end() if match and match.end() - start <= chunk_chars * 4 else min(start + chunk_chars * 4, length)
+        chunk = text[start:end]
+        if chunk.strip():
+            chunks.append((start, byte_start, chunk))
+        byte_start += len(chunk.encode('utf-8'))
+        start = end
+    return chunks
+
+
+def make_snippet(text: str, patterns: List[re.Pattern], context: int = SNIPPET_CONTEXT) -> Dict:
+    """
+    在块中定位第一个命中，截取前后context个字符的片段
+
+    Returns:
+        {'snippet', 'highlights': [[开始, 结束], ...]（相对片段）, 'match_start'（相对块）}
+    """
+    first = None
+    for pattern in patterns:
+        match = pattern.search(text)
+        if match and (first is None or match.start() < first.start()):
+            first = match
+    center = first.start() if first else 0
+    begin = max(center - context, 0)
+    end = min((first.end() if first else 0) + context, len(text))
+    # 片段内所有命中都高亮
+    highlights = []
+    for pattern in patterns:
+        for match in pattern.finditer(text, begin, end):
+            if match.end() > match.start():
+                highlights.append([match.start() - begin, match.end() - begin])
+    highlights.sort()
+    snippet = text[begin:end]
+    return {
+        'snippet': ('…' if begin > 0 else '') + snippet + ('…' if end < len(text) else ''),
+        'highlights': [[s + (1 if begin > 0 else 0), e + (1 if begin > 0 else 0)] for s, e in highlights],
+        'match_start': center
+    }
+
+
+class SearchIndex:
+    """文库全文检索索引"""
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        """每个线程一个连接（WAL模式下读不阻塞写）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ---------- 更新 ----------
+
+    def index_file(self, library_id: str, file_id: str, md_file: Path, filename: str = '', force: bool = False) -> bool:
+        """
+        索引一篇文档（markdown未修改时跳过）
+
+        Returns:
+            是否重新建立了索引
+        """
+        md_file = Path(md_file)
+        stat = md_file.stat()
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT mtime_ns, size, md_path FROM documents WHERE library_id = ? AND file_id = ?",
+            (library_id, file_id)
+        ).fetchone()
+        if (not force and row is not None and row['mtime_ns'] == stat.st_mtime_ns
+                and row['size'] == stat.st_size and row['md_path'] == str(md_file)):
+            return False
+
+        # 分块和分词在锁外完成，写事务只做插入
+        with open(md_file, 'r', encoding='utf-8', errors='replace') as f:
+            text = f.read()
+        chunks = split_chunks(text)
+        key = library_key(library_id)
+        rows = [(char_start, byte_start, chunk, ' '.join(tokenize(chunk))) for char_start, byte_start, chunk in chunks]
+
+        with self._write_lock, conn:
+            self._delete_file(conn, library_id, file_id)
+            for char_start, byte_start, chunk, tokens in rows:
+                cursor = conn.execute(
+                    "INSERT INTO chunks (library_id, file_id, char_start, byte_start, text) VALUES (?, ?, ?, ?, ?)",
+                    (library_id, file_id, char_start, byte_start, chunk)
+                )
+                conn.execute(
+                    "INSERT INTO chunks_fts (rowid, tokens, library_key) VALUES (?, ?, ?)",
+                    (cursor.lastrowid, tokens, key)
+                )
+            conn.execute(
+                """INSERT OR REPLACE INTO documents (library_id, file_id, filename, md_path, mtime_ns, size, indexed_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (library_id, file_id, filename or md_file.stem, str(md_file), stat.st_mtime_ns, stat.st_size, time.time())
+            )
+        return True
+
+    @staticmethod
+    def _delete_file(conn: sqlite3.Connection, library_id: str, file_id: str):
+        conn.execute(
+            "DELETE FROM chunks_fts WHERE rowid IN (SELECT id FROM chunks WHERE library_id = ? AND file_id = ?)",
+            (library_id, file_id)
+        )
+        conn.execute("DELETE FROM chunks WHERE library_id = ? AND file_id = ?", (library_id, file_id))
+        conn.execute("DELETE FROM documents WHERE library_id = ? AND file_id = ?", (library_id, file_id))
+
+    def remove_file(self, library_id: str, file_id: str):
+        """删除一篇文档的索引"""
+        conn = self._conn()
+        with self._write_lock, conn:
+            self._delete_file(conn, library_id, file_id)
+
+    def remove_library(self, library_id: str):
+        """删除整个文库的索引"""
+        conn = self._conn()
+        with self._write_lock, conn:
+            conn.execute(
+                "DELETE FROM chunks_fts WHERE rowid IN (SELECT id FROM chunks WHERE library_id = ?)",
+                (library_id,)
+            )
+            conn.execute("DELETE FROM chunks WHERE library_id = ?", (library_id,))
+            conn.execute("DELETE FROM documents WHERE library_id = ?", (library_id,))
+
+    def indexed_files(self, library_id: Optional[str] = None) -> Dict[Tuple[str, str], str]:
+        """已索引的文档: (library_id, file_id) -> markdown路径"""
+        sql = "SELECT library_id, file_id, md_path FROM documents"
+        params = ()
+        if library_id is not None:
+            sql += " WHERE library_id = ?"
+            params = (library_id,)
+        return {(row['library_id'], row['file_id']): row['md_path'] for row in self._conn().execute(sql, params)}
+
+    def sync(self, files: Iterable[Tuple[str, str, Path, str]], library_id: Optional[str] = None,
+             force: bool = False) -> Dict[str, int]:
+        """
+        按文件列表同步索引：新增/修改的文档重新索引，列表中没有的文档删除
+
+        Args:
+            files: [(library_id, file_id, markdown路径, 原始文件名)]
+            library_id: 只同步该文库（None表示全部）
+            force: 忽略修改时间，全部重新索引
+        """
+        counts = {'indexed': 0, 'unchanged': 0, 'removed': 0, 'failed': 0}
+        seen = set()
+        for lib_id, file_id, md_file, filename in files:
+            seen.add((lib_id, file_id))
+            try:
+                if self.index_file(lib_id, file_id, md_file, filename, force=force):
+                    counts['indexed'] += 1
+                else:
+                    counts['unchanged'] += 1
+            except Exception as e:
+                counts['failed'] += 1
+                print(f"⚠️ 索引文档失败 ({lib_id}/{file_id}): {str(e)}")
+        for lib_id, file_id in set(self.indexed_files(library_id)) - seen:
+            self.remove_file(lib_id, file_id)
+            counts['removed'] += 1
+        return counts
+
+    # ---------- 查询 ----------
+
+    def search(self, library_id: str, query: str, limit: int = 20, offset: int = 0,
+               file_id: Optional[str] = None) -> Dict:
+        """
+        在文库中检索
+
+        Args:
+            library_id: 文库ID
+            query: 查询（空白分隔的多个词须同时出现，引号可省略）
+            limit/offset: 分页
+            file_id: 只检索该文档
+
+        Returns:
+            {'total', 'hits': [{file_id, filename, score, offset, byte_offset, snippet, highlights}]}，
+            offset/byte_offset为命中位置在markdown中的字符/字节偏移
+        """
+        expression, patterns = parse_query(query)
+        if expression is None:
+            return {'total': 0, 'hits': []}
+
+        conn = self._conn()
+        match = f'library_key : {library_key(library_id)} AND tokens : ({expression})'
+        where = "chunks_fts MATCH ?"
+        params: list = [match]
+        if file_id is not None:
+            where += " AND c.file_id = ?"
+            params.append(file_id)
+
+        total = conn.execute(
+            f"SELECT COUNT(*) FROM chunks_fts JOIN chunks c ON c.id = chunks_fts.rowid WHERE {where}", params
+        ).fetchone()[0]
+        rows = conn.execute(
+            f"""SELECT c.file_id, c.char_start, c.byte_start, c.text, d.filename,
+                       bm25(chunks_fts, 1.0, 0.0) AS score
+                FROM chunks_fts
+                JOIN chunks c ON c.id = chunks_fts.rowid
+                LEFT JOIN documents d ON d.library_id = c.library_id AND d.file_id = c.file_id
+                WHERE {where}
+                ORDER BY score
+                LIMIT ? OFFSET ?""",
+            params + [limit, offset]
+        ).fetchall()
+
+        hits = []
+        for row in rows:
+            snippet = make_snippet(row['text'], patterns)
+            prefix = row['text'][:snippet['match_start']]
+            hits.append({
+                'file_id': row['file_id'],
+                'filename': row['filename'],
+                # bm25越小越相关，取反后越大越相关
+                'score': round(-row['score'], 4),
+                'offset': row['char_start'] + snippet['match_start'],
+                'byte_offset': row['byte_start'] + len(prefix.encode('utf-8')),
+                'snippet': snippet['snippet'],
+                'highlights': snippet['highlights']
+            })
+        return {'total': total, 'hits': hits}
+
+    def stats(self) -> Dict[str, int]:
+        conn = self._conn()
+        return {
+            'documents': conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0],
+            'chunks': conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+        }
+
+
+def catalog_files(catalog, library_id: Optional[str] = None) -> List[Tuple[str, str, Path, str]]:
+    """从文库目录列出需要索引的文档: [(library_id, file_id, markdown路径, 原始文件名)]"""
+    files = []
+    for record in catalog.list_files(library_id, markdown_only=True):
+        content_dir = catalog.libraries_dir / record['library_id'] / record['content_dir']
+        md_files = list(content_dir.glob("*.md"))
+        if md_files:
+            files.append((record['library_id'], record['file_id'], md_files[0], record['filename']))
+    return files
+
+
+def main(argv: Optional[List[str]] = None):
+    import argparse
+    from config import Config
+    from catalog import LibraryCatalog
+
+    parser = argparse.ArgumentParser(description="文库全文检索索引")
+    parser.add_argument('command', choices=['rebuild'], help="rebuild: 按文库目录同步索引")
+    parser.add_argument('--force', action='store_true', help="忽略修改时间，全部重新索引")
+    args = parser.parse_args(argv)
+
+    catalog = LibraryCatalog(Config.CATALOG_DB_PATH, Config.OUTPUT_DIR / 'libraries')
+    index = SearchIndex(Config.SEARCH_INDEX_DB_PATH)
+    start = time.perf_counter()
+    counts = index.sync(catalog_files(catalog), force=args.force)
+    print(f"✅ 索引同步完成: 新建 {counts['indexed']}，未变 {counts['unchanged']}，"
+          f"删除 {counts['removed']}，失败 {counts['failed']}（{time.perf_counter() - start:.2f}s）")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
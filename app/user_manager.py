@@ -239,6 +239,7 @@ def get_user_manager() -> UserManager:
     """获取全局用户管理器实例"""
     global _user_manager
     if _user_manager is None:
-        _user_manager = UserManager()
+        data_dir = os.environ.get('DATA_DIR')
+        _user_manager = UserManager(str(Path(data_dir) / "users.txt")) if data_dir else UserManager()
     return _user_manager
 
@@ -90,10 +90,14 @@ export const getLibraryFilesUrl = (libraryId) =>
   `${API_BASE_URL}/api/libraries/${libraryId}/files`;
 export const getLibraryFileContentUrl = (libraryId, fileId) =>
   `${API_BASE_URL}/api/libraries/${libraryId}/files/${fileId}/content`;
+export const getLibraryFileSectionsUrl = (libraryId, fileId) =>
+  `${API_BASE_URL}/api/libraries/${libraryId}/files/${fileId}/sections`;
 export const getLibraryFileProcessUrl = (libraryId, fileId) =>
   `${API_BASE_URL}/api/libraries/${libraryId}/files/${fileId}/process`;
 export const getLibraryImageUrl = (libraryId, fileId, imagePath) =>
   `${API_BASE_URL}/api/libraries/${libraryId}/files/${fileId}/images/${imagePath}`;
+export const getRelatedPapersUrl = (libraryId, fileId) =>
+  `${API_BASE_URL}/api/libraries/${libraryId}/files/${fileId}/related`;
 
 // 文库管理API函数
 export const getLibraries = async () => {
@@ -117,9 +121,10 @@ export const createLibrary = async (libraryData) => {
 };
 
 // 文件管理API函数
-export const getFiles = async (libraryId) => {
+// params: { limit, cursor, sort, order, prefix }（游标分页，见后端列表接口说明）
+export const getFiles = async (libraryId, params = {}) => {
   try {
-    const response = await axios.get(getLibraryFilesUrl(libraryId));
+    const response = await axios.get(getLibraryFilesUrl(libraryId), { params });
     return response;
   } catch (error) {
     console.error("获取文件列表失败:", error);
@@ -139,6 +144,39 @@ export const getLibraryFileContent = async (libraryId, fileId) => {
   }
 };
 
+// 分段获取文件内容（offset为字节偏移，withToc为false时不返回目录）
+export const getLibraryFileSections = async (
+  libraryId,
+  fileId,
+  { offset = 0, limit, withToc = true } = {}
+) => {
+  try {
+    const params = { offset };
+    if (limit) params.limit = limit;
+    if (!withToc) params.toc = 0;
+    const response = await axios.get(
+      getLibraryFileSectionsUrl(libraryId, fileId),
+      { params }
+    );
+    return response;
+  } catch (error) {
+    console.error("获取分段内容失败:", error);
+    throw error;
+  }
+};
+
+export const getRelatedPapers = async (libraryId, fileId, limit = 10) => {
+  try {
+    const response = await axios.get(getRelatedPapersUrl(libraryId, fileId), {
+      params: { limit },
+    });
+    return response;
+  } catch (error) {
+    console.error("获取相关论文失败:", error);
+    throw error;
+  }
+};
+
 // 文件上传API函数
 export const uploadFiles = async (formData) => {
   try {
@@ -154,6 +192,17 @@ export const uploadFiles = async (formData) => {
   }
 };
 
+// 解析任务状态（上传后按任务ID轮询进度）
+export const getIngestJob = async (jobId) => {
+  try {
+    const response = await axios.get(`${API_BASE_URL}/api/jobs/${jobId}`);
+    return response;
+  } catch (error) {
+    console.error("获取解析任务状态失败:", error);
+    throw error;
+  }
+};
+
 // 删除文件API函数
 export const deleteFile = async (libraryId, fileId) => {
   try {